@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Pos Demo - Pharmacy Point of Sale',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'category': 'Point of Sale',
     'summary': 'Comprehensive Pharmacy POS for Kenyan pharmacies with prescription management, insurance claims, and PPB compliance',
     'description': """
@@ -46,11 +46,15 @@
         'security/ir.model.access.csv',
         
         # Data
+        'data/cache_generation.xml',
         'data/product_categories.xml',
         'data/drug_schedules.xml',
         'data/insurance_providers.xml',
         'data/sequence.xml',
         'data/payment_methods.xml',
+        'data/ir_cron.xml',
+        'data/stock_locations.xml',
+        'data/pharmacy_ingredients.xml',
         # 'data/pos_config_data.xml',  # Install chart of accounts first, then uncomment and upgrade
         'data/test_data_kenya.xml',
         
@@ -63,7 +67,16 @@
         'views/controlled_drugs_views.xml',
         'views/res_partner_views.xml',
         'views/accounting_views.xml',
+        'views/mpesa_views.xml',
+        'views/etr_views.xml',
         'views/reports_menu.xml',
+        'views/controlled_drugs_archive_views.xml',
+        'views/pos_order_archive_views.xml',
+        'views/report_job_views.xml',
+        'views/insurance_claim_export_views.xml',
+        'views/lot_valuation_views.xml',
+        'views/branch_stock_views.xml',
+        'views/ingredient_views.xml',
         'views/demo_data_views.xml',
         
         # Reports
@@ -71,10 +84,17 @@
         'reports/controlled_drugs_report.xml',
         'reports/ppb_returns.xml',
         'reports/insurance_claims_report.xml',
+        'reports/session_totals_report.xml',
         
         # Wizards
         # 'wizard/prescription_wizard_views.xml',  # Temporarily disabled
         'wizard/insurance_claim_wizard_views.xml',
+        'wizard/mpesa_statement_import_views.xml',
+        'wizard/insurance_invoice_batch_views.xml',
+        'wizard/insurance_remittance_import_views.xml',
+        'wizard/reorder_planner_views.xml',
+        'wizard/expiry_writeoff_views.xml',
+        'wizard/index_advisor_views.xml',
     ],
     'assets': {
         'point_of_sale.assets': [
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from odoo import http
 from odoo.http import request
+import json
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -15,31 +16,31 @@ class PharmacyPOSController(http.Controller):
         
         Args:
             member_number: Insurance member/policy number
-            provider_id: Insurance provider ID
+            provider_id: Insurance provider ID or provider code
             
         Returns:
             dict: Eligibility status and coverage details
         """
         try:
-            provider = request.env['insurance.provider'].browse(provider_id)
+            provider = request.env['insurance.provider']._resolve_provider(provider_id)
             
-            if not provider.exists():
+            if not provider:
                 return {'error': 'Invalid insurance provider'}
             
             # TODO: Implement actual API integration based on provider
             # For now, return mock verification
             
-            if provider.claim_submission_method == 'api' and provider.api_endpoint:
+            if provider['claim_submission_method'] == 'api' and provider['api_endpoint']:
                 # API integration logic here
                 pass
             
             # Mock response
             return {
                 'eligible': True,
-                'coverage_percentage': provider.coverage_percentage,
-                'copay_percentage': provider.copay_percentage,
-                'requires_preauth': provider.requires_preauth,
-                'preauth_threshold': provider.preauth_threshold,
+                'coverage_percentage': provider['coverage_percentage'],
+                'copay_percentage': provider['copay_percentage'],
+                'requires_preauth': provider['requires_preauth'],
+                'preauth_threshold': provider['preauth_threshold'],
                 'member_name': 'Verified Member',
                 'valid_until': '2026-12-31',
             }
@@ -88,3 +89,195 @@ class PharmacyPOSController(http.Controller):
         except Exception as e:
             _logger.error(f"Patient history error: {str(e)}")
             return {'error': str(e)}
+    
+    @http.route('/pos_demo/insurance_expired', type='json', auth='user')
+    def get_insurance_expired(self, since):
+        """
+        Get members whose insurance lapsed since a date
+        
+        Args:
+            since: Date (YYYY-MM-DD) of the till's last refresh
+            
+        Returns:
+            dict: Compact partner payload for the POS cache
+        """
+        try:
+            partners = request.env['res.partner'].get_insurance_expired_since(since)
+            return {'partners': partners}
+            
+        except Exception as e:
+            _logger.error(f"Insurance expiry refresh error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/counter_search', type='json', auth='user')
+    def counter_search(self, query, limit=20):
+        """
+        Typeahead search of prescriptions and patients at the counter
+        
+        Args:
+            query: RX number, patient name, ID number or phone
+            limit: Maximum rows of each kind
+            
+        Returns:
+            dict: Compact prescription and patient rows, open prescriptions first
+        """
+        try:
+            return request.env['pharmacy.prescription'].counter_search(query, limit=limit)
+            
+        except Exception as e:
+            _logger.error(f"Counter search error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/allergy_profile', type='json', auth='user')
+    def get_allergy_profile(self, partner_id):
+        """
+        Get the products a patient is allergic to
+        
+        Args:
+            partner_id: Patient ID
+            
+        Returns:
+            dict: Conflicting ingredient and allergy per product ID
+        """
+        try:
+            return {'products': request.env['res.partner'].get_allergy_profile(partner_id)}
+            
+        except Exception as e:
+            _logger.error(f"Allergy profile error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/allergy_check', type='json', auth='user')
+    def check_allergies(self, partner_id, product_ids):
+        """
+        Check a whole cart against a patient's allergies
+        
+        Args:
+            partner_id: Patient ID
+            product_ids: Product IDs in the order
+            
+        Returns:
+            dict: List of conflicts (product, ingredient, allergy)
+        """
+        try:
+            return {'conflicts': request.env['res.partner'].check_allergy_conflicts(partner_id, product_ids)}
+            
+        except Exception as e:
+            _logger.error(f"Allergy check error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/branch_stock', type='json', auth='user')
+    def get_branch_stock(self, product_ids):
+        """
+        Get availability of products in every branch from the cached index
+        
+        Args:
+            product_ids: List of product.product IDs
+            
+        Returns:
+            dict: Lots and quantities per branch, keyed by product ID
+        """
+        try:
+            return {'products': request.env['pharmacy.branch.stock'].get_branch_availability(product_ids)}
+            
+        except Exception as e:
+            _logger.error(f"Branch stock lookup error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/lots/fefo', type='json', auth='user')
+    def get_fefo_lots(self, config_id, product_id):
+        """
+        Get sellable lots of a product, first to expire first
+        
+        Args:
+            config_id: POS config selling the product
+            product_id: Product ID
+            
+        Returns:
+            dict: Lots with their unreserved quantity
+        """
+        try:
+            return {'lots': request.env['pos.lot.reservation'].get_fefo_lots(config_id, product_id)}
+            
+        except Exception as e:
+            _logger.error(f"FEFO lot lookup error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/lots/reserve', type='json', auth='user')
+    def reserve_lot(self, config_id, line_uuid, lot_id, quantity):
+        """
+        Reserve lot quantity for an order line (quantity 0 releases it)
+        
+        Errors are not caught here: a serialisation failure must reach the
+        dispatcher so that the request is retried.
+        """
+        return request.env['pos.lot.reservation'].reserve(config_id, line_uuid, lot_id, quantity)
+    
+    @http.route('/pos_demo/lots/release', type='json', auth='user')
+    def release_lots(self, line_uuids):
+        """Release the lot reservations of removed order lines"""
+        return request.env['pos.lot.reservation'].release(line_uuids)
+    
+    @http.route('/pos_demo/lots/renew', type='json', auth='user')
+    def renew_lots(self, line_uuids):
+        """Extend the lot reservations of lines still open on the till
+        
+        Returns:
+            dict: uuids of lines whose reservation had already expired
+        """
+        return {'expired': request.env['pos.lot.reservation'].renew(line_uuids)}
+    
+    @http.route('/pos_demo/mpesa/stk_push', type='json', auth='user')
+    def mpesa_stk_push(self, config_id, amount, phone, reference=None):
+        """
+        Start an M-PESA STK push without waiting for the customer
+        
+        Args:
+            config_id: POS config starting the payment
+            amount: Amount to request
+            phone: Customer phone number
+            reference: Account reference shown to the customer
+            
+        Returns:
+            dict: Request id and initial status; the final status is sent
+            on the bus as MPESA_STK_RESULT
+        """
+        try:
+            return request.env['pos.mpesa.request'].create_stk_push(
+                config_id, amount, phone, reference=reference
+            )
+            
+        except Exception as e:
+            _logger.error(f"M-PESA STK push error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/mpesa/status', type='json', auth='user')
+    def mpesa_status(self, config_id, request_ids):
+        """
+        Get the current status of STK push requests (returns immediately)
+        
+        Args:
+            config_id: POS config that started the requests
+            request_ids: List of pos.mpesa.request IDs
+            
+        Returns:
+            dict: Status of each request
+        """
+        try:
+            return {'requests': request.env['pos.mpesa.request'].get_pos_status(config_id, request_ids)}
+            
+        except Exception as e:
+            _logger.error(f"M-PESA status error: {str(e)}")
+            return {'error': str(e)}
+    
+    @http.route('/pos_demo/mpesa/callback/<string:token>', type='http', auth='public',
+                methods=['POST'], csrf=False, save_session=False)
+    def mpesa_callback(self, token, **kwargs):
+        """Daraja STK push result callback"""
+        try:
+            data = json.loads(request.httprequest.get_data() or b'{}')
+            request.env['pos.mpesa.request'].sudo()._process_callback(token, data)
+            
+        except Exception as e:
+            _logger.error(f"M-PESA callback error: {str(e)}")
+        # Always acknowledge so Daraja does not keep retrying
+        return request.make_json_response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
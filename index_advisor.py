@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Pharmacy Index Advisor
+Reports missing pack indexes, unused indexes, sequentially scanned tables
+and the slowest statements (pg_stat_statements) on the pharmacy tables.
+
+Usage:
+    python3 index_advisor.py [--min-seq-scans 1000] [--statements 15] [--create-missing]
+"""
+
+import argparse
+import xmlrpc.client
+
+URL = "http://localhost:8069"
+DB = "pharmacy_kenya"
+USERNAME = "admin"
+PASSWORD = "admin"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-seq-scans', type=int, default=1000)
+    parser.add_argument('--statements', type=int, default=15)
+    parser.add_argument('--create-missing', action='store_true', help='Create missing pack indexes first')
+    args = parser.parse_args()
+
+    print("🔌 Connecting to Odoo...")
+    common = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/common')
+    uid = common.authenticate(DB, USERNAME, PASSWORD, {})
+    if not uid:
+        print("❌ Authentication failed!")
+        raise SystemExit(1)
+    models = xmlrpc.client.ServerProxy(f'{URL}/xmlrpc/2/object')
+
+    if args.create_missing:
+        wizard_id = models.execute_kw(DB, uid, PASSWORD, 'pharmacy.index.advisor', 'create', [{}])
+        models.execute_kw(DB, uid, PASSWORD, 'pharmacy.index.advisor', 'action_create_missing', [[wizard_id]])
+        print("✓ Missing pack indexes created")
+
+    report = models.execute_kw(DB, uid, PASSWORD, 'pharmacy.index.advisor', 'get_report',
+                               [args.min_seq_scans, args.statements])
+    print()
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Recompute the pharmacy invoice flag of historical moves in SQL"""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['account.move']._backfill_is_pharmacy_invoice()
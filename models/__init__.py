@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from . import cache_generation
+from . import ingredient
 from . import product_template
 from . import product_product
 from . import stock_lot
@@ -10,6 +12,19 @@ from . import pos_payment
 from . import res_partner
 from . import insurance_provider
 from . import insurance_claim
+from . import insurance_claim_export
 from . import controlled_drugs_register
+from . import controlled_drugs_archive
+from . import pos_order_archive
+from . import session_totals
+from . import report_job
 from . import pharmacy_demo_data
 from . import account_move
+from . import mpesa_request
+from . import etr_queue
+from . import lot_valuation
+from . import stock_move
+from . import stock_refresh
+from . import branch_stock
+from . import lot_reservation
+from . import index_pack
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
+from odoo.tools import split_every
+import logging
+
+_logger = logging.getLogger(__name__)
 
 
 class AccountMove(models.Model):
@@ -16,21 +20,113 @@ class AccountMove(models.Model):
         string='Insurance Claim',
         help='Link invoice to insurance claim'
     )
+    insurance_claim_ids = fields.One2many(
+        'insurance.claim',
+        'invoice_id',
+        string='Invoiced Claims',
+        help='Claims covered by this consolidated insurer invoice'
+    )
+    insurance_claim_count = fields.Integer(
+        string='Invoiced Claims Count',
+        compute='_compute_insurance_claim_count'
+    )
     is_pharmacy_invoice = fields.Boolean(
         string='Pharmacy Invoice',
         compute='_compute_is_pharmacy_invoice',
         store=True
     )
     
-    @api.depends('line_ids.product_id')
+    def _compute_insurance_claim_count(self):
+        """Count invoiced claims with one grouped query"""
+        counts = {
+            move.id: count
+            for move, count in self.env['insurance.claim']._read_group(
+                [('invoice_id', 'in', self.ids)],
+                groupby=['invoice_id'],
+                aggregates=['__count'],
+            )
+        }
+        for move in self:
+            move.insurance_claim_count = counts.get(move.id, 0)
+    
+    def action_view_insurance_claims(self):
+        """Open the claims covered by this invoice"""
+        self.ensure_one()
+        return {
+            'name': 'Invoiced Claims',
+            'type': 'ir.actions.act_window',
+            'res_model': 'insurance.claim',
+            'view_mode': 'list,form',
+            'domain': [('invoice_id', '=', self.id)],
+        }
+    
+    @api.depends('invoice_line_ids.product_id')
     def _compute_is_pharmacy_invoice(self):
-        """Check if invoice contains pharmaceutical products"""
+        """Check if invoice contains pharmaceutical products.
+        
+        Only product lines trigger the recompute, and saved moves are
+        resolved with one EXISTS query per batch instead of reading every
+        line (tax and receivable lines included).
+        """
+        saved = self.filtered(lambda move: isinstance(move.id, int))
+        pharmacy_ids = set()
+        if saved:
+            self.env['account.move.line'].flush_model(['move_id', 'product_id', 'display_type'])
+            self.env['product.product'].flush_model(['product_tmpl_id'])
+            self.env['product.template'].flush_model(['is_pharmaceutical'])
+            for move_ids in split_every(self.env.cr.IN_MAX, saved.ids):
+                self.env.cr.execute("""
+                    SELECT m.id
+                      FROM unnest(%s) AS m(id)
+                     WHERE EXISTS (
+                            SELECT 1
+                              FROM account_move_line l
+                              JOIN product_product p ON p.id = l.product_id
+                              JOIN product_template t ON t.id = p.product_tmpl_id
+                             WHERE l.move_id = m.id
+                               AND l.display_type = 'product'
+                               AND t.is_pharmaceutical
+                     )
+                """, [list(move_ids)])
+                pharmacy_ids.update(row[0] for row in self.env.cr.fetchall())
+        
         for move in self:
-            move.is_pharmacy_invoice = any(
-                line.product_id.is_pharmaceutical 
-                for line in move.line_ids 
-                if line.product_id
-            )
+            if isinstance(move.id, int):
+                move.is_pharmacy_invoice = move.id in pharmacy_ids
+            else:
+                # Unsaved move in a form: only its product lines matter
+                move.is_pharmacy_invoice = any(
+                    line.product_id.is_pharmaceutical
+                    for line in move.invoice_line_ids
+                )
+    
+    @api.model
+    def _backfill_is_pharmacy_invoice(self):
+        """One-off SQL backfill of the flag for historical moves"""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            UPDATE account_move m
+               SET is_pharmacy_invoice = EXISTS (
+                        SELECT 1
+                          FROM account_move_line l
+                          JOIN product_product p ON p.id = l.product_id
+                          JOIN product_template t ON t.id = p.product_tmpl_id
+                         WHERE l.move_id = m.id
+                           AND l.display_type = 'product'
+                           AND t.is_pharmaceutical
+                   )
+             WHERE m.is_pharmacy_invoice IS DISTINCT FROM EXISTS (
+                        SELECT 1
+                          FROM account_move_line l
+                          JOIN product_product p ON p.id = l.product_id
+                          JOIN product_template t ON t.id = p.product_tmpl_id
+                         WHERE l.move_id = m.id
+                           AND l.display_type = 'product'
+                           AND t.is_pharmaceutical
+                   )
+        """)
+        _logger.info("Backfilled is_pharmacy_invoice on %s move(s)", self.env.cr.rowcount)
+        self.invalidate_model(['is_pharmacy_invoice'])
 
 
 class AccountMoveLine(models.Model):
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, Command, _
+from odoo.exceptions import UserError
+from collections import defaultdict
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class PharmacyBranchStock(models.Model):
+    """Cached availability of each product, by lot, in every branch
+
+    A branch is the stock location its POS tills sell from. Rows are rebuilt
+    from stock.quant by one aggregated query, per product shortly after stock moves
+    and in full every night.
+    """
+    _name = 'pharmacy.branch.stock'
+    _description = 'Branch Stock Index'
+    _order = 'product_id, branch_location_id, expiry_date'
+    _rec_name = 'product_id'
+
+    product_id = fields.Many2one('product.product', string='Product', required=True, index=True, readonly=True)
+    branch_location_id = fields.Many2one('stock.location', string='Branch', required=True, index=True, readonly=True)
+    lot_id = fields.Many2one('stock.lot', string='Batch/Lot', readonly=True)
+    expiry_date = fields.Date(string='Expiry Date', readonly=True)
+    quantity = fields.Float(string='On Hand', readonly=True)
+    available_quantity = fields.Float(string='Available', readonly=True)
+
+    # Branch stock locations are those POS tills take their stock from
+    _BRANCH_CTE = """
+        WITH branch AS (
+            SELECT DISTINCT sl.id, sl.parent_path
+              FROM pos_config pc
+              JOIN stock_picking_type spt ON spt.id = pc.picking_type_id
+              JOIN stock_location sl ON sl.id = spt.default_location_src_id
+             WHERE pc.active
+        )
+    """
+
+    _INDEX_INSERT = _BRANCH_CTE + """
+        INSERT INTO pharmacy_branch_stock (
+            product_id, branch_location_id, lot_id, expiry_date, quantity, available_quantity,
+            create_uid, create_date, write_uid, write_date
+        )
+        SELECT q.product_id, b.id, q.lot_id, lot.expiry_date,
+               SUM(q.quantity), SUM(q.quantity - q.reserved_quantity),
+               %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+          FROM branch b
+          JOIN stock_location sl ON sl.parent_path LIKE b.parent_path || '%%' AND sl.usage = 'internal'
+          JOIN stock_quant q ON q.location_id = sl.id
+     LEFT JOIN stock_lot lot ON lot.id = q.lot_id
+         WHERE q.quantity > 0
+           {where}
+      GROUP BY q.product_id, b.id, q.lot_id, lot.expiry_date
+    """
+
+    @api.model
+    def _refresh_index(self, product_ids=None):
+        """Rebuild the index, fully or for some products only"""
+        self.env['stock.quant'].flush_model(['quantity', 'reserved_quantity', 'location_id', 'lot_id'])
+        self.env['stock.lot'].flush_model(['expiry_date'])
+        params = {'uid': self.env.uid}
+        cr = self.env.cr
+        if product_ids is None:
+            cr.execute("DELETE FROM pharmacy_branch_stock")
+            cr.execute(self._INDEX_INSERT.format(where=''), params)
+        else:
+            params['product_ids'] = list(product_ids)
+            cr.execute("DELETE FROM pharmacy_branch_stock WHERE product_id = ANY(%(product_ids)s)", params)
+            cr.execute(self._INDEX_INSERT.format(where='AND q.product_id = ANY(%(product_ids)s)'), params)
+        self.invalidate_model()
+
+    @api.model
+    def _update_products(self, product_ids):
+        if product_ids:
+            self._refresh_index(product_ids=product_ids)
+
+    @api.model
+    def _cron_rebuild(self):
+        self._refresh_index()
+        self.env['pharmacy.transfer.suggestion']._generate_suggestions()
+
+    @api.model
+    def get_branch_availability(self, product_ids):
+        """Availability per product for the POS, in one call
+
+        Returns {product_id: [{branch, lot, expiry_date, quantity}, ...]}
+        ordered by branch and expiry (first to expire first).
+        """
+        result = defaultdict(list)
+        if not product_ids:
+            return result
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT bs.product_id, bs.branch_location_id, sl.complete_name, lot.name,
+                   bs.expiry_date, bs.available_quantity
+              FROM pharmacy_branch_stock bs
+              JOIN stock_location sl ON sl.id = bs.branch_location_id
+         LEFT JOIN stock_lot lot ON lot.id = bs.lot_id
+             WHERE bs.product_id = ANY(%s)
+               AND bs.available_quantity > 0
+          ORDER BY bs.product_id, sl.complete_name, bs.expiry_date NULLS LAST
+        """, [list(product_ids)])
+        for product_id, branch_id, branch, lot, expiry_date, quantity in self.env.cr.fetchall():
+            result[product_id].append({
+                'branch_id': branch_id,
+                'branch': branch,
+                'lot': lot,
+                'expiry_date': fields.Date.to_string(expiry_date),
+                'quantity': quantity,
+            })
+        return result
+
+    @api.model
+    def _get_branch_velocity(self, days=30):
+        """Average daily POS sales per (product, branch location)"""
+        self.env.cr.execute("""
+            SELECT l.product_id, spt.default_location_src_id, SUM(l.qty) / %s
+              FROM pos_order_line l
+              JOIN pos_order o ON o.id = l.order_id
+              JOIN pos_session s ON s.id = o.session_id
+              JOIN pos_config pc ON pc.id = s.config_id
+              JOIN stock_picking_type spt ON spt.id = pc.picking_type_id
+             WHERE o.state IN ('paid', 'done', 'invoiced')
+               AND o.date_order >= %s
+          GROUP BY l.product_id, spt.default_location_src_id
+            HAVING SUM(l.qty) > 0
+        """, [float(days), fields.Datetime.now() - timedelta(days=days)])
+        return {(product_id, location_id): velocity for product_id, location_id, velocity in self.env.cr.fetchall()}
+
+
+class PharmacyTransferSuggestion(models.Model):
+    """Proposed move of near-expiry stock to a branch that sells it faster"""
+    _name = 'pharmacy.transfer.suggestion'
+    _description = 'Inter-branch Transfer Suggestion'
+    _order = 'expiry_date, id'
+    _rec_name = 'product_id'
+
+    product_id = fields.Many2one('product.product', string='Product', required=True, readonly=True)
+    lot_id = fields.Many2one('stock.lot', string='Batch/Lot', readonly=True)
+    expiry_date = fields.Date(string='Expiry Date', readonly=True)
+    source_location_id = fields.Many2one('stock.location', string='From Branch', required=True, readonly=True)
+    dest_location_id = fields.Many2one('stock.location', string='To Branch', required=True, readonly=True)
+    quantity = fields.Float(string='Quantity', readonly=True)
+    source_velocity = fields.Float(string='Source Daily Sales', readonly=True)
+    dest_velocity = fields.Float(string='Destination Daily Sales', readonly=True)
+    state = fields.Selection([
+        ('new', 'Proposed'),
+        ('done', 'Transfer Created'),
+        ('dismissed', 'Dismissed'),
+    ], string='Status', default='new', required=True, readonly=True, index=True)
+    picking_id = fields.Many2one('stock.picking', string='Transfer', readonly=True)
+
+    @api.model
+    def _generate_suggestions(self, horizon_days=90, velocity_days=30):
+        """Replace open suggestions with a fresh set from the branch index"""
+        self.search([('state', '=', 'new')]).unlink()
+        today = fields.Date.context_today(self)
+        velocity = self.env['pharmacy.branch.stock']._get_branch_velocity(velocity_days)
+        branches_by_product = defaultdict(list)
+        for product_id, location_id in velocity:
+            branches_by_product[product_id].append(location_id)
+
+        candidates = self.env['pharmacy.branch.stock'].search([
+            ('expiry_date', '>=', today),
+            ('expiry_date', '<', today + timedelta(days=horizon_days)),
+            ('available_quantity', '>', 0),
+            ('product_id', 'in', list(branches_by_product)),
+        ], order='product_id, branch_location_id, expiry_date, id')
+        vals_list = []
+        # Sales drain lots first to expire first: lots expiring earlier in the
+        # same branch use up part of each later lot's selling window
+        sold_before = defaultdict(float)
+        for row in candidates:
+            days_left = (row.expiry_date - today).days
+            key = (row.product_id.id, row.branch_location_id.id)
+            source_velocity = velocity.get(key, 0.0)
+            sellable = min(row.available_quantity, max(source_velocity * days_left - sold_before[key], 0.0))
+            sold_before[key] += sellable
+            # What this branch will not sell before the lot expires
+            excess = row.available_quantity - sellable
+            if excess < 1:
+                continue
+            best = max(
+                (
+                    (velocity[row.product_id.id, location_id], location_id)
+                    for location_id in branches_by_product[row.product_id.id]
+                    if location_id != row.branch_location_id.id
+                ),
+                default=None,
+            )
+            if not best or best[0] <= source_velocity:
+                continue
+            quantity = int(min(excess, best[0] * days_left))
+            if quantity < 1:
+                continue
+            vals_list.append({
+                'product_id': row.product_id.id,
+                'lot_id': row.lot_id.id,
+                'expiry_date': row.expiry_date,
+                'source_location_id': row.branch_location_id.id,
+                'dest_location_id': best[1],
+                'quantity': quantity,
+                'source_velocity': source_velocity,
+                'dest_velocity': best[0],
+            })
+        _logger.info("Inter-branch transfer suggestions: %s", len(vals_list))
+        return self.create(vals_list)
+
+    def action_create_transfer(self):
+        """One internal transfer per (source, destination) pair"""
+        groups = defaultdict(lambda: self.browse())
+        for suggestion in self.filtered(lambda s: s.state == 'new'):
+            groups[suggestion.source_location_id, suggestion.dest_location_id] |= suggestion
+        pickings = self.env['stock.picking']
+        for (source, dest), suggestions in groups.items():
+            picking_type = source.warehouse_id.int_type_id
+            if not picking_type:
+                raise UserError(_('No internal transfer operation type for %s.') % source.display_name)
+            picking = self.env['stock.picking'].create({
+                'picking_type_id': picking_type.id,
+                'location_id': source.id,
+                'location_dest_id': dest.id,
+                'origin': _('Near-expiry rebalancing'),
+                'move_ids': [Command.create({
+                    'name': s.product_id.display_name,
+                    'product_id': s.product_id.id,
+                    'product_uom': s.product_id.uom_id.id,
+                    'product_uom_qty': s.quantity,
+                    'location_id': source.id,
+                    'location_dest_id': dest.id,
+                    'restrict_lot_id': s.lot_id.id,
+                }) for s in suggestions],
+            })
+            picking.action_confirm()
+            suggestions.write({'state': 'done', 'picking_id': picking.id})
+            pickings |= picking
+        return {
+            'name': _('Transfers'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'stock.picking',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', pickings.ids)],
+        }
+
+    def action_dismiss(self):
+        self.filtered(lambda s: s.state == 'new').write({'state': 'dismissed'})
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class PharmacyCacheGeneration(models.Model):
+    """Version counter of one kind of cached data
+
+    ormcache entries of that kind include the counter in their key, so
+    bumping it retires just those entries instead of clearing the whole
+    registry cache on every worker. Counter values come from a sequence
+    and are never reused, so an entry cached by a transaction that is
+    later rolled back can never be looked up again. The value is read
+    through the ORM and so costs one query per transaction at most.
+    """
+    _name = 'pharmacy.cache.generation'
+    _description = 'Pharmacy Cache Generation'
+    _log_access = False
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'Cache generation names must be unique'),
+    ]
+
+    name = fields.Char(string='Name', required=True)
+    value = fields.Integer(string='Generation', readonly=True)
+
+    def init(self):
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS pharmacy_cache_generation_seq")
+
+    @api.model
+    def _get_record(self, name):
+        return self.env.ref('pos_demo.cache_generation_%s' % name, raise_if_not_found=False)
+
+    @api.model
+    def _get(self, name):
+        """Current generation, or None when the counter is not installed yet"""
+        generation = self._get_record(name)
+        return generation.sudo().value if generation else None
+
+    @api.model
+    def _bump(self, name):
+        """Retire the cached entries of a kind"""
+        generation = self._get_record(name)
+        if not generation:
+            return
+        self.env.cr.execute("""
+            UPDATE pharmacy_cache_generation
+               SET value = nextval('pharmacy_cache_generation_seq')
+             WHERE id = %s
+        """, [generation.id])
+        generation.invalidate_recordset(['value'])
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+from datetime import date, datetime, time, timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Register columns copied to the archive and exposed by the history view
+REGISTER_COLUMNS = [
+    ('id', 'integer NOT NULL'),
+    ('date', 'timestamp NOT NULL'),
+    ('product_id', 'integer NOT NULL'),
+    ('transaction_type', 'varchar NOT NULL'),
+    ('quantity_received', 'double precision'),
+    ('quantity_dispensed', 'double precision'),
+    ('running_balance', 'double precision'),
+    ('prescription_id', 'integer'),
+    ('patient_name', 'varchar'),
+    ('patient_id_number', 'varchar'),
+    ('prescriber_name', 'varchar'),
+    ('prescriber_license', 'varchar'),
+    ('supplier_id', 'integer'),
+    ('purchase_order_ref', 'varchar'),
+    ('invoice_ref', 'varchar'),
+    ('lot_id', 'integer'),
+    ('authorized_by', 'integer'),
+    ('witnessed_by', 'integer'),
+    ('remarks', 'text'),
+    ('pos_order_id', 'integer'),
+    ('pos_order_archive_id', 'integer'),
+    ('stock_picking_id', 'integer'),
+]
+# Kept in the archive for the audit trail only
+AUDIT_COLUMNS = [
+    ('create_uid', 'integer'),
+    ('create_date', 'timestamp'),
+    ('write_uid', 'integer'),
+    ('write_date', 'timestamp'),
+]
+
+
+class ControlledDrugsRegisterPeriod(models.Model):
+    """Reporting period of the register (normally a calendar year)
+
+    Frozen periods are read-only and carry a closing balance per drug, so
+    the running balance of later entries never needs their rows. Archiving
+    a frozen period moves its rows out of the live table into a partition
+    of controlled_drugs_register_archive.
+    """
+    _name = 'controlled.drugs.register.period'
+    _description = 'Controlled Drugs Register Period'
+    _order = 'date_from desc'
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'Period name must be unique'),
+        ('dates_check', 'CHECK(date_from <= date_to)', 'The period must end after it starts'),
+    ]
+
+    name = fields.Char(
+        string='Period',
+        required=True,
+        default=lambda self: str(fields.Date.context_today(self).year - 1)
+    )
+    date_from = fields.Date(
+        string='From',
+        required=True,
+        default=lambda self: date(fields.Date.context_today(self).year - 1, 1, 1)
+    )
+    date_to = fields.Date(
+        string='To',
+        required=True,
+        default=lambda self: date(fields.Date.context_today(self).year - 1, 12, 31)
+    )
+    state = fields.Selection([
+        ('open', 'Open'),
+        ('frozen', 'Frozen'),
+        ('archived', 'Archived'),
+    ], string='Status', default='open', required=True, readonly=True, index=True)
+    frozen_by = fields.Many2one('res.users', string='Frozen By', readonly=True)
+    frozen_date = fields.Datetime(string='Frozen On', readonly=True)
+    balance_ids = fields.One2many(
+        'controlled.drugs.register.period.balance',
+        'period_id',
+        string='Closing Balances',
+        readonly=True
+    )
+    archived_count = fields.Integer(string='Archived Entries', readonly=True)
+
+    @api.constrains('date_from', 'date_to')
+    def _check_overlap(self):
+        for period in self:
+            if self.search_count([
+                ('id', '!=', period.id),
+                ('date_from', '<=', period.date_to),
+                ('date_to', '>=', period.date_from),
+            ]):
+                raise ValidationError(_('Register period %s overlaps another period.') % period.name)
+
+    def write(self, vals):
+        if {'date_from', 'date_to'} & set(vals) and self.filtered(lambda p: p.state != 'open'):
+            raise UserError(_('The dates of a frozen register period cannot be changed.'))
+        return super().write(vals)
+
+    def unlink(self):
+        if self.filtered(lambda p: p.state != 'open'):
+            raise UserError(_('Frozen register periods cannot be deleted.'))
+        return super().unlink()
+
+    def _get_bounds(self):
+        """UTC datetimes [start, end) covered by the period"""
+        self.ensure_one()
+        return (
+            datetime.combine(self.date_from, time.min),
+            datetime.combine(self.date_to + timedelta(days=1), time.min),
+        )
+
+    # ------------------------------------------------------------------
+    # Register hooks
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _check_dates_open(self, dates):
+        """Refuse changes to register entries dated in a frozen period"""
+        dates = [d for d in dates if d]
+        if not dates:
+            return
+        closed = self.sudo().search([
+            ('state', '!=', 'open'),
+            ('date_from', '<=', max(dates).date()),
+            ('date_to', '>=', min(dates).date()),
+        ])
+        for period in closed:
+            start, end = period._get_bounds()
+            if any(start <= d < end for d in dates):
+                raise UserError(_(
+                    'The register period %s is frozen: its entries are read-only.'
+                ) % period.name)
+
+    @api.model
+    def _get_opening_balance(self, product_id, before):
+        """Closing balance of the last frozen period ending before a date
+
+        Returns:
+            tuple: (end of that period, balance), (datetime.min, 0.0) if none
+        """
+        self.flush_model(['state', 'date_to'])
+        self.env['controlled.drugs.register.period.balance'].flush_model()
+        self.env.cr.execute("""
+            SELECT p.date_to, b.closing_balance
+              FROM controlled_drugs_register_period p
+         LEFT JOIN controlled_drugs_register_period_balance b
+                ON b.period_id = p.id AND b.product_id = %s
+             WHERE p.state != 'open'
+               AND (p.date_to + 1)::timestamp <= %s
+          ORDER BY p.date_to DESC
+             LIMIT 1
+        """, [product_id, before])
+        row = self.env.cr.fetchone()
+        if not row:
+            return datetime.min, 0.0
+        return datetime.combine(row[0] + timedelta(days=1), time.min), row[1] or 0.0
+
+    # ------------------------------------------------------------------
+    # Actions
+    # ------------------------------------------------------------------
+
+    def action_freeze(self):
+        """Close the period: store closing balances and make it read-only"""
+        today = fields.Date.context_today(self)
+        for period in self.sorted('date_from'):
+            if period.state != 'open':
+                raise UserError(_('Register period %s is already frozen.') % period.name)
+            if period.date_to >= today:
+                raise UserError(_('Register period %s has not ended yet.') % period.name)
+            if self.search_count([('state', '=', 'open'), ('date_to', '<', period.date_from)]):
+                raise UserError(_('Freeze the periods before %s first.') % period.name)
+            period._store_closing_balances()
+            period.write({
+                'state': 'frozen',
+                'frozen_by': self.env.uid,
+                'frozen_date': fields.Datetime.now(),
+            })
+            _logger.info("Controlled drugs register period %s frozen", period.name)
+        return True
+
+    def _store_closing_balances(self):
+        """Opening + movements of the period per drug, in one statement"""
+        self.ensure_one()
+        start, end = self._get_bounds()
+        previous = self.search([('state', '!=', 'open'), ('date_to', '<', self.date_from)],
+                               order='date_to desc', limit=1)
+        previous_end = previous and previous._get_bounds()[1] or datetime.min
+        self.env['controlled.drugs.register'].flush_model()
+        self.env['controlled.drugs.register.period.balance'].flush_model()
+        self.env.cr.execute("""
+            WITH opening AS (
+                SELECT product_id, SUM(quantity) AS quantity
+                  FROM (
+                        SELECT product_id, closing_balance AS quantity
+                          FROM controlled_drugs_register_period_balance
+                         WHERE period_id = %(previous)s
+                     UNION ALL
+                        -- entries older than any period (before the first freeze)
+                        SELECT product_id, COALESCE(quantity_received, 0) - COALESCE(quantity_dispensed, 0)
+                          FROM controlled_drugs_register
+                         WHERE date >= %(previous_end)s AND date < %(start)s
+                  ) carried
+              GROUP BY product_id
+            ), movement AS (
+                SELECT product_id,
+                       SUM(COALESCE(quantity_received, 0)) AS received,
+                       SUM(COALESCE(quantity_dispensed, 0)) AS dispensed
+                  FROM controlled_drugs_register
+                 WHERE date >= %(start)s AND date < %(end)s
+              GROUP BY product_id
+            )
+            INSERT INTO controlled_drugs_register_period_balance (
+                period_id, product_id, opening_balance, quantity_received, quantity_dispensed,
+                closing_balance, create_uid, create_date, write_uid, write_date
+            )
+            SELECT %(period)s, COALESCE(m.product_id, o.product_id),
+                   COALESCE(o.quantity, 0), COALESCE(m.received, 0), COALESCE(m.dispensed, 0),
+                   COALESCE(o.quantity, 0) + COALESCE(m.received, 0) - COALESCE(m.dispensed, 0),
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+              FROM movement m
+         FULL JOIN opening o ON o.product_id = m.product_id
+        """, {
+            'period': self.id,
+            'previous': previous.id or None,
+            'previous_end': previous_end,
+            'start': start,
+            'end': end,
+            'uid': self.env.uid,
+        })
+        self.env['controlled.drugs.register.period.balance'].invalidate_model()
+
+    def action_reopen(self):
+        """Undo a freeze (not possible once the rows are archived)"""
+        for period in self:
+            if period.state != 'frozen':
+                raise UserError(_('Only frozen, not yet archived periods can be reopened.'))
+            if self.search_count([('state', '!=', 'open'), ('date_from', '>', period.date_to)]):
+                raise UserError(_('Reopen the later periods first.'))
+            period.balance_ids.unlink()
+            period.write({'state': 'open', 'frozen_by': False, 'frozen_date': False})
+            _logger.info("Controlled drugs register period %s reopened", period.name)
+        return True
+
+    def action_archive_entries(self):
+        """Move the rows of frozen periods from the live table to the archive"""
+        Register = self.env['controlled.drugs.register']
+        Register.flush_model()
+        columns = ', '.join(name for name, _type in REGISTER_COLUMNS + AUDIT_COLUMNS)
+        for period in self.sorted('date_from'):
+            if period.state != 'frozen':
+                raise UserError(_('Only frozen register periods can be archived.'))
+            start, end = period._get_bounds()
+            self.env['controlled.drugs.register.history']._ensure_partition(period)
+            self.env.cr.execute("""
+                INSERT INTO controlled_drugs_register_archive ({columns}, period_id)
+                SELECT {columns}, %s
+                  FROM controlled_drugs_register
+                 WHERE date >= %s AND date < %s
+            """.format(columns=columns), [period.id, start, end])
+            count = self.env.cr.rowcount
+            self.env.cr.execute(
+                "DELETE FROM controlled_drugs_register WHERE date >= %s AND date < %s",
+                [start, end],
+            )
+            period.write({'state': 'archived', 'archived_count': count})
+            _logger.info("Archived %d controlled drugs register entries of period %s", count, period.name)
+        Register.invalidate_model()
+        return True
+
+    def action_view_history(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Register %s') % self.name,
+            'res_model': 'controlled.drugs.register.history',
+            'view_mode': 'list,pivot',
+            'domain': [('period_id', '=', self.id)],
+            'context': {'search_default_group_product': 1},
+        }
+
+
+class ControlledDrugsRegisterPeriodBalance(models.Model):
+    _name = 'controlled.drugs.register.period.balance'
+    _description = 'Controlled Drugs Period Closing Balance'
+    _order = 'period_id, product_id'
+
+    _sql_constraints = [
+        ('period_product_unique', 'unique(period_id, product_id)',
+         'One closing balance per drug and period'),
+    ]
+
+    period_id = fields.Many2one(
+        'controlled.drugs.register.period',
+        string='Period',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    product_id = fields.Many2one('product.product', string='Controlled Drug', required=True, readonly=True)
+    opening_balance = fields.Float(string='Opening Balance', readonly=True)
+    quantity_received = fields.Float(string='Received', readonly=True)
+    quantity_dispensed = fields.Float(string='Dispensed', readonly=True)
+    closing_balance = fields.Float(string='Closing Balance', readonly=True)
+
+
+class ControlledDrugsRegisterHistory(models.Model):
+    """Live and archived register entries in one read-only model for reports"""
+    _name = 'controlled.drugs.register.history'
+    _description = 'Controlled Drugs Register History'
+    _auto = False
+    _order = 'date desc, id desc'
+    _rec_name = 'product_id'
+
+    date = fields.Datetime(string='Date', readonly=True)
+    product_id = fields.Many2one('product.product', string='Controlled Drug', readonly=True)
+    product_generic_name = fields.Char(related='product_id.product_tmpl_id.drug_generic_name')
+    product_strength = fields.Char(related='product_id.product_tmpl_id.drug_strength')
+    drug_schedule = fields.Selection(related='product_id.product_tmpl_id.drug_schedule')
+    transaction_type = fields.Selection(
+        selection=lambda self: self.env['controlled.drugs.register']._fields['transaction_type'].selection,
+        string='Transaction Type',
+        readonly=True
+    )
+    quantity_received = fields.Float(string='Quantity Received', readonly=True)
+    quantity_dispensed = fields.Float(string='Quantity Dispensed', readonly=True)
+    running_balance = fields.Float(string='Running Balance', readonly=True)
+    prescription_id = fields.Many2one('pharmacy.prescription', string='Prescription Reference', readonly=True)
+    patient_name = fields.Char(string='Patient Name', readonly=True)
+    patient_id_number = fields.Char(string='Patient ID Number', readonly=True)
+    prescriber_name = fields.Char(string='Prescriber Name', readonly=True)
+    prescriber_license = fields.Char(string='Prescriber License No.', readonly=True)
+    supplier_id = fields.Many2one('res.partner', string='Supplier', readonly=True)
+    purchase_order_ref = fields.Char(string='Purchase Order Reference', readonly=True)
+    invoice_ref = fields.Char(string='Invoice Reference', readonly=True)
+    lot_id = fields.Many2one('stock.lot', string='Batch/Lot', readonly=True)
+    authorized_by = fields.Many2one('res.users', string='Authorized/Recorded By', readonly=True)
+    witnessed_by = fields.Many2one('res.users', string='Witnessed By', readonly=True)
+    remarks = fields.Text(string='Remarks', readonly=True)
+    pos_order_id = fields.Many2one('pos.order', string='POS Order', readonly=True)
+    pos_order_archive_id = fields.Many2one('pos.order.archive', string='Archived POS Order', readonly=True)
+    stock_picking_id = fields.Many2one('stock.picking', string='Stock Transfer', readonly=True)
+    period_id = fields.Many2one('controlled.drugs.register.period', string='Period', readonly=True)
+    source = fields.Selection([
+        ('live', 'Live'),
+        ('archive', 'Archive'),
+    ], string='Storage', readonly=True)
+    write_date = fields.Datetime(string='Last Updated on', readonly=True)
+
+    def init(self):
+        self._create_archive_table()
+        columns = ', '.join('r.%s' % name for name, _type in REGISTER_COLUMNS + [('write_date', None)])
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE VIEW {view} AS (
+                SELECT {columns}, p.id AS period_id, 'live' AS source
+                  FROM controlled_drugs_register r
+             LEFT JOIN controlled_drugs_register_period p
+                    ON r.date >= p.date_from AND r.date < p.date_to + 1
+             UNION ALL
+                SELECT {columns}, r.period_id, 'archive' AS source
+                  FROM controlled_drugs_register_archive r
+            )
+        """.format(view=self._table, columns=columns))
+
+    @api.model
+    def _create_archive_table(self):
+        """Archive table, range-partitioned on the entry date (one partition per period)"""
+        columns = ',\n'.join('%s %s' % column for column in REGISTER_COLUMNS + AUDIT_COLUMNS)
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS controlled_drugs_register_archive (
+                {columns},
+                period_id integer NOT NULL,
+                PRIMARY KEY (id, date)
+            ) PARTITION BY RANGE (date)
+        """.format(columns=columns))
+        # Columns added to the register after the archive was created
+        for name, column_type in REGISTER_COLUMNS + AUDIT_COLUMNS:
+            if 'NOT NULL' not in column_type:
+                self.env.cr.execute(
+                    "ALTER TABLE controlled_drugs_register_archive ADD COLUMN IF NOT EXISTS %s %s" % (name, column_type)
+                )
+
+    @api.model
+    def _ensure_partition(self, period):
+        start, end = period._get_bounds()
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS controlled_drugs_register_archive_p{suffix}
+            PARTITION OF controlled_drugs_register_archive
+            FOR VALUES FROM (%s) TO (%s)
+        """.format(suffix=period.date_from.strftime('%Y%m%d')), [start, end])
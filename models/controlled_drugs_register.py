@@ -112,57 +112,79 @@ class ControlledDrugsRegister(models.Model):
         string='POS Order',
         readonly=True
     )
+    pos_order_archive_id = fields.Many2one(
+        'pos.order.archive',
+        string='Archived POS Order',
+        readonly=True
+    )
     stock_picking_id = fields.Many2one(
         'stock.picking',
         string='Stock Transfer',
         readonly=True
     )
     
-    @api.model
-    def create(self, vals):
+    @api.model_create_multi
+    def create(self, vals_list):
         """Calculate running balance on creation"""
-        record = super().create(vals)
-        record._compute_running_balance()
-        return record
+        records = super().create(vals_list)
+        self.env['controlled.drugs.register.period']._check_dates_open(records.mapped('date'))
+        records._compute_running_balance()
+        return records
     
     def write(self, vals):
         """Recalculate running balance on updates"""
+        if set(vals) - {'running_balance'}:
+            Period = self.env['controlled.drugs.register.period']
+            Period._check_dates_open(self.mapped('date') + [fields.Datetime.to_datetime(vals.get('date'))])
         res = super().write(vals)
         if any(field in vals for field in ['quantity_received', 'quantity_dispensed', 'date', 'product_id']):
             self._compute_running_balance()
         return res
     
+    def unlink(self):
+        self.env['controlled.drugs.register.period']._check_dates_open(self.mapped('date'))
+        return super().unlink()
+    
     def _compute_running_balance(self):
-        """Calculate running balance for each product"""
+        """Calculate running balance for each product
+        
+        Balances are replayed once per product from the earliest changed
+        transaction, so bulk creations do not rescan the register per row.
+        The replay starts from the previous entry's balance, or from the
+        closing balance of the last frozen period, so archived years are
+        never read.
+        """
+        self.flush_model(['product_id', 'date', 'quantity_received', 'quantity_dispensed', 'running_balance'])
+        Period = self.env['controlled.drugs.register.period']
+        start_by_product = {}
         for record in self:
-            # Get all previous transactions for this product
-            previous_records = self.search([
-                ('product_id', '=', record.product_id.id),
-                ('date', '<', record.date),
-            ], order='date asc, id asc')
+            start = start_by_product.get(record.product_id.id)
+            if start is None or record.date < start:
+                start_by_product[record.product_id.id] = record.date
+        
+        for product_id, start in start_by_product.items():
+            # Balance carried into the earliest change
+            period_end, balance = Period._get_opening_balance(product_id, start)
+            self.env.cr.execute("""
+                SELECT running_balance
+                  FROM controlled_drugs_register
+                 WHERE product_id = %s AND date < %s AND date >= %s
+              ORDER BY date DESC, id DESC
+                 LIMIT 1
+            """, [product_id, start, period_end])
+            row = self.env.cr.fetchone()
+            if row:
+                balance = row[0] or 0.0
             
-            # Calculate balance
-            balance = 0.0
-            for prev in previous_records:
-                balance += (prev.quantity_received or 0.0)
-                balance -= (prev.quantity_dispensed or 0.0)
-            
-            # Add current transaction
-            balance += (record.quantity_received or 0.0)
-            balance -= (record.quantity_dispensed or 0.0)
-            
-            record.running_balance = balance
-            
-            # Update subsequent records
-            subsequent_records = self.search([
-                ('product_id', '=', record.product_id.id),
-                ('date', '>', record.date),
+            records = self.search([
+                ('product_id', '=', product_id),
+                ('date', '>=', start),
             ], order='date asc, id asc')
-            
-            for subsequent in subsequent_records:
-                balance += (subsequent.quantity_received or 0.0)
-                balance -= (subsequent.quantity_dispensed or 0.0)
-                subsequent.running_balance = balance
+            for record in records:
+                balance += (record.quantity_received or 0.0)
+                balance -= (record.quantity_dispensed or 0.0)
+                if record.running_balance != balance:
+                    record.running_balance = balance
     
     @api.constrains('quantity_received', 'quantity_dispensed', 'transaction_type')
     def _check_quantities(self):
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+from datetime import timedelta
+import hashlib
+import hmac
+import json
+import logging
+import threading
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+ETR_TIMEOUT = 10
+ETR_MAX_ATTEMPTS = 10
+# Prefix of etr_api_url selecting the built-in mock control unit
+ETR_MOCK_SCHEME = 'mock://'
+# Advisory lock namespace serialising workers per control unit
+ETR_LOCK_KEY = 4187
+
+
+class PosEtrQueue(models.Model):
+    """Outbox of fiscal receipts waiting for the KRA ETR control unit"""
+    _name = 'pos.etr.queue'
+    _description = 'ETR Fiscal Receipt Queue'
+    _order = 'id'
+
+    order_id = fields.Many2one(
+        'pos.order',
+        string='POS Order',
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    config_id = fields.Many2one(
+        'pos.config',
+        string='Point of Sale',
+        required=True,
+        readonly=True
+    )
+    session_id = fields.Many2one(
+        'pos.session',
+        string='Session',
+        readonly=True,
+        index=True
+    )
+    cu_serial = fields.Char(
+        string='Control Unit Serial',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Signed'),
+        ('failed', 'Failed'),
+    ], string='Status', default='pending', required=True, readonly=True, index=True)
+    attempts = fields.Integer(string='Attempts', readonly=True)
+    next_attempt_at = fields.Datetime(
+        string='Next Attempt',
+        default=fields.Datetime.now,
+        readonly=True
+    )
+    payload = fields.Text(string='Payload', readonly=True)
+    fiscal_number = fields.Char(string='CU Invoice Number', readonly=True)
+    fiscal_signature = fields.Char(string='Signature', readonly=True)
+    error = fields.Text(string='Last Error', readonly=True)
+
+    _sql_constraints = [
+        ('order_unique', 'unique(order_id)', 'An order can only be queued for the ETR once'),
+    ]
+
+    # ------------------------------------------------------------------
+    # Enqueue
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _enqueue_orders(self, orders):
+        """Queue paid orders of ETR-enabled tills; returns the queue rows"""
+        queued = set(self.sudo().search([('order_id', 'in', orders.ids)]).order_id.ids)
+        vals_list = []
+        for order in orders:
+            if order.id in queued:
+                continue
+            config = order.session_id.config_id
+            if not config.etr_enabled or not config.etr_cu_serial:
+                continue
+            vals_list.append({
+                'order_id': order.id,
+                'config_id': config.id,
+                'session_id': order.session_id.id,
+                'cu_serial': config.etr_cu_serial,
+                'payload': json.dumps(order._prepare_etr_payload()),
+            })
+        if not vals_list:
+            return self
+        entries = self.sudo().create(vals_list)
+        entries.order_id.write({'etr_state': 'pending'})
+        # Wake the worker now instead of waiting for the next interval
+        self.env.ref('pos_demo.ir_cron_etr_process_queue')._trigger()
+        return entries
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _cron_process_queue(self, limit=500):
+        """Submit pending receipts, in order per control unit"""
+        self._process_queue(limit=limit, auto_commit=not getattr(threading.current_thread(), 'testing', False))
+
+    @api.model
+    def _process_queue(self, limit=500, auto_commit=False):
+        self.flush_model()
+        self.env.cr.execute("""
+            SELECT DISTINCT cu_serial
+              FROM pos_etr_queue
+             WHERE state = 'pending'
+        """)
+        for (cu_serial,) in self.env.cr.fetchall():
+            self._process_control_unit(cu_serial, limit, auto_commit)
+
+    @api.model
+    def _process_control_unit(self, cu_serial, limit, auto_commit):
+        """Drain one control unit's backlog, stopping at the first failure"""
+        # One worker per control unit; the session lock survives commits
+        cr = self.env.cr
+        cr.execute("SELECT pg_try_advisory_lock(%s, hashtext(%s))", [ETR_LOCK_KEY, cu_serial])
+        if not cr.fetchone()[0]:
+            return
+        try:
+            cr.execute("""
+                SELECT id, next_attempt_at
+                  FROM pos_etr_queue
+                 WHERE state = 'pending'
+                   AND cu_serial = %s
+              ORDER BY id
+                 LIMIT %s
+            """, [cu_serial, limit])
+            now = fields.Datetime.now()
+            for entry_id, next_attempt_at in cr.fetchall():
+                if next_attempt_at and next_attempt_at > now:
+                    # Backing off; later receipts wait to keep the CU order
+                    break
+                signed = self.browse(entry_id)._submit()
+                if auto_commit:
+                    cr.commit()
+                if not signed:
+                    break
+        finally:
+            cr.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", [ETR_LOCK_KEY, cu_serial])
+
+    def _submit(self):
+        """Send one receipt to the control unit; True when signed"""
+        self.ensure_one()
+        config = self.config_id
+        try:
+            if (config.etr_api_url or ETR_MOCK_SCHEME).startswith(ETR_MOCK_SCHEME):
+                result = self._mock_control_unit_sign()
+            else:
+                response = requests.post(
+                    config.etr_api_url,
+                    json={'cu_serial': self.cu_serial, 'receipt': json.loads(self.payload)},
+                    timeout=ETR_TIMEOUT,
+                )
+                response.raise_for_status()
+                result = response.json()
+            fiscal_number = result['invoice_number']
+        except Exception as e:
+            self._register_failure(str(e))
+            return False
+
+        self.write({
+            'state': 'done',
+            'attempts': self.attempts + 1,
+            'fiscal_number': fiscal_number,
+            'fiscal_signature': result.get('signature'),
+            'error': False,
+        })
+        self.order_id.write({
+            'etr_state': 'signed',
+            'etr_invoice_number': fiscal_number,
+        })
+        self.env['bus.bus']._sendone(config.access_token, 'ETR_SIGNED', {
+            'pos_reference': self.order_id.pos_reference,
+            'etr_invoice_number': fiscal_number,
+        })
+        return True
+
+    def _register_failure(self, error):
+        """Back off exponentially; give up after ETR_MAX_ATTEMPTS"""
+        attempts = self.attempts + 1
+        _logger.warning("ETR submission of %s failed (attempt %s): %s", self.order_id.name, attempts, error)
+        vals = {
+            'attempts': attempts,
+            'error': error,
+            'next_attempt_at': fields.Datetime.now() + timedelta(minutes=min(2 ** attempts, 60)),
+        }
+        if attempts >= ETR_MAX_ATTEMPTS:
+            vals['state'] = 'failed'
+            self.order_id.etr_state = 'failed'
+        self.write(vals)
+
+    def _mock_control_unit_sequence(self):
+        """Receipt counter of the mock control unit, one sequence per CU"""
+        self.ensure_one()
+        Sequence = self.env['ir.sequence'].sudo()
+        code = 'pos.etr.mock.%s' % self.cu_serial
+        sequence = Sequence.search([('code', '=', code)], limit=1)
+        if not sequence:
+            sequence = Sequence.create({
+                'name': 'ETR Mock Control Unit %s' % self.cu_serial,
+                'code': code,
+                'prefix': self.cu_serial[-6:],
+                'padding': 10,
+                'company_id': False,
+            })
+        return sequence
+
+    def _mock_control_unit_sign(self):
+        """Local stand-in for a control unit, numbering receipts per CU"""
+        signature = hmac.new(
+            self.cu_serial.encode(), (self.payload or '').encode(), hashlib.sha256
+        ).hexdigest()[:32].upper()
+        return {
+            'invoice_number': self._mock_control_unit_sequence().next_by_id(),
+            'signature': signature,
+        }
+
+    def action_retry(self):
+        """Put failed receipts back in the queue"""
+        self.filtered(lambda e: e.state == 'failed').write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt_at': fields.Datetime.now(),
+        })
+        self.order_id.filtered(lambda o: o.etr_state == 'failed').write({'etr_state': 'pending'})
+        self.env.ref('pos_demo.ir_cron_etr_process_queue')._trigger()
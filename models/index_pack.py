@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+from odoo.tools import create_index
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# (index name, table, expressions, where) for the pharmacy hot paths
+PHARMACY_INDEXES = [
+    # Register balance replay and PPB returns per drug
+    ('controlled_drugs_register_product_date_id_idx', 'controlled_drugs_register',
+     ['product_id', 'date', 'id'], ''),
+    # Archived register history per drug (created on every partition)
+    ('controlled_drugs_register_archive_product_date_id_idx', 'controlled_drugs_register_archive',
+     ['product_id', 'date', 'id'], ''),
+    # Patient purchase history and interaction checks
+    ('pos_order_partner_date_state_idx', 'pos_order',
+     ['partner_id', 'date_order DESC', 'state'], 'partner_id IS NOT NULL'),
+    # Claim batches, exports and monthly insurer invoicing
+    ('insurance_claim_provider_state_date_idx', 'insurance_claim',
+     ['insurance_provider_id', 'state', 'date'], ''),
+    # Patient prescriptions and open prescriptions at the counter
+    ('pharmacy_prescription_patient_state_date_idx', 'pharmacy_prescription',
+     ['patient_id', 'state', 'date DESC'], ''),
+    # FEFO lot selection and expiry reports
+    ('stock_lot_product_expiry_idx', 'stock_lot',
+     ['product_id', 'expiry_date'], ''),
+    # Outstanding quantities for refills and the reorder planner
+    ('pharmacy_prescription_line_product_open_idx', 'pharmacy_prescription_line',
+     ['product_id'], 'quantity_remaining > 0'),
+]
+
+# Tables the index advisor reports on
+PHARMACY_TABLES = sorted({index[1] for index in PHARMACY_INDEXES} | {
+    'pos_order_line', 'pos_payment', 'pos_session', 'stock_quant', 'res_partner',
+    'pharmacy_ingredient', 'pharmacy_lot_valuation', 'pharmacy_branch_stock',
+    'pos_lot_reservation', 'pos_etr_queue', 'pos_mpesa_request', 'pos_order_archive',
+    'pos_session_totals',
+})
+
+
+class PharmacyIndexPack(models.AbstractModel):
+    """Composite indexes for the pharmacy access paths, kept in one place"""
+    _name = 'pharmacy.index.pack'
+    _description = 'Pharmacy Index Pack'
+
+    def init(self):
+        self._create_indexes()
+
+    @api.model
+    def _create_indexes(self):
+        """Create the pack's missing indexes (existing ones are left as is)"""
+        for name, table, expressions, where in PHARMACY_INDEXES:
+            create_index(self.env.cr, name, table, expressions, where=where)
+
+    @api.model
+    def _get_missing_indexes(self):
+        self.env.cr.execute(
+            "SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)",
+            [[index[0] for index in PHARMACY_INDEXES]],
+        )
+        existing = {row[0] for row in self.env.cr.fetchall()}
+        return [index for index in PHARMACY_INDEXES if index[0] not in existing]
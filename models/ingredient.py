@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import ValidationError
+import re
+
+# Cache generations retiring the vocabulary and the patients' allergy profiles
+VOCABULARY_CACHE = 'ingredient_vocabulary'
+ALLERGY_CACHE = 'allergy_profiles'
+
+# Ingredient fields read by the text matching and by the conflict query
+MATCHED_FIELDS = {'name', 'synonyms', 'active'}
+CONFLICT_FIELDS = MATCHED_FIELDS | {'parent_id'}
+
+
+def normalize_ingredient_text(text):
+    """Lowercase words separated by single spaces, padded for whole-word search"""
+    return ' %s ' % ' '.join(re.findall(r'[a-z0-9]+', (text or '').lower()))
+
+
+class PharmacyIngredient(models.Model):
+    """Active ingredient or drug class (e.g. Penicillins) for allergy checks"""
+    _name = 'pharmacy.ingredient'
+    _description = 'Active Ingredient'
+    _parent_store = True
+    _order = 'name'
+
+    _sql_constraints = [
+        ('name_unique', 'unique(name)', 'Ingredient name must be unique'),
+    ]
+
+    name = fields.Char(string='Name', required=True)
+    synonyms = fields.Char(
+        string='Synonyms',
+        help='Comma separated alternative names found in allergy or ingredient texts, '
+             'e.g. "acetaminophen" for Paracetamol'
+    )
+    is_class = fields.Boolean(
+        string='Drug Class',
+        help='Groups ingredients; an allergy to a class covers all its ingredients'
+    )
+    parent_id = fields.Many2one(
+        'pharmacy.ingredient',
+        string='Drug Class',
+        index=True,
+        ondelete='restrict',
+        domain=[('is_class', '=', True)]
+    )
+    parent_path = fields.Char(index=True)
+    child_ids = fields.One2many('pharmacy.ingredient', 'parent_id', string='Members')
+    active = fields.Boolean(default=True)
+
+    @api.constrains('parent_id')
+    def _check_parent_id(self):
+        if self._has_cycle():
+            raise ValidationError(_('A drug class cannot contain itself.'))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Invalidate the vocabulary and re-read free-text fields"""
+        ingredients = super().create(vals_list)
+        self._bump_caches(VOCABULARY_CACHE, ALLERGY_CACHE)
+        self._schedule_rematch()
+        return ingredients
+
+    def write(self, vals):
+        res = super().write(vals)
+        if MATCHED_FIELDS & set(vals):
+            self._bump_caches(VOCABULARY_CACHE)
+            self._schedule_rematch()
+        if CONFLICT_FIELDS & set(vals):
+            self._bump_caches(ALLERGY_CACHE)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._bump_caches(VOCABULARY_CACHE, ALLERGY_CACHE)
+        return res
+
+    @api.model
+    def _bump_caches(self, *names):
+        for name in names:
+            self.env['pharmacy.cache.generation']._bump(name)
+
+    @api.model
+    def _schedule_rematch(self):
+        """Rematch free texts now, or once at the end of a data file load"""
+        if not self.env.context.get('install_module'):
+            self._rematch_texts()
+            return
+        precommit = self.env.cr.precommit
+        if precommit.data.get('pharmacy.ingredient.rematch'):
+            return
+        precommit.data['pharmacy.ingredient.rematch'] = True
+
+        @precommit.add
+        def rematch():
+            # Runs after the last flush before commit: flush what it marks
+            self._rematch_texts()
+            self.env.flush_all()
+
+    @api.model
+    def _rematch_texts(self):
+        """Recompute structured allergies and ingredients from their texts"""
+        for model, fname, text_field in [
+            ('res.partner', 'allergy_ingredient_ids', 'allergies'),
+            ('product.template', 'ingredient_ids', 'active_ingredients'),
+        ]:
+            records = self.env[model].with_context(active_test=False).search([(text_field, '!=', False)])
+            self.env.add_to_compute(records._fields[fname], records)
+
+    # ------------------------------------------------------------------
+    # Text matching
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_vocabulary(self):
+        """(normalized alias, ingredient id) pairs of the whole vocabulary"""
+        generation = self.env['pharmacy.cache.generation']._get(VOCABULARY_CACHE)
+        if generation is None:
+            return self._read_vocabulary()
+        return self._get_vocabulary_cached(generation)
+
+    @api.model
+    @tools.ormcache('generation')
+    def _get_vocabulary_cached(self, generation):
+        return self._read_vocabulary()
+
+    @api.model
+    def _read_vocabulary(self):
+        vocabulary = []
+        for ingredient in self.sudo().search([]):
+            aliases = [ingredient.name] + (ingredient.synonyms or '').split(',')
+            for alias in aliases:
+                alias = normalize_ingredient_text(alias)
+                if alias.strip():
+                    vocabulary.append((alias, ingredient.id))
+        return tuple(vocabulary)
+
+    @api.model
+    def _match_text(self, text):
+        """Ingredients mentioned in a free text, as a recordset"""
+        text = normalize_ingredient_text(text)
+        if not text.strip():
+            return self.browse()
+        ids = {ingredient_id for alias, ingredient_id in self._get_vocabulary() if alias in text}
+        return self.browse(sorted(ids))
+
+    # ------------------------------------------------------------------
+    # Conflicts
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _find_conflicts(self, partner_id, product_ids=None):
+        """Allergy conflicts of a patient, for some products or all of them
+
+        An ingredient conflicts with an allergy to itself or to any class
+        above it, which the parent_path prefix test resolves in the same
+        query.
+
+        Returns:
+            list: (product_id, ingredient name, allergy name) tuples
+        """
+        self.env['res.partner'].flush_model(['allergy_ingredient_ids'])
+        self.env['product.template'].flush_model(['ingredient_ids'])
+        self.flush_model(['parent_path', 'name'])
+        where, params = '', [partner_id]
+        if product_ids is not None:
+            where = 'AND pp.id = ANY(%s)'
+            params.append(list(product_ids))
+        self.env.cr.execute("""
+            SELECT DISTINCT pp.id, ing.name, alg.name
+              FROM res_partner_allergy_ingredient_rel ar
+              JOIN pharmacy_ingredient alg ON alg.id = ar.ingredient_id
+              JOIN pharmacy_ingredient ing ON ing.parent_path LIKE alg.parent_path || '%%'
+              JOIN product_template_ingredient_rel pr ON pr.ingredient_id = ing.id
+              JOIN product_product pp ON pp.product_tmpl_id = pr.product_tmpl_id
+             WHERE ar.partner_id = %s
+               {where}
+          ORDER BY pp.id, ing.name
+        """.format(where=where), params)
+        return self.env.cr.fetchall()
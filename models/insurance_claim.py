@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo import models, fields, api, Command, _
+from odoo.exceptions import ValidationError, UserError
+from datetime import timedelta
+import csv
+import io
+import logging
+import tempfile
+
+_logger = logging.getLogger(__name__)
+
+# Claims read per query when streaming claim schedules
+CLAIM_SCHEDULE_PAGE = 5000
 
 
 class InsuranceClaim(models.Model):
@@ -87,6 +97,11 @@ class InsuranceClaim(models.Model):
         string='POS Order',
         readonly=True
     )
+    pos_order_archive_id = fields.Many2one(
+        'pos.order.archive',
+        string='Archived POS Order',
+        readonly=True
+    )
     
     # Status
     state = fields.Selection([
@@ -120,6 +135,16 @@ class InsuranceClaim(models.Model):
         tracking=True
     )
     
+    # Insurer invoicing
+    invoice_id = fields.Many2one(
+        'account.move',
+        string='Insurer Invoice',
+        readonly=True,
+        copy=False,
+        index=True,
+        help='Consolidated insurer invoice covering this claim'
+    )
+    
     # Notes
     notes = fields.Text(string='Internal Notes')
     
@@ -130,6 +155,20 @@ class InsuranceClaim(models.Model):
             vals['name'] = self.env['ir.sequence'].next_by_code('insurance.claim') or 'New'
         return super().create(vals)
     
+    @api.model
+    def _get_claim_provider_terms(self, code_or_id):
+        """Cached terms of the provider a new claim is made for"""
+        terms = self.env['insurance.provider']._resolve_provider(code_or_id)
+        if not terms or not terms['active']:
+            raise UserError(_('Unknown or archived insurance provider: %s') % code_or_id)
+        return terms
+    
+    @api.model
+    def _needs_preauth(self, terms, amount, preauth_number=None):
+        """Whether a claim of this amount must wait for a pre-authorization"""
+        return bool(terms['requires_preauth'] and not preauth_number
+                    and amount > (terms['preauth_threshold'] or 0.0))
+    
     @api.depends('line_ids.amount')
     def _compute_amounts(self):
         """Calculate total claim amount"""
@@ -217,6 +256,144 @@ class InsuranceClaim(models.Model):
         """Reset claim to draft"""
         self.ensure_one()
         self.state = 'draft'
+    
+    # ------------------------------------------------------------------
+    # Consolidated insurer invoicing
+    # ------------------------------------------------------------------
+    
+    @api.model
+    def _cron_invoice_previous_month(self):
+        """Monthly job: one invoice per provider for last month's claims"""
+        date_to = fields.Date.context_today(self).replace(day=1) - timedelta(days=1)
+        self._invoice_claims_by_provider(date_to.replace(day=1), date_to)
+    
+    @api.model
+    def _invoice_claims_by_provider(self, date_from, date_to, providers=None, grouping='product'):
+        """Create one insurer invoice per provider and period.
+        
+        Approved, not yet invoiced claims are aggregated in SQL, so a month
+        of NHIF claims becomes a single invoice in one pass.
+        
+        :param grouping: 'product' for one line per product, 'claim' for
+                         one line per claim
+        :return: created account.move records
+        """
+        self.flush_model()
+        self.env['insurance.claim.line'].flush_model()
+        params = [date_from, date_to]
+        provider_clause = ''
+        if providers:
+            provider_clause = 'AND insurance_provider_id = ANY(%s)'
+            params.append(providers.ids)
+        self.env.cr.execute("""
+            SELECT insurance_provider_id, ARRAY_AGG(id ORDER BY id)
+              FROM insurance_claim
+             WHERE state IN ('approved', 'partial')
+               AND invoice_id IS NULL
+               AND date BETWEEN %s AND %s
+               {provider_clause}
+          GROUP BY insurance_provider_id
+        """.format(provider_clause=provider_clause), params)
+        
+        moves = self.env['account.move']
+        for provider_id, claim_ids in self.env.cr.fetchall():
+            provider = self.env['insurance.provider'].browse(provider_id)
+            moves |= self._create_insurer_invoice(provider, claim_ids, date_from, date_to, grouping)
+        return moves
+    
+    @api.model
+    def _create_insurer_invoice(self, provider, claim_ids, date_from, date_to, grouping):
+        """Invoice a provider for a set of claims with aggregated lines"""
+        if not provider.partner_id:
+            raise UserError(_('Set the related partner of %s before invoicing its claims.') % provider.name)
+        
+        if grouping == 'claim':
+            self.env.cr.execute("""
+                SELECT name, member_number, date, insurance_payment
+                  FROM insurance_claim
+                 WHERE id = ANY(%s)
+              ORDER BY date, id
+            """, [claim_ids])
+            line_commands = [Command.create({
+                'name': _('Claim %(claim)s - Member %(member)s (%(date)s)',
+                          claim=name, member=member or '', date=date),
+                'quantity': 1.0,
+                'price_unit': amount,
+                'tax_ids': [Command.clear()],
+            }) for name, member, date, amount in self.env.cr.fetchall()]
+        else:
+            # Spread what the insurer pays over the claim's lines
+            self.env.cr.execute("""
+                SELECT l.product_id,
+                       SUM(l.quantity),
+                       SUM(l.amount * c.insurance_payment / NULLIF(c.total_amount, 0))
+                  FROM insurance_claim_line l
+                  JOIN insurance_claim c ON c.id = l.claim_id
+                 WHERE c.id = ANY(%s)
+              GROUP BY l.product_id
+              ORDER BY l.product_id
+            """, [claim_ids])
+            line_commands = []
+            for product_id, quantity, amount in self.env.cr.fetchall():
+                vals = {
+                    'quantity': quantity,
+                    'price_unit': (amount or 0.0) / quantity if quantity else 0.0,
+                    'tax_ids': [Command.clear()],
+                }
+                if product_id:
+                    vals['product_id'] = product_id
+                else:
+                    # Lines of imported claims may have no product
+                    vals['name'] = _('Claimed items without a product')
+                line_commands.append(Command.create(vals))
+        
+        move = self.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': provider.partner_id.id,
+            'invoice_date': date_to,
+            'ref': _('%(code)s claims %(start)s to %(end)s', code=provider.code, start=date_from, end=date_to),
+            'invoice_line_ids': line_commands,
+        })
+        claims = self.browse(claim_ids)
+        claims.with_context(tracking_disable=True).write({'invoice_id': move.id})
+        self._attach_claim_schedule(move, claim_ids)
+        _logger.info("Invoiced %s claim(s) of %s on %s", len(claim_ids), provider.code, move.display_name)
+        return move
+    
+    @api.model
+    def _attach_claim_schedule(self, move, claim_ids):
+        """Attach the claim schedule CSV, reading claims page by page
+
+        Rows are written to a temporary file rather than kept in memory
+        while the schedule is built.
+        """
+        with tempfile.TemporaryFile() as buffer:
+            text = io.TextIOWrapper(buffer, encoding='utf-8', newline='', write_through=True)
+            writer = csv.writer(text)
+            writer.writerow([
+                'Claim Number', 'Claim Date', 'Member Number', 'Patient', 'Pre-auth',
+                'Claimed', 'Approved', 'Co-payment', 'Insurer Payable',
+            ])
+            for page in range(0, len(claim_ids), CLAIM_SCHEDULE_PAGE):
+                self.env.cr.execute("""
+                    SELECT c.name, c.date, c.member_number, p.name, c.preauth_number,
+                           c.total_amount, c.approved_amount, c.patient_copay, c.insurance_payment
+                      FROM insurance_claim c
+                      JOIN res_partner p ON p.id = c.patient_id
+                     WHERE c.id = ANY(%s)
+                  ORDER BY c.id
+                """, [claim_ids[page:page + CLAIM_SCHEDULE_PAGE]])
+                writer.writerows(self.env.cr.fetchall())
+            text.detach()
+            buffer.seek(0)
+            raw = buffer.read()
+        return self.env['ir.attachment'].create({
+            'name': '%s - claim schedule.csv' % (move.ref or move.name),
+            'res_model': 'account.move',
+            'res_id': move.id,
+            'raw': raw,
+            'mimetype': 'text/csv',
+        })
 
 
 class InsuranceClaimLine(models.Model):
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from xml.sax.saxutils import XMLGenerator
+from datetime import timedelta
+import csv
+import hashlib
+import io
+import json
+import logging
+import tempfile
+import threading
+import traceback
+
+from .insurance_claim import CLAIM_SCHEDULE_PAGE
+
+_logger = logging.getLogger(__name__)
+
+# Claims sent to the insurer, i.e. everything past draft
+EXPORT_CLAIM_STATES = ('submitted', 'approved', 'partial', 'paid', 'rejected')
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'xml': 'application/xml',
+}
+
+CSV_HEADER = [
+    'Claim Number', 'Claim Date', 'Member Number', 'Patient', 'Pre-auth', 'Pre-auth Amount',
+    'Status', 'Claimed', 'Approved', 'Co-payment', 'Insurer Payable',
+    'Product Code', 'Product', 'Description', 'Quantity', 'Unit Price', 'Amount',
+]
+
+
+class InsuranceClaimExport(models.Model):
+    """Claim batch of one provider and period, in the provider's file format
+
+    Claims are read by keyset pages of CLAIM_SCHEDULE_PAGE and written
+    straight to a temporary file, so a batch of 100k claims never sits in
+    memory as records. The file's SHA-256 and control totals are kept on
+    the export for the insurer to check the batch against.
+
+    Formats are pluggable: add a value to insurance.provider.export_format
+    with selection_add and implement _export_<value>(stream, claims, totals).
+    """
+    _name = 'insurance.claim.export'
+    _description = 'Insurer Claim Batch Export'
+    _order = 'create_date desc, id desc'
+
+    def _default_last_month_end(self):
+        return fields.Date.context_today(self).replace(day=1) - timedelta(days=1)
+
+    name = fields.Char(string='Name', compute='_compute_name', store=True)
+    provider_id = fields.Many2one('insurance.provider', string='Insurance Provider', required=True, index=True)
+    date_from = fields.Date(string='From', required=True,
+                            default=lambda self: self._default_last_month_end().replace(day=1))
+    date_to = fields.Date(string='To', required=True, default=lambda self: self._default_last_month_end())
+    export_format = fields.Selection(selection='_selection_export_format', string='Format',
+                                     compute='_compute_export_format', store=True, readonly=False, required=True)
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('queued', 'Queued'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='draft', required=True, readonly=True, index=True)
+    user_id = fields.Many2one('res.users', string='Requested By', default=lambda self: self.env.user, readonly=True)
+
+    # Control totals
+    claim_count = fields.Integer(string='Claims', readonly=True)
+    line_count = fields.Integer(string='Claim Lines', readonly=True)
+    total_claimed = fields.Float(string='Total Claimed', readonly=True)
+    total_payable = fields.Float(string='Insurer Payable', readonly=True)
+    checksum = fields.Char(string='SHA-256', readonly=True)
+    file_size = fields.Integer(string='File Size (bytes)', readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', string='File', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    date_done = fields.Datetime(string='Generated', readonly=True)
+
+    @api.model
+    def _selection_export_format(self):
+        return self.env['insurance.provider']._fields['export_format'].selection
+
+    @api.depends('provider_id.code', 'date_from', 'date_to')
+    def _compute_name(self):
+        for export in self:
+            export.name = '%s %s - %s' % (export.provider_id.code or '', export.date_from or '', export.date_to or '')
+
+    @api.depends('provider_id')
+    def _compute_export_format(self):
+        for export in self:
+            export.export_format = export.provider_id.export_format or 'csv'
+
+    # ------------------------------------------------------------------
+    # Queueing
+    # ------------------------------------------------------------------
+
+    def action_generate(self):
+        if self.filtered(lambda export: export.date_from > export.date_to):
+            raise UserError(_('The start of the period must be before its end.'))
+        self.write({'state': 'queued', 'error': False})
+        self.env.ref('pos_demo.ir_cron_insurance_claim_export')._trigger()
+        return True
+
+    @api.model
+    def _cron_run_exports(self, limit=2):
+        for export in self.search([('state', '=', 'queued')], order='id', limit=limit):
+            export._run(auto_commit=not getattr(threading.current_thread(), 'testing', False))
+
+    # ------------------------------------------------------------------
+    # Generation
+    # ------------------------------------------------------------------
+
+    def _run(self, auto_commit=True):
+        self.ensure_one()
+        try:
+            self._generate()
+        except Exception:
+            if not auto_commit:
+                raise
+            self.env.cr.rollback()
+            self.env.invalidate_all()
+            _logger.exception("Claim export %s failed", self.id)
+            self.write({'state': 'failed', 'error': traceback.format_exc(limit=5)})
+        if auto_commit:
+            self.env.cr.commit()
+
+    def _generate(self):
+        """Stream the claims into the provider's format and attach the file"""
+        self.ensure_one()
+        writer = getattr(self, '_export_%s' % self.export_format, None)
+        if writer is None:
+            raise UserError(_('No exporter is installed for the %s format.') % self.export_format)
+        totals = {'claim_count': 0, 'line_count': 0, 'total_claimed': 0.0, 'total_payable': 0.0}
+        with tempfile.TemporaryFile() as buffer:
+            text = io.TextIOWrapper(buffer, encoding='utf-8', newline='')
+            writer(text, self._tally(self._iter_claims(), totals), totals)
+            text.flush()
+            text.detach()
+            buffer.seek(0)
+            raw = buffer.read()
+        if self.attachment_id:
+            self.attachment_id.unlink()
+        attachment = self.env['ir.attachment'].create({
+            'name': '%s.%s' % (self.name, self.export_format),
+            'raw': raw,
+            'mimetype': EXPORT_MIMETYPES.get(self.export_format, 'application/octet-stream'),
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+        self.write(dict(
+            totals,
+            state='done',
+            checksum=hashlib.sha256(raw).hexdigest(),
+            file_size=len(raw),
+            attachment_id=attachment.id,
+            date_done=fields.Datetime.now(),
+            error=False,
+        ))
+        _logger.info("Exported %d claim(s) of %s to %s (%d bytes)",
+                     totals['claim_count'], self.provider_id.code, attachment.name, len(raw))
+
+    def _iter_claims(self):
+        """Yield the batch's claims with their lines, one keyset page at a time"""
+        self.ensure_one()
+        for model in ('insurance.claim', 'insurance.claim.line', 'res.partner', 'product.product', 'product.template'):
+            self.env[model].flush_model()
+        cr = self.env.cr
+        lang = self.env.lang or 'en_US'
+        last_id = 0
+        while True:
+            cr.execute("""
+                SELECT c.id, c.name, c.date, c.member_number, p.name AS patient, c.preauth_number,
+                       c.preauth_amount, c.state, c.total_amount, c.approved_amount,
+                       c.patient_copay, c.insurance_payment
+                  FROM insurance_claim c
+                  JOIN res_partner p ON p.id = c.patient_id
+                 WHERE c.insurance_provider_id = %s
+                   AND c.date BETWEEN %s AND %s
+                   AND c.state IN %s
+                   AND c.id > %s
+              ORDER BY c.id
+                 LIMIT %s
+            """, [self.provider_id.id, self.date_from, self.date_to, EXPORT_CLAIM_STATES, last_id, CLAIM_SCHEDULE_PAGE])
+            claims = cr.dictfetchall()
+            if not claims:
+                return
+            cr.execute("""
+                SELECT l.claim_id, pp.default_code AS product_code,
+                       COALESCE(pt.name->>%s, pt.name->>'en_US') AS product,
+                       l.description, l.quantity, l.unit_price, l.amount
+                  FROM insurance_claim_line l
+                  JOIN product_product pp ON pp.id = l.product_id
+                  JOIN product_template pt ON pt.id = pp.product_tmpl_id
+                 WHERE l.claim_id = ANY(%s)
+              ORDER BY l.claim_id, l.id
+            """, [lang, [claim['id'] for claim in claims]])
+            lines = {}
+            for line in cr.dictfetchall():
+                lines.setdefault(line.pop('claim_id'), []).append(line)
+            last_id = claims[-1]['id']
+            for claim in claims:
+                claim['lines'] = lines.get(claim.pop('id'), [])
+                yield claim
+
+    @api.model
+    def _tally(self, claims, totals):
+        """Pass claims through, adding them to the control totals"""
+        for claim in claims:
+            totals['claim_count'] += 1
+            totals['line_count'] += len(claim['lines'])
+            totals['total_claimed'] += claim['total_amount'] or 0.0
+            totals['total_payable'] += claim['insurance_payment'] or 0.0
+            yield claim
+
+    def _get_batch_header(self):
+        self.ensure_one()
+        return {
+            'provider_code': self.provider_id.code,
+            'provider': self.provider_id.name,
+            'date_from': str(self.date_from),
+            'date_to': str(self.date_to),
+            'company': self.env.company.name,
+            'generated': fields.Datetime.to_string(fields.Datetime.now()),
+        }
+
+    @api.model
+    def _get_control(self, totals):
+        return {
+            'claim_count': totals['claim_count'],
+            'line_count': totals['line_count'],
+            'total_claimed': round(totals['total_claimed'], 2),
+            'total_payable': round(totals['total_payable'], 2),
+        }
+
+    # ------------------------------------------------------------------
+    # Formats
+    # ------------------------------------------------------------------
+
+    def _export_csv(self, stream, claims, totals):
+        """One row per claim line, claim columns repeated"""
+        writer = csv.writer(stream)
+        writer.writerow(CSV_HEADER)
+        for claim in claims:
+            head = [
+                claim['name'], claim['date'], claim['member_number'], claim['patient'], claim['preauth_number'] or '',
+                claim['preauth_amount'] or 0.0, claim['state'], claim['total_amount'], claim['approved_amount'],
+                claim['patient_copay'], claim['insurance_payment'],
+            ]
+            if not claim['lines']:
+                writer.writerow(head)
+            for line in claim['lines']:
+                writer.writerow(head + [
+                    line['product_code'] or '', line['product'], line['description'] or '',
+                    line['quantity'], line['unit_price'], line['amount'],
+                ])
+
+    def _export_json(self, stream, claims, totals):
+        """One JSON document: header, claims array, then control totals"""
+        stream.write('{"batch": %s, "claims": [' % json.dumps(self._get_batch_header()))
+        for index, claim in enumerate(claims):
+            if index:
+                stream.write(',')
+            stream.write('\n')
+            stream.write(json.dumps(claim, default=str))
+        stream.write('\n], "control": %s}\n' % json.dumps(self._get_control(totals)))
+
+    def _export_xml(self, stream, claims, totals):
+        """<ClaimBatch> with a header, the claims and a trailing control block"""
+        xml = XMLGenerator(stream, encoding='utf-8', short_empty_elements=True)
+
+        def element(tag, value):
+            xml.startElement(tag, {})
+            if value not in (None, False):
+                xml.characters(str(value))
+            xml.endElement(tag)
+
+        xml.startDocument()
+        xml.startElement('ClaimBatch', {})
+        xml.startElement('Header', {})
+        for key, value in self._get_batch_header().items():
+            element(key, value)
+        xml.endElement('Header')
+        xml.startElement('Claims', {})
+        for claim in claims:
+            xml.startElement('Claim', {})
+            for key, value in claim.items():
+                if key != 'lines':
+                    element(key, value)
+            xml.startElement('Lines', {})
+            for line in claim['lines']:
+                xml.startElement('Line', {})
+                for key, value in line.items():
+                    element(key, value)
+                xml.endElement('Line')
+            xml.endElement('Lines')
+            xml.endElement('Claim')
+        xml.endElement('Claims')
+        xml.startElement('Control', {})
+        for key, value in self._get_control(totals).items():
+            element(key, value)
+        xml.endElement('Control')
+        xml.endElement('ClaimBatch')
+        xml.endDocument()
+
+    # ------------------------------------------------------------------
+    # Actions
+    # ------------------------------------------------------------------
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_('The file has not been generated yet.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % self.attachment_id.id,
+            'target': 'self',
+        }
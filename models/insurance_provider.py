@@ -1,13 +1,26 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
 
+# Cache generation retiring the provider lookups below
+PROVIDER_CACHE = 'insurance_providers'
+
+# Provider fields returned by the cached lookups
+PROVIDER_TERMS = [
+    'code', 'name', 'provider_type', 'active', 'copay_percentage', 'coverage_percentage',
+    'requires_preauth', 'preauth_threshold', 'claim_submission_method', 'api_endpoint',
+]
+
 
 class InsuranceProvider(models.Model):
     _name = 'insurance.provider'
     _description = 'Insurance Provider'
     _order = 'name'
     
+    _sql_constraints = [
+        ('code_unique', 'unique(code)', 'Provider code must be unique'),
+    ]
+    
     name = fields.Char(
         string='Provider Name',
         required=True,
@@ -70,6 +83,12 @@ class InsuranceProvider(models.Model):
     api_key = fields.Char(string='API Key')
     portal_url = fields.Char(string='Portal URL')
     submission_email = fields.Char(string='Claims Submission Email')
+    export_format = fields.Selection([
+        ('csv', 'CSV'),
+        ('json', 'JSON'),
+        ('xml', 'XML'),
+    ], string='Claim Batch Format', default='csv', required=True,
+        help='File format of the monthly claim batches sent to this provider')
     
     # Processing times
     average_processing_days = fields.Integer(
@@ -112,9 +131,69 @@ class InsuranceProvider(models.Model):
             if provider.copay_percentage < 0 or provider.copay_percentage > 100:
                 raise ValidationError(_('Co-payment percentage must be between 0 and 100'))
     
-    @api.constrains('code')
-    def _check_unique_code(self):
-        """Ensure provider code is unique"""
-        for provider in self:
-            if self.search_count([('code', '=', provider.code), ('id', '!=', provider.id)]) > 0:
-                raise ValidationError(_('Provider code must be unique'))
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Invalidate the provider lookups (a code may have been cached as unknown)"""
+        providers = super().create(vals_list)
+        self.env['pharmacy.cache.generation']._bump(PROVIDER_CACHE)
+        return providers
+    
+    def write(self, vals):
+        """Invalidate the provider lookups when cached terms change"""
+        res = super().write(vals)
+        if set(vals) & set(PROVIDER_TERMS):
+            self.env['pharmacy.cache.generation']._bump(PROVIDER_CACHE)
+        return res
+    
+    def unlink(self):
+        """Invalidate the provider lookups"""
+        res = super().unlink()
+        self.env['pharmacy.cache.generation']._bump(PROVIDER_CACHE)
+        return res
+    
+    @api.model
+    def _get_provider_id_by_code(self, code):
+        """Cached provider id for a provider code (False if unknown)"""
+        generation = self.env['pharmacy.cache.generation']._get(PROVIDER_CACHE)
+        if generation is None:
+            return self._lookup_provider_id(code)
+        return self._get_provider_id_by_code_cached(code, generation)
+    
+    @api.model
+    @tools.ormcache('code', 'generation')
+    def _get_provider_id_by_code_cached(self, code, generation):
+        return self._lookup_provider_id(code)
+    
+    @api.model
+    def _lookup_provider_id(self, code):
+        provider = self.with_context(active_test=False).search([('code', '=', code)], limit=1)
+        return provider.id
+    
+    @api.model
+    def _get_provider_terms(self, provider_id):
+        """Cached coverage terms of a provider, keyed by id"""
+        generation = self.env['pharmacy.cache.generation']._get(PROVIDER_CACHE)
+        if generation is None:
+            return self._read_provider_terms(provider_id)
+        return self._get_provider_terms_cached(provider_id, generation)
+    
+    @api.model
+    @tools.ormcache('provider_id', 'generation')
+    def _get_provider_terms_cached(self, provider_id, generation):
+        return self._read_provider_terms(provider_id)
+    
+    @api.model
+    def _read_provider_terms(self, provider_id):
+        provider = self.sudo().browse(provider_id).exists()
+        if not provider:
+            return None
+        return tools.frozendict({'id': provider.id, **{fname: provider[fname] for fname in PROVIDER_TERMS}})
+    
+    @api.model
+    def _resolve_provider(self, code_or_id):
+        """Resolve a provider id or code to its cached terms (at most one query per transaction)"""
+        if isinstance(code_or_id, str) and not code_or_id.isdigit():
+            provider_id = self._get_provider_id_by_code(code_or_id)
+        else:
+            provider_id = int(code_or_id or 0)
+        return self._get_provider_terms(provider_id) if provider_id else None
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Reservations not refreshed by the till within this delay are released
+RESERVATION_TIMEOUT = timedelta(minutes=15)
+
+
+class PosLotReservation(models.Model):
+    """Quantity of a lot held by an order line until its stock leaves
+
+    Tills reserve when a line is added, so two tills cannot sell the last
+    units of the same lot. Concurrent reservations of a lot are serialised
+    by row locks on its quants. Once the order is paid the hold no longer
+    expires; it is released when the order's picking is done, which may
+    only happen at session closing.
+    """
+    _name = 'pos.lot.reservation'
+    _description = 'POS Lot Reservation'
+    _order = 'id'
+
+    line_uuid = fields.Char(string='Order Line UUID', required=True, readonly=True)
+    config_id = fields.Many2one('pos.config', string='Point of Sale', required=True, readonly=True)
+    location_id = fields.Many2one('stock.location', string='Location', required=True, readonly=True)
+    product_id = fields.Many2one('product.product', string='Product', required=True, readonly=True)
+    lot_id = fields.Many2one('stock.lot', string='Batch/Lot', required=True, readonly=True, ondelete='cascade')
+    quantity = fields.Float(string='Quantity', required=True, readonly=True)
+    expires_at = fields.Datetime(string='Expires At', required=True, readonly=True, index=True)
+    order_id = fields.Many2one(
+        'pos.order',
+        string='Paid Order',
+        readonly=True,
+        index='btree_not_null',
+        ondelete='cascade',
+        help='Paid order whose stock has not been moved yet'
+    )
+
+    _sql_constraints = [
+        ('line_uuid_unique', 'unique(line_uuid)', 'An order line can only hold one reservation'),
+    ]
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS pos_lot_reservation_lot_location_idx
+                ON pos_lot_reservation (lot_id, location_id)
+        """)
+
+    @api.model
+    def _get_config_location(self, config_id):
+        config = self.env['pos.config'].browse(config_id)
+        location = config.picking_type_id.default_location_src_id
+        if not location:
+            raise UserError(_('%s has no stock location.') % config.name)
+        return config, location
+
+    @api.model
+    def reserve(self, config_id, line_uuid, lot_id, quantity):
+        """Reserve (or resize the reservation of) a line on a lot
+
+        Returns {'reserved': bool, 'available': unreserved quantity before
+        this line}. A refused request leaves any previous reservation of the
+        line unchanged.
+        """
+        config, location = self._get_config_location(config_id)
+        lot = self.env['stock.lot'].browse(lot_id)
+        cr = self.env.cr
+        self.flush_model()
+
+        # Lock the lot's quants with a no-op update. Concurrent tills wait
+        # here; under repeatable read the losers then fail to serialise and
+        # the request is retried on a fresh snapshot that sees our row.
+        cr.execute("""
+            UPDATE stock_quant q
+               SET write_date = q.write_date
+              FROM stock_location sl
+             WHERE sl.id = q.location_id
+               AND q.lot_id = %s
+               AND sl.parent_path LIKE %s
+               AND sl.usage = 'internal'
+         RETURNING q.quantity
+        """, [lot.id, location.parent_path + '%'])
+        on_hand = sum(row[0] for row in cr.fetchall())
+        cr.execute("""
+            SELECT COALESCE(SUM(quantity), 0)
+              FROM pos_lot_reservation
+             WHERE lot_id = %s
+               AND location_id = %s
+               AND line_uuid != %s
+               AND (expires_at > NOW() AT TIME ZONE 'UTC' OR order_id IS NOT NULL)
+        """, [lot.id, location.id, line_uuid])
+        available = on_hand - cr.fetchone()[0]
+        if quantity > available:
+            return {'reserved': False, 'available': max(available, 0.0)}
+
+        expires_at = fields.Datetime.now() + RESERVATION_TIMEOUT
+        existing = self.sudo().search([('line_uuid', '=', line_uuid), ('order_id', '=', False)])
+        if quantity <= 0:
+            existing.unlink()
+        elif existing:
+            existing.write({'lot_id': lot.id, 'quantity': quantity, 'expires_at': expires_at})
+        else:
+            self.sudo().create({
+                'line_uuid': line_uuid,
+                'config_id': config.id,
+                'location_id': location.id,
+                'product_id': lot.product_id.id,
+                'lot_id': lot.id,
+                'quantity': quantity,
+                'expires_at': expires_at,
+            })
+        return {'reserved': True, 'available': available}
+
+    @api.model
+    def release(self, line_uuids):
+        """Release the reservations of removed order lines"""
+        if line_uuids:
+            self.sudo().search([
+                ('line_uuid', 'in', list(line_uuids)),
+                ('order_id', '=', False),
+            ]).unlink()
+        return True
+
+    @api.model
+    def renew(self, line_uuids):
+        """Extend the holds of lines still open on the till
+
+        Returns the uuids whose hold had already expired; the till must
+        reserve those again.
+        """
+        if not line_uuids:
+            return []
+        reservations = self.sudo().search([
+            ('line_uuid', 'in', list(line_uuids)),
+            ('order_id', '=', False),
+            ('expires_at', '>', fields.Datetime.now()),
+        ])
+        reservations.write({'expires_at': fields.Datetime.now() + RESERVATION_TIMEOUT})
+        return sorted(set(line_uuids) - set(reservations.mapped('line_uuid')))
+
+    @api.model
+    def _keep_for_orders(self, orders):
+        """Keep the holds of paid orders until their stock is moved"""
+        order_by_uuid = {line.uuid: line.order_id.id for line in orders.lines if line.uuid}
+        if not order_by_uuid:
+            return
+        reservations = self.sudo().search([
+            ('line_uuid', 'in', list(order_by_uuid)),
+            ('order_id', '=', False),
+        ])
+        for order_id in set(order_by_uuid.values()):
+            reservations.filtered(lambda r: order_by_uuid[r.line_uuid] == order_id).write({'order_id': order_id})
+
+    @api.model
+    def _release_orders(self, orders):
+        """Release the holds of orders whose picking is done"""
+        if orders:
+            self.sudo().search([('order_id', 'in', orders.ids)]).unlink()
+
+    @api.model
+    def get_fefo_lots(self, config_id, product_id):
+        """Unexpired lots of a product with unreserved stock, first to expire first"""
+        config, location = self._get_config_location(config_id)
+        self.flush_model()
+        self.env['stock.quant'].flush_model(['quantity', 'lot_id', 'location_id'])
+        today = fields.Date.context_today(self)
+        self.env.cr.execute("""
+            WITH stock AS (
+                SELECT q.lot_id, SUM(q.quantity) AS quantity
+                  FROM stock_quant q
+                  JOIN stock_location sl ON sl.id = q.location_id
+                 WHERE q.product_id = %(product_id)s
+                   AND q.lot_id IS NOT NULL
+                   AND sl.parent_path LIKE %(path)s
+                   AND sl.usage = 'internal'
+              GROUP BY q.lot_id
+            ), held AS (
+                SELECT lot_id, SUM(quantity) AS quantity
+                  FROM pos_lot_reservation
+                 WHERE product_id = %(product_id)s
+                   AND location_id = %(location_id)s
+                   AND (expires_at > NOW() AT TIME ZONE 'UTC' OR order_id IS NOT NULL)
+              GROUP BY lot_id
+            )
+            SELECT lot.id, lot.name, lot.batch_number, lot.expiry_date, lot.expiry_alert,
+                   stock.quantity - COALESCE(held.quantity, 0) AS available
+              FROM stock
+              JOIN stock_lot lot ON lot.id = stock.lot_id
+         LEFT JOIN held ON held.lot_id = stock.lot_id
+             WHERE stock.quantity - COALESCE(held.quantity, 0) > 0
+               AND (lot.expiry_date IS NULL OR lot.expiry_date >= %(today)s)
+          ORDER BY lot.expiry_date NULLS LAST, lot.id
+        """, {
+            'product_id': product_id,
+            'location_id': location.id,
+            'path': location.parent_path + '%',
+            'today': today,
+        })
+        return [{
+            'id': lot_id,
+            'name': name,
+            'batch_number': batch_number,
+            'expiry_date': fields.Date.to_string(expiry_date),
+            'expiry_alert': expiry_alert,
+            'is_expired': False,
+            'available_quantity': available,
+        } for lot_id, name, batch_number, expiry_date, expiry_alert, available in self.env.cr.fetchall()]
+
+    @api.model
+    def _cron_release_expired(self):
+        """Drop reservations of tills that went away without releasing"""
+        self.search([('expires_at', '<', fields.Datetime.now()), ('order_id', '=', False)]).unlink()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Snapshots kept for day-to-day comparison
+VALUATION_RETENTION_DAYS = 31
+
+
+class PharmacyLotValuation(models.Model):
+    """Daily on-hand valuation per product, lot and location at lot cost"""
+    _name = 'pharmacy.lot.valuation'
+    _description = 'Lot Inventory Valuation'
+    _order = 'expiry_date, product_id, lot_id'
+    _rec_name = 'product_id'
+
+    date = fields.Date(string='Valuation Date', required=True, index=True, readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    product_id = fields.Many2one('product.product', string='Product', required=True, index=True, readonly=True)
+    lot_id = fields.Many2one('stock.lot', string='Batch/Lot', readonly=True)
+    location_id = fields.Many2one('stock.location', string='Location', required=True, readonly=True)
+    expiry_date = fields.Date(string='Expiry Date', readonly=True)
+    expiry_bucket = fields.Selection([
+        ('expired', 'Expired'),
+        ('lt30', 'Expires < 30 days'),
+        ('lt90', 'Expires < 90 days'),
+        ('lt180', 'Expires < 180 days'),
+        ('later', 'Expires later'),
+        ('no_expiry', 'No Expiry Date'),
+    ], string='Expiry Window', readonly=True, index=True)
+    quantity = fields.Float(string='On Hand', readonly=True)
+    unit_cost = fields.Float(string='Unit Cost', readonly=True)
+    value = fields.Float(string='Value', readonly=True)
+
+    # One aggregated pass over stock.quant; {where} narrows to some products
+    _VALUATION_INSERT = """
+        INSERT INTO pharmacy_lot_valuation (
+            date, company_id, product_id, lot_id, location_id, expiry_date,
+            expiry_bucket, quantity, unit_cost, value,
+            create_uid, create_date, write_uid, write_date
+        )
+        SELECT %(date)s, q.company_id, q.product_id, q.lot_id, q.location_id, lot.expiry_date,
+               CASE
+                   WHEN lot.expiry_date IS NULL THEN 'no_expiry'
+                   WHEN lot.expiry_date < %(date)s THEN 'expired'
+                   WHEN lot.expiry_date < %(date)s + 30 THEN 'lt30'
+                   WHEN lot.expiry_date < %(date)s + 90 THEN 'lt90'
+                   WHEN lot.expiry_date < %(date)s + 180 THEN 'lt180'
+                   ELSE 'later'
+               END,
+               SUM(q.quantity),
+               cost.unit_cost,
+               SUM(q.quantity) * cost.unit_cost,
+               %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+          FROM stock_quant q
+          JOIN stock_location sl ON sl.id = q.location_id AND sl.usage = 'internal'
+          JOIN product_product pp ON pp.id = q.product_id
+     LEFT JOIN stock_lot lot ON lot.id = q.lot_id
+         CROSS JOIN LATERAL (
+               SELECT COALESCE(
+                   NULLIF(lot.purchase_price, 0),
+                   (pp.standard_price ->> q.company_id::text)::float,
+                   0
+               ) AS unit_cost
+         ) cost
+         WHERE q.quantity != 0
+           {where}
+      GROUP BY q.company_id, q.product_id, q.lot_id, q.location_id, lot.expiry_date, cost.unit_cost
+    """
+
+    @api.model
+    def _refresh_snapshot(self, date=None, product_ids=None):
+        """(Re)build the snapshot of a day, fully or for some products only"""
+        date = date or fields.Date.context_today(self)
+        self.env['stock.quant'].flush_model(['quantity', 'location_id', 'lot_id', 'product_id'])
+        self.env['stock.lot'].flush_model(['purchase_price', 'expiry_date'])
+        self.flush_model()
+        params = {'date': date, 'uid': self.env.uid}
+        cr = self.env.cr
+        if product_ids is None:
+            cr.execute("DELETE FROM pharmacy_lot_valuation WHERE date = %s", [date])
+            cr.execute(self._VALUATION_INSERT.format(where=''), params)
+        else:
+            params['product_ids'] = list(product_ids)
+            cr.execute(
+                "DELETE FROM pharmacy_lot_valuation WHERE date = %(date)s AND product_id = ANY(%(product_ids)s)",
+                params,
+            )
+            cr.execute(self._VALUATION_INSERT.format(where='AND q.product_id = ANY(%(product_ids)s)'), params)
+        self.invalidate_model()
+
+    @api.model
+    def _snapshot_exists(self, date=None):
+        self.flush_model(['date'])
+        self.env.cr.execute(
+            "SELECT 1 FROM pharmacy_lot_valuation WHERE date = %s LIMIT 1",
+            [date or fields.Date.context_today(self)],
+        )
+        return bool(self.env.cr.fetchone())
+
+    @api.model
+    def _update_products(self, product_ids):
+        """Incremental refresh after stock moves; no-op before today's build"""
+        if product_ids and self._snapshot_exists():
+            self._refresh_snapshot(product_ids=product_ids)
+
+    @api.model
+    def _cron_rebuild(self):
+        """Nightly job: build today's snapshot and drop old ones"""
+        today = fields.Date.context_today(self)
+        self._refresh_snapshot(today)
+        self.env.cr.execute(
+            "DELETE FROM pharmacy_lot_valuation WHERE date < %s",
+            [today - timedelta(days=VALUATION_RETENTION_DAYS)],
+        )
+        self.invalidate_model()
+
+    @api.model
+    def action_open_dashboard(self):
+        """Open today's valuation, building it on first use of the day"""
+        today = fields.Date.context_today(self)
+        if not self._snapshot_exists(today):
+            self._refresh_snapshot(today)
+        return {
+            'name': _('Expiry Write-off Valuation'),
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'view_mode': 'list,pivot',
+            'domain': [('date', '=', today)],
+            'context': {'group_by': ['expiry_bucket']},
+        }
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from datetime import datetime, timedelta
+import base64
+import logging
+import re
+import threading
+import time
+import uuid
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+MPESA_BASE_URLS = {
+    'sandbox': 'https://sandbox.safaricom.co.ke',
+    'production': 'https://api.safaricom.co.ke',
+}
+MPESA_TIMEOUT = 10
+# Daraja timestamps are in East Africa Time
+MPESA_UTC_OFFSET = timedelta(hours=3)
+
+# OAuth tokens are shared by all threads of the worker until they expire
+_token_cache = {}
+_token_lock = threading.Lock()
+
+
+def normalize_msisdn(phone):
+    """Return a phone number in Daraja 2547XXXXXXXX format"""
+    digits = re.sub(r'\D', '', phone or '')
+    if digits.startswith('0'):
+        digits = '254' + digits[1:]
+    elif len(digits) == 9:
+        digits = '254' + digits
+    return digits
+
+
+class PosMpesaRequest(models.Model):
+    """One STK push sent to a customer's phone"""
+    _name = 'pos.mpesa.request'
+    _description = 'M-PESA STK Push Request'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(
+        string='Checkout Request ID',
+        readonly=True,
+        index=True
+    )
+    merchant_request_id = fields.Char(
+        string='Merchant Request ID',
+        readonly=True
+    )
+    config_id = fields.Many2one(
+        'pos.config',
+        string='Point of Sale',
+        required=True,
+        readonly=True
+    )
+    session_id = fields.Many2one(
+        'pos.session',
+        string='Session',
+        readonly=True
+    )
+    phone = fields.Char(
+        string='Phone Number',
+        required=True,
+        readonly=True
+    )
+    amount = fields.Float(
+        string='Amount',
+        required=True,
+        readonly=True
+    )
+    account_reference = fields.Char(
+        string='Account Reference',
+        readonly=True
+    )
+    state = fields.Selection([
+        ('pending', 'Waiting for Customer'),
+        ('paid', 'Paid'),
+        ('failed', 'Failed'),
+        ('timeout', 'Timed Out'),
+    ], string='Status', default='pending', required=True, readonly=True, index=True)
+    result_code = fields.Char(string='Result Code', readonly=True)
+    result_desc = fields.Char(string='Result Description', readonly=True)
+    mpesa_receipt = fields.Char(
+        string='M-PESA Receipt',
+        readonly=True,
+        index=True
+    )
+    transaction_date = fields.Datetime(string='Transaction Date', readonly=True)
+    callback_token = fields.Char(
+        string='Callback Token',
+        readonly=True,
+        copy=False,
+        default=lambda self: uuid.uuid4().hex
+    )
+
+    _sql_constraints = [
+        ('callback_token_unique', 'unique(callback_token)', 'Callback token must be unique'),
+    ]
+
+    # ------------------------------------------------------------------
+    # Daraja API
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _mpesa_base_url(self, config):
+        """Daraja base URL for the config's environment"""
+        if config.mpesa_environment == 'simulator':
+            return self.env['ir.config_parameter'].sudo().get_param(
+                'pos_demo.mpesa_simulator_url', 'http://127.0.0.1:8099'
+            ).rstrip('/')
+        return MPESA_BASE_URLS[config.mpesa_environment or 'sandbox']
+
+    @api.model
+    def _mpesa_get_token(self, config):
+        """OAuth access token, cached per worker until shortly before expiry
+
+        The lock only guards the cache: the HTTP fetch runs outside it so a
+        slow Daraja never blocks other threads that hold a valid token.
+        """
+        base_url = self._mpesa_base_url(config)
+        key = (base_url, config.mpesa_api_key)
+        with _token_lock:
+            token, expires_at = _token_cache.get(key, (None, 0))
+        if token and expires_at > time.monotonic():
+            return token
+
+        response = requests.get(
+            f'{base_url}/oauth/v1/generate',
+            params={'grant_type': 'client_credentials'},
+            auth=(config.mpesa_api_key or '', config.mpesa_api_secret or ''),
+            timeout=MPESA_TIMEOUT,
+        )
+        response.raise_for_status()
+        data = response.json()
+        token = data['access_token']
+        # Refresh a minute early so a token never expires mid-request
+        lifetime = int(data.get('expires_in') or 3599)
+        expires_at = time.monotonic() + max(lifetime - 60, 0)
+        with _token_lock:
+            # Another thread may have stored a token while we were fetching
+            cached, cached_expires_at = _token_cache.get(key, (None, 0))
+            if cached and cached_expires_at >= expires_at:
+                return cached
+            _token_cache[key] = (token, expires_at)
+        return token
+
+    @api.model
+    def _mpesa_clear_token(self, config):
+        """Drop a cached token rejected by Daraja"""
+        with _token_lock:
+            _token_cache.pop((self._mpesa_base_url(config), config.mpesa_api_key), None)
+
+    def _mpesa_callback_url(self):
+        self.ensure_one()
+        base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
+        return f'{base_url}/pos_demo/mpesa/callback/{self.callback_token}'
+
+    def _mpesa_stk_payload(self):
+        """Daraja STK push (CustomerPayBillOnline) request body"""
+        self.ensure_one()
+        config = self.config_id
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        shortcode = config.mpesa_shortcode or config.mpesa_paybill
+        password = base64.b64encode(
+            f'{shortcode}{config.mpesa_passkey or ""}{timestamp}'.encode()
+        ).decode()
+        return {
+            'BusinessShortCode': shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'TransactionType': 'CustomerPayBillOnline',
+            'Amount': int(round(self.amount)),
+            'PartyA': self.phone,
+            'PartyB': shortcode,
+            'PhoneNumber': self.phone,
+            'CallBackURL': self._mpesa_callback_url(),
+            'AccountReference': self.account_reference or config.name,
+            'TransactionDesc': 'Pharmacy payment',
+        }
+
+    def _mpesa_send_stk_push(self):
+        """Send the push; the result arrives later on the callback route"""
+        self.ensure_one()
+        config = self.config_id
+        url = f'{self._mpesa_base_url(config)}/mpesa/stkpush/v1/processrequest'
+        payload = self._mpesa_stk_payload()
+        for attempt in range(2):
+            token = self._mpesa_get_token(config)
+            response = requests.post(
+                url,
+                json=payload,
+                headers={'Authorization': f'Bearer {token}'},
+                timeout=MPESA_TIMEOUT,
+            )
+            if response.status_code == 401 and not attempt:
+                # Token revoked before its advertised expiry
+                self._mpesa_clear_token(config)
+                continue
+            break
+
+        data = response.json() if response.content else {}
+        if response.status_code != 200 or str(data.get('ResponseCode')) != '0':
+            message = data.get('errorMessage') or data.get('ResponseDescription') or response.reason
+            self.write({
+                'state': 'failed',
+                'result_code': str(data.get('ResponseCode') or data.get('errorCode') or response.status_code),
+                'result_desc': message,
+            })
+            return
+        self.write({
+            'name': data['CheckoutRequestID'],
+            'merchant_request_id': data.get('MerchantRequestID'),
+        })
+
+    # ------------------------------------------------------------------
+    # POS entry points
+    # ------------------------------------------------------------------
+
+    @api.model
+    def create_stk_push(self, config_id, amount, phone, reference=None):
+        """Start an STK push for the POS and return immediately"""
+        config = self.env['pos.config'].browse(config_id)
+        if not config.mpesa_enabled:
+            raise UserError(_('M-PESA payments are not enabled on %s') % config.name)
+        if amount <= 0:
+            raise UserError(_('M-PESA amount must be positive'))
+
+        mpesa_request = self.sudo().create({
+            'config_id': config.id,
+            'session_id': config.current_session_id.id,
+            'phone': normalize_msisdn(phone),
+            'amount': amount,
+            'account_reference': reference,
+        })
+        try:
+            mpesa_request._mpesa_send_stk_push()
+        except requests.RequestException as e:
+            _logger.error("M-PESA STK push error: %s", e)
+            mpesa_request.write({'state': 'failed', 'result_desc': str(e)})
+        return mpesa_request._get_pos_status()
+
+    @api.model
+    def get_pos_status(self, config_id, request_ids):
+        """Non-blocking status check used when the bus is unavailable
+
+        Only requests the caller started from this till are returned.
+        """
+        config = self.env['pos.config'].browse(config_id)
+        config.check_access_rights('read')
+        config.check_access_rule('read')
+        requests_ = self.sudo().search([
+            ('id', 'in', request_ids),
+            ('config_id', '=', config.id),
+            ('create_uid', '=', self.env.uid),
+        ])
+        return [r._get_pos_status() for r in requests_]
+
+    def _get_pos_status(self):
+        self.ensure_one()
+        return {
+            'id': self.id,
+            'state': self.state,
+            'amount': self.amount,
+            'phone': self.phone,
+            'mpesa_receipt': self.mpesa_receipt,
+            'result_desc': self.result_desc,
+        }
+
+    def _notify_pos(self):
+        """Push the final status to the till that started the request"""
+        for mpesa_request in self:
+            self.env['bus.bus']._sendone(
+                mpesa_request.config_id.access_token,
+                'MPESA_STK_RESULT',
+                mpesa_request._get_pos_status(),
+            )
+
+    # ------------------------------------------------------------------
+    # Callback
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _process_callback(self, callback_token, data):
+        """Record the Daraja stkCallback result for a request"""
+        callback = (data.get('Body') or {}).get('stkCallback') or {}
+        mpesa_request = self.sudo().search([
+            ('callback_token', '=', callback_token),
+            ('name', '=', callback.get('CheckoutRequestID')),
+        ], limit=1)
+        if not mpesa_request:
+            _logger.warning("M-PESA callback for unknown request %s", callback.get('CheckoutRequestID'))
+            return False
+        if mpesa_request.state != 'pending':
+            # Daraja retries callbacks; the first one wins
+            return True
+
+        items = {
+            item.get('Name'): item.get('Value')
+            for item in (callback.get('CallbackMetadata') or {}).get('Item', [])
+        }
+        vals = {
+            'result_code': str(callback.get('ResultCode')),
+            'result_desc': callback.get('ResultDesc'),
+        }
+        if str(callback.get('ResultCode')) == '0':
+            vals.update({
+                'state': 'paid',
+                'mpesa_receipt': items.get('MpesaReceiptNumber'),
+            })
+            if items.get('TransactionDate'):
+                vals['transaction_date'] = datetime.strptime(
+                    str(items['TransactionDate']), '%Y%m%d%H%M%S'
+                ) - MPESA_UTC_OFFSET
+        else:
+            vals['state'] = 'failed'
+        mpesa_request.write(vals)
+        if vals['state'] == 'paid':
+            # Orders synced before the callback arrived
+            self.env['pos.payment'].sudo().search([
+                ('mpesa_request_id', '=', mpesa_request.id),
+                ('mpesa_transaction_id', '=', False),
+            ]).write({'mpesa_transaction_id': mpesa_request.mpesa_receipt})
+        mpesa_request._notify_pos()
+        return True
+
+    @api.model
+    def _cron_expire_pending(self, minutes=5):
+        """Time out pushes the customer never answered"""
+        stale = self.search([
+            ('state', '=', 'pending'),
+            ('create_date', '<', fields.Datetime.now() - timedelta(minutes=minutes)),
+        ])
+        stale.write({'state': 'timeout', 'result_desc': 'No response from customer'})
+        stale._notify_pos()
@@ -81,6 +81,13 @@ class PosConfig(models.Model):
         help='Check patient purchases within this many days for interactions'
     )
     
+    # Session Closing
+    background_session_close = fields.Boolean(
+        string='Close Sessions in Background',
+        help='Closing the till queues the session close; accounting, stock and '
+             'pharmacy records are finished by the server while the cashier leaves'
+    )
+    
     # KRA ETR Integration
     etr_enabled = fields.Boolean(
         string='Enable ETR Integration',
@@ -111,32 +118,50 @@ class PosConfig(models.Model):
     mpesa_environment = fields.Selection([
         ('sandbox', 'Sandbox/Test'),
         ('production', 'Production'),
+        ('simulator', 'Local Simulator'),
     ], string='M-PESA Environment', default='sandbox')
 
     @api.depends('session_ids', 'session_ids.stop_at')
     def _compute_last_session(self):
         """
-        Override to handle cases where stop_at is False (open sessions).
-        This prevents AttributeError when trying to call astimezone() on a boolean.
+        Resolve the last closed session of every config in one query.
+        Open sessions have no stop_at and are skipped, which also prevents
+        AttributeError when calling astimezone() on a boolean.
         """
-        for pos_config in self:
-            session = self.env['pos.session'].search(
-                [('config_id', '=', pos_config.id)],
-                order='stop_at desc',
-                limit=1
+        last_sessions = {}
+        config_ids = [config_id for config_id in self._origin.ids if config_id]
+        if config_ids:
+            # Served by pos_session_config_stop_at_closed_idx
+            self.env['pos.session'].flush_model(
+                ['config_id', 'state', 'stop_at', 'cash_register_balance_end_real']
             )
-            if session and session.stop_at:
-                # Only process if stop_at is actually set (not False)
-                timezone = dt_timezone.utc
-                if self.env.user.tz:
-                    try:
-                        from zoneinfo import ZoneInfo
-                        timezone = ZoneInfo(self.env.user.tz)
-                    except Exception:
-                        pass
-                pos_config.last_session_closing_date = session.stop_at.astimezone(timezone).date()
-                pos_config.last_session_closing_cash = session.cash_register_balance_end_real
+            self.env.cr.execute("""
+                SELECT DISTINCT ON (config_id)
+                       config_id, stop_at, cash_register_balance_end_real
+                  FROM pos_session
+                 WHERE config_id = ANY(%s)
+                   AND state = 'closed'
+                   AND stop_at IS NOT NULL
+              ORDER BY config_id, stop_at DESC
+            """, [config_ids])
+            last_sessions = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+        
+        timezone = dt_timezone.utc
+        if self.env.user.tz:
+            try:
+                from zoneinfo import ZoneInfo
+                timezone = ZoneInfo(self.env.user.tz)
+            except Exception:
+                pass
+        
+        for pos_config in self:
+            stop_at, closing_cash = last_sessions.get(pos_config._origin.id, (False, 0))
+            if stop_at:
+                # stop_at is a naive UTC datetime in the database
+                stop_at = stop_at.replace(tzinfo=dt_timezone.utc)
+                pos_config.last_session_closing_date = stop_at.astimezone(timezone).date()
+                pos_config.last_session_closing_cash = closing_cash or 0
             else:
-                # Session is open or doesn't exist
+                # No closed session yet
                 pos_config.last_session_closing_date = False
                 pos_config.last_session_closing_cash = 0
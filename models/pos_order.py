@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+import logging
+
+_logger = logging.getLogger(__name__)
 
 
 class PosOrder(models.Model):
@@ -65,6 +68,19 @@ class PosOrder(models.Model):
         store=True
     )
     
+    # KRA ETR fiscal receipt
+    etr_state = fields.Selection([
+        ('pending', 'Pending'),
+        ('signed', 'Signed'),
+        ('failed', 'Failed'),
+    ], string='ETR Status', readonly=True, copy=False)
+    etr_invoice_number = fields.Char(
+        string='ETR Invoice Number',
+        readonly=True,
+        copy=False,
+        help='Fiscal number assigned by the ETR control unit'
+    )
+    
     @api.depends('lines.product_id.product_tmpl_id.requires_prescription')
     def _compute_prescription_items(self):
         """Check if order contains prescription-only items"""
@@ -125,13 +141,21 @@ class PosOrder(models.Model):
     def _create_insurance_claim(self):
         """Create insurance claim for orders with insurance"""
         InsuranceClaim = self.env['insurance.claim']
+        Provider = self.env['insurance.provider']
         
         for order in self:
             if order.insurance_provider_id and not order.insurance_claim_id:
+                # The sale is done: an archived provider is reported, not refused
+                terms = Provider._resolve_provider(order.insurance_provider_id.id)
+                if not terms or not terms['active']:
+                    _logger.warning("Order %s: no claim created, insurance provider %s is unknown or archived",
+                                    order.name, order.insurance_provider_id.id)
+                    continue
+                
                 # Create claim
                 claim = InsuranceClaim.create({
                     'patient_id': order.partner_id.id,
-                    'insurance_provider_id': order.insurance_provider_id.id,
+                    'insurance_provider_id': terms['id'],
                     'member_number': order.insurance_member_number,
                     'patient_copay': order.patient_copay,
                     'pos_order_id': order.id,
@@ -150,8 +174,9 @@ class PosOrder(models.Model):
                 # Link claim to order
                 order.insurance_claim_id = claim.id
                 
-                # Auto-submit if configured
-                if order.session_id.config_id.auto_create_insurance_claim:
+                # Auto-submit if configured, unless the insurer needs a pre-authorization first
+                if (order.session_id.config_id.auto_create_insurance_claim
+                        and not InsuranceClaim._needs_preauth(terms, order.insurance_amount or 0.0)):
                     claim.action_submit()
     
     def _update_prescription_dispensed_quantity(self):
@@ -169,6 +194,47 @@ class PosOrder(models.Model):
                 # Update prescription state
                 order.prescription_id.action_dispense()
     
+    def _prepare_etr_payload(self):
+        """Receipt data sent to the ETR control unit"""
+        self.ensure_one()
+        return {
+            'reference': self.pos_reference or self.name,
+            'date': fields.Datetime.to_string(self.date_order),
+            'customer_pin': self.partner_id.vat or '',
+            'lines': [{
+                'description': line.full_product_name or line.product_id.display_name,
+                'quantity': line.qty,
+                'unit_price': line.price_unit,
+                'discount': line.discount,
+                'total_excluded': line.price_subtotal,
+                'total_included': line.price_subtotal_incl,
+                'tax_rates': line.tax_ids_after_fiscal_position.mapped('amount'),
+            } for line in self.lines],
+            'amount_tax': self.amount_tax,
+            'amount_total': self.amount_total,
+        }
+    
+    @api.model
+    def _payment_fields(self, order, ui_paymentline):
+        """Keep the M-PESA confirmation sent by the till
+
+        Payments collected by an STK push take the receipt from the request
+        confirmed by Daraja rather than from the till.
+        """
+        fields_vals = super()._payment_fields(order, ui_paymentline)
+        if ui_paymentline.get('mpesa_request_id'):
+            mpesa_request = self.env['pos.mpesa.request'].sudo().browse(ui_paymentline['mpesa_request_id']).exists()
+            if mpesa_request:
+                fields_vals['mpesa_request_id'] = mpesa_request.id
+                fields_vals['mpesa_phone'] = mpesa_request.phone
+                if mpesa_request.state == 'paid':
+                    fields_vals['mpesa_transaction_id'] = mpesa_request.mpesa_receipt
+                return fields_vals
+        if ui_paymentline.get('mpesa_transaction_id'):
+            fields_vals['mpesa_transaction_id'] = ui_paymentline['mpesa_transaction_id']
+            fields_vals['mpesa_phone'] = ui_paymentline.get('mpesa_phone')
+        return fields_vals
+    
     @api.model
     def create(self, vals):
         """Override create to handle pharmacy-specific logic"""
@@ -177,6 +243,7 @@ class PosOrder(models.Model):
     
     def write(self, vals):
         """Override write to handle state changes"""
+        newly_paid = self.filtered(lambda o: o.state != 'paid') if vals.get('state') == 'paid' else self.browse()
         res = super().write(vals)
         
         # Handle order confirmation
@@ -193,6 +260,15 @@ class PosOrder(models.Model):
                 # Update prescription
                 if order.prescription_id:
                     order._update_prescription_dispensed_quantity()
+            
+            # Queue fiscal receipts; the POS prints without waiting for the CU
+            self.env['pos.etr.queue']._enqueue_orders(newly_paid)
+            
+            # Lot holds stay until the stock leaves, possibly at session closing
+            self.env['pos.lot.reservation']._keep_for_orders(newly_paid)
+            
+            # X/Z report figures
+            self.env['pos.session.totals']._add_orders(newly_paid)
         
         return res
 
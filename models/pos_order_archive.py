@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.tools import html_escape
+from datetime import timedelta
+import base64
+import json
+import logging
+import threading
+import zlib
+
+import psycopg2
+
+_logger = logging.getLogger(__name__)
+
+# Orders younger than this stay in the live POS tables
+DEFAULT_RETENTION_DAYS = 730
+
+ORDER_LINE_FIELDS = [
+    'product_id', 'full_product_name', 'qty', 'price_unit', 'discount',
+    'price_subtotal', 'price_subtotal_incl', 'tax_ids_after_fiscal_position',
+    'lot_id', 'uuid', 'customer_note',
+]
+PAYMENT_FIELDS = [
+    'payment_method_id', 'amount', 'payment_date', 'card_type', 'transaction_id',
+    'insurance_provider_id', 'insurance_member_number', 'mpesa_transaction_id', 'mpesa_phone',
+]
+
+
+class PosOrderArchive(models.Model):
+    """Closed POS order moved out of the live tables
+
+    The header is kept in columns for searching; lines, payments and lot
+    numbers are stored as one zlib-compressed JSON document.
+    """
+    _name = 'pos.order.archive'
+    _description = 'Archived POS Order'
+    _order = 'date_order desc, id desc'
+
+    _sql_constraints = [
+        ('original_id_unique', 'unique(original_id)', 'A POS order can only be archived once'),
+    ]
+
+    original_id = fields.Integer(string='Original Order ID', required=True, readonly=True, index=True)
+    name = fields.Char(string='Order Ref', readonly=True)
+    pos_reference = fields.Char(string='Receipt Number', readonly=True, index=True)
+    date_order = fields.Datetime(string='Date', readonly=True, index=True)
+    state = fields.Char(string='Status', readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    config_id = fields.Many2one('pos.config', string='Point of Sale', readonly=True)
+    session_id = fields.Many2one('pos.session', string='Session', readonly=True)
+    user_id = fields.Many2one('res.users', string='Cashier', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Customer', readonly=True, index=True)
+    prescription_id = fields.Many2one('pharmacy.prescription', string='Prescription', readonly=True, index=True)
+    insurance_claim_id = fields.Many2one('insurance.claim', string='Insurance Claim', readonly=True)
+    insurance_provider_id = fields.Many2one('insurance.provider', string='Insurance Provider', readonly=True)
+    etr_invoice_number = fields.Char(string='ETR Invoice Number', readonly=True)
+    amount_tax = fields.Float(string='Taxes', readonly=True)
+    amount_total = fields.Float(string='Total', readonly=True)
+    amount_paid = fields.Float(string='Paid', readonly=True)
+    line_count = fields.Integer(string='Lines', readonly=True)
+    payment_count = fields.Integer(string='Payments', readonly=True)
+    data = fields.Binary(string='Compressed Details', attachment=False, readonly=True)
+    details_html = fields.Html(string='Details', compute='_compute_details_html', sanitize=False)
+
+    # ------------------------------------------------------------------
+    # Compressed details
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _pack(self, payload):
+        return base64.b64encode(zlib.compress(json.dumps(payload, default=str).encode(), 9))
+
+    def get_details(self):
+        """Lines and payments of the archived order, as stored"""
+        self.ensure_one()
+        if not self.data:
+            return {'lines': [], 'payments': []}
+        return json.loads(zlib.decompress(base64.b64decode(self.data)))
+
+    def _compute_details_html(self):
+        for archive in self:
+            details = archive.get_details()
+            rows = ''.join(
+                '<tr><td>%s</td><td>%s</td><td class="text-end">%s</td><td class="text-end">%s</td>'
+                '<td class="text-end">%s</td></tr>' % (
+                    html_escape(line['full_product_name'] or (line['product_id'] or ['', ''])[1]),
+                    html_escape(', '.join(line.get('lot_names') or [])),
+                    line['qty'], line['price_unit'], line['price_subtotal_incl'],
+                ) for line in details['lines']
+            )
+            payments = ''.join(
+                '<tr><td>%s</td><td>%s</td><td class="text-end">%s</td></tr>' % (
+                    html_escape((payment['payment_method_id'] or ['', ''])[1]),
+                    html_escape(payment.get('mpesa_transaction_id') or payment.get('transaction_id') or ''),
+                    payment['amount'],
+                ) for payment in details['payments']
+            )
+            archive.details_html = (
+                '<table class="table table-sm"><thead><tr><th>%s</th><th>%s</th><th class="text-end">%s</th>'
+                '<th class="text-end">%s</th><th class="text-end">%s</th></tr></thead><tbody>%s</tbody></table>'
+                '<table class="table table-sm"><thead><tr><th>%s</th><th>%s</th><th class="text-end">%s</th>'
+                '</tr></thead><tbody>%s</tbody></table>'
+            ) % (
+                _('Product'), _('Lots'), _('Quantity'), _('Unit Price'), _('Total'), rows,
+                _('Payment Method'), _('Reference'), _('Amount'), payments,
+            )
+
+    # ------------------------------------------------------------------
+    # Archiving
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_retention_days(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param(
+            'pos_demo.pos_order_retention_days', DEFAULT_RETENTION_DAYS
+        ))
+
+    @api.model
+    def _get_archivable_order_ids(self, cutoff, limit):
+        """Orders of closed sessions with nothing left to settle"""
+        self.env['pos.order'].flush_model()
+        self.env['insurance.claim'].flush_model(['state'])
+        self.env.cr.execute("""
+            SELECT o.id
+              FROM pos_order o
+              JOIN pos_session s ON s.id = o.session_id AND s.state = 'closed'
+         LEFT JOIN insurance_claim c ON c.id = o.insurance_claim_id
+             WHERE o.state IN ('done', 'invoiced', 'cancel')
+               AND o.date_order < %s
+               AND (o.etr_state IS NULL OR o.etr_state = 'signed')
+               AND (c.id IS NULL OR c.state IN ('paid', 'rejected'))
+          ORDER BY o.id
+             LIMIT %s
+        """, [cutoff, limit])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _prepare_archive_vals(self, orders):
+        """One archive record per order, with three batched reads"""
+        lines = self.env['pos.order.line'].search_read([('order_id', 'in', orders.ids)], ORDER_LINE_FIELDS + ['order_id'])
+        payments = self.env['pos.payment'].search_read([('pos_order_id', 'in', orders.ids)], PAYMENT_FIELDS + ['pos_order_id'])
+        lot_names = {}
+        for lot in self.env['pos.pack.operation.lot'].search_read(
+                [('pos_order_line_id', 'in', [line['id'] for line in lines])], ['pos_order_line_id', 'lot_name']):
+            lot_names.setdefault(lot['pos_order_line_id'][0], []).append(lot['lot_name'])
+        taxes = {tax.id: tax.name for tax in self.env['account.tax'].browse(
+            {tax_id for line in lines for tax_id in line['tax_ids_after_fiscal_position']}
+        )}
+
+        lines_by_order, payments_by_order = {}, {}
+        for line in lines:
+            line['lot_names'] = lot_names.get(line['id'], [])
+            line['taxes'] = [taxes[tax_id] for tax_id in line.pop('tax_ids_after_fiscal_position')]
+            lines_by_order.setdefault(line.pop('order_id')[0], []).append(line)
+        for payment in payments:
+            payments_by_order.setdefault(payment.pop('pos_order_id')[0], []).append(payment)
+
+        vals_list = []
+        for order in orders:
+            order_lines = lines_by_order.get(order.id, [])
+            order_payments = payments_by_order.get(order.id, [])
+            vals_list.append({
+                'original_id': order.id,
+                'name': order.name,
+                'pos_reference': order.pos_reference,
+                'date_order': order.date_order,
+                'state': order.state,
+                'company_id': order.company_id.id,
+                'config_id': order.config_id.id,
+                'session_id': order.session_id.id,
+                'user_id': order.user_id.id,
+                'partner_id': order.partner_id.id,
+                'prescription_id': order.prescription_id.id,
+                'insurance_claim_id': order.insurance_claim_id.id,
+                'insurance_provider_id': order.insurance_provider_id.id,
+                'etr_invoice_number': order.etr_invoice_number,
+                'amount_tax': order.amount_tax,
+                'amount_total': order.amount_total,
+                'amount_paid': order.amount_paid,
+                'line_count': len(order_lines),
+                'payment_count': len(order_payments),
+                'data': self._pack({'lines': order_lines, 'payments': order_payments}),
+            })
+        return vals_list
+
+    @api.model
+    def _archive_orders(self, order_ids):
+        """Archive some orders and delete them from the live tables
+
+        Runs in a savepoint so a foreign key still pointing at an order
+        (e.g. from another module) rolls the whole batch back. The orders
+        are deleted in SQL, bypassing unlink(), so their chatter and
+        attachments are removed here explicitly.
+        """
+        orders = self.env['pos.order'].browse(order_ids)
+        try:
+            with self.env.cr.savepoint():
+                archives = self.create(self._prepare_archive_vals(orders))
+                self.flush_model()
+                # Keep side records resolvable once the order is gone
+                for table in ('insurance_claim', 'controlled_drugs_register', 'controlled_drugs_register_archive'):
+                    self.env.cr.execute("""
+                        UPDATE {table} t
+                           SET pos_order_archive_id = a.id
+                          FROM pos_order_archive a
+                         WHERE a.original_id = t.pos_order_id
+                           AND a.id = ANY(%s)
+                    """.format(table=table), [archives.ids])
+                self._unlink_order_side_records(order_ids)
+                # Lines, payments and lot numbers follow by ON DELETE CASCADE
+                self.env.cr.execute("DELETE FROM pos_order WHERE id = ANY(%s)", [list(order_ids)])
+        finally:
+            self.env.invalidate_all()
+        return archives
+
+    @api.model
+    def _unlink_order_side_records(self, order_ids):
+        """Messages, followers, activities and attachments of the orders
+
+        These only refer to an order by (model, res_id), so no cascade
+        removes them. Attachments are unlinked through the ORM so their
+        files are garbage collected from the filestore.
+        """
+        order_ids = list(order_ids)
+        self.env['mail.message'].sudo().search([
+            ('model', '=', 'pos.order'), ('res_id', 'in', order_ids),
+        ]).unlink()
+        for model in ('mail.followers', 'mail.activity'):
+            self.env[model].sudo().search([
+                ('res_model', '=', 'pos.order'), ('res_id', 'in', order_ids),
+            ]).unlink()
+        self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', 'pos.order'), ('res_id', 'in', order_ids),
+            '|', ('res_field', '=', False), ('res_field', '!=', False),
+        ]).unlink()
+
+    @api.model
+    def archive_orders(self, retention_days=None, batch_size=500, max_batches=None, auto_commit=False):
+        """Move closed orders older than the retention window to the archive
+
+        Returns:
+            dict: archived count and {order id: error} of orders left live
+        """
+        retention_days = retention_days or self._get_retention_days()
+        cutoff = fields.Datetime.now() - timedelta(days=retention_days)
+        archived, failed, batches = 0, {}, 0
+        while max_batches is None or batches < max_batches:
+            order_ids = [i for i in self._get_archivable_order_ids(cutoff, batch_size + len(failed))
+                         if i not in failed][:batch_size]
+            if not order_ids:
+                break
+            batches += 1
+            try:
+                archived += len(self._archive_orders(order_ids))
+            except psycopg2.Error:
+                # Isolate the orders the database refuses to delete
+                for order_id in order_ids:
+                    try:
+                        archived += len(self._archive_orders([order_id]))
+                    except psycopg2.Error as e:
+                        failed[order_id] = str(e)
+                        _logger.warning("POS order %s not archived: %s", order_id, e)
+            if auto_commit:
+                self.env.cr.commit()
+        _logger.info("Archived %d POS order(s) older than %d days, %d left live", archived, retention_days, len(failed))
+        return {'archived': archived, 'failed': failed}
+
+    @api.model
+    def _cron_archive_orders(self, batch_size=500, max_batches=20):
+        self.archive_orders(batch_size=batch_size, max_batches=max_batches,
+                            auto_commit=not getattr(threading.current_thread(), 'testing', False))
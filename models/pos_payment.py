@@ -16,6 +16,39 @@ class PosPaymentMethod(models.Model):
         string='Linked Insurance Providers',
         help='Insurance providers that use this payment method'
     )
+    payment_category = fields.Selection([
+        ('cash', 'Cash'),
+        ('card', 'Card/Bank'),
+        ('mpesa', 'M-PESA'),
+        ('insurance', 'Insurance'),
+        ('other', 'Other'),
+    ], string='Payment Category',
+        compute='_compute_payment_category',
+        store=True,
+        readonly=False,
+        index=True,
+        help='Which session total this payment method counts towards'
+    )
+    
+    @api.depends('is_insurance', 'is_cash_count')
+    def _compute_payment_category(self):
+        """Suggest a category once; renaming the method does not change it"""
+        for method in self:
+            if method.is_insurance:
+                method.payment_category = 'insurance'
+            elif method.is_cash_count:
+                method.payment_category = 'cash'
+            elif method.payment_category not in (False, 'insurance', 'cash'):
+                # Keep the category chosen by the user
+                continue
+            else:
+                name = (method.name or '').lower()
+                if 'mpesa' in name or 'm-pesa' in name or 'mobile' in name:
+                    method.payment_category = 'mpesa'
+                elif method.type == 'bank':
+                    method.payment_category = 'card'
+                else:
+                    method.payment_category = 'other'
     
     @api.constrains('is_insurance', 'is_cash_count')
     def _check_insurance_not_cash(self):
@@ -52,16 +85,36 @@ class PosPayment(models.Model):
         compute='_compute_is_insurance',
         store=True
     )
+    payment_category = fields.Selection(
+        related='payment_method_id.payment_category',
+        store=True,
+        index=True
+    )
     
     # M-PESA payment details
     mpesa_transaction_id = fields.Char(
         string='M-PESA Transaction ID',
-        help='M-PESA confirmation code'
+        help='M-PESA confirmation code',
+        index=True
     )
     mpesa_phone = fields.Char(
         string='M-PESA Phone Number',
         help='Phone number used for M-PESA payment'
     )
+    mpesa_request_id = fields.Many2one(
+        'pos.mpesa.request',
+        string='M-PESA Request',
+        readonly=True,
+        copy=False,
+        index='btree_not_null',
+        help='STK push that collected this payment'
+    )
+    mpesa_reconciled = fields.Boolean(
+        string='M-PESA Reconciled',
+        readonly=True,
+        copy=False,
+        help='Matched against the M-PESA paybill statement'
+    )
     
     @api.depends('payment_method_id', 'payment_method_id.is_insurance')
     def _compute_is_insurance(self):
@@ -78,9 +131,10 @@ class PosPayment(models.Model):
             # Auto-create insurance claim for insurance payments
             if payment.is_insurance_payment and not payment.insurance_claim_id:
                 if payment.pos_order_id and payment.insurance_provider_id:
+                    terms = self.env['insurance.claim']._get_claim_provider_terms(payment.insurance_provider_id.id)
                     claim = self.env['insurance.claim'].create({
                         'patient_id': payment.pos_order_id.partner_id.id,
-                        'insurance_provider_id': payment.insurance_provider_id.id,
+                        'insurance_provider_id': terms['id'],
                         'member_number': payment.insurance_member_number or '',
                         'preauth_number': payment.insurance_preauth,
                         'patient_copay': payment.pos_order_id.patient_copay or 0.0,
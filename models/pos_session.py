@@ -1,6 +1,16 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import create_index
+import json
+import logging
+import threading
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+# Orders handled per commit while closing in the background
+CLOSE_BATCH_SIZE = 100
 
 
 class PosSession(models.Model):
@@ -73,35 +83,53 @@ class PosSession(models.Model):
         store=True
     )
     
-    @api.depends('order_ids', 'order_ids.payment_ids', 'order_ids.payment_ids.amount', 
-                 'order_ids.payment_ids.payment_method_id')
+    totals_ids = fields.One2many(
+        'pos.session.totals',
+        'session_id',
+        string='Running Totals'
+    )
+    
+    # Background closing
+    close_state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Background Close', readonly=True, copy=False, index=True)
+    close_progress = fields.Integer(string='Close Progress', readonly=True, copy=False)
+    close_step = fields.Char(string='Close Step', readonly=True, copy=False)
+    close_error = fields.Text(string='Close Error', readonly=True, copy=False)
+    close_params = fields.Text(string='Close Parameters', readonly=True, copy=False)
+    close_requested_by = fields.Many2one('res.users', string='Close Requested By', readonly=True, copy=False)
+    
+    # KRA ETR
+    etr_backlog_count = fields.Integer(
+        string='ETR Backlog',
+        compute='_compute_etr_backlog_count',
+        help='Fiscal receipts not yet signed by the ETR control unit'
+    )
+    
+    def _compute_etr_backlog_count(self):
+        """Count unsigned fiscal receipts with one grouped query"""
+        counts = {
+            session.id: count
+            for session, count in self.env['pos.etr.queue']._read_group(
+                [('session_id', 'in', self.ids), ('state', 'in', ['pending', 'failed'])],
+                groupby=['session_id'],
+                aggregates=['__count'],
+            )
+        }
+        for session in self:
+            session.etr_backlog_count = counts.get(session.id, 0)
+    
+    @api.depends('totals_ids.card_total', 'totals_ids.mpesa_total', 'totals_ids.insurance_total')
     def _compute_closing_totals(self):
-        """Compute totals by payment method"""
+        """Read the totals by payment category from the running totals"""
         for session in self:
-            card_total = 0.0
-            mpesa_total = 0.0
-            insurance_total = 0.0
-            
-            # Get all payments from orders in this session
-            for order in session.order_ids:
-                for payment in order.payment_ids:
-                    payment_method = payment.payment_method_id
-                    if payment_method:
-                        # Check if it's a bank/card payment
-                        if hasattr(payment_method, 'type') and payment_method.type == 'bank':
-                            if 'mpesa' in payment_method.name.lower() or 'mobile' in payment_method.name.lower():
-                                mpesa_total += payment.amount
-                            else:
-                                card_total += payment.amount
-                        # Check for insurance payment
-                        elif hasattr(payment_method, 'is_insurance') and payment_method.is_insurance:
-                            insurance_total += payment.amount
-                        elif payment_method.name and 'insurance' in payment_method.name.lower():
-                            insurance_total += payment.amount
-                    
-            session.closing_card_total = card_total
-            session.closing_mpesa_total = mpesa_total
-            session.closing_insurance_total = insurance_total
+            totals = session.totals_ids[:1]
+            session.closing_card_total = totals.card_total
+            session.closing_mpesa_total = totals.mpesa_total
+            session.closing_insurance_total = totals.insurance_total
     
     @api.depends('cash_register_balance_end_real', 'cash_register_balance_end', 'closing_cash_counted')
     def _compute_cash_difference(self):
@@ -114,29 +142,34 @@ class PosSession(models.Model):
             else:
                 session.cash_difference = 0.0
     
-    @api.depends('order_ids', 'order_ids.amount_total', 'order_ids.has_prescription_items', 
-                 'order_ids.insurance_amount')
+    @api.depends('totals_ids.total_sales', 'totals_ids.prescription_sales',
+                 'totals_ids.otc_sales', 'totals_ids.insurance_sales')
     def _compute_session_summary(self):
-        """Compute session sales summaries"""
+        """Read the session sales summaries from the running totals"""
         for session in self:
-            total = 0.0
-            prescription = 0.0
-            otc = 0.0
-            insurance = 0.0
-            
-            for order in session.order_ids:
-                total += order.amount_total
-                insurance += order.insurance_amount or 0.0
-                
-                if order.has_prescription_items:
-                    prescription += order.amount_total
-                else:
-                    otc += order.amount_total
-                    
-            session.total_sales = total
-            session.prescription_sales = prescription
-            session.otc_sales = otc
-            session.insurance_sales = insurance
+            totals = session.totals_ids[:1]
+            session.total_sales = totals.total_sales
+            session.prescription_sales = totals.prescription_sales
+            session.otc_sales = totals.otc_sales
+            session.insurance_sales = totals.insurance_sales
+    
+    @api.model
+    def _get_totals_summary_fields(self):
+        """Stored fields computed from pos.session.totals"""
+        return [
+            'total_sales', 'prescription_sales', 'otc_sales', 'insurance_sales',
+            'closing_card_total', 'closing_mpesa_total', 'closing_insurance_total',
+        ]
+    
+    def init(self):
+        """Index backing the last closed session lookup on pos.config"""
+        create_index(
+            self.env.cr,
+            'pos_session_config_stop_at_closed_idx',
+            self._table,
+            ['config_id', 'stop_at DESC'],
+            where="state = 'closed' AND stop_at IS NOT NULL",
+        )
     
     def action_pos_session_open(self):
         """Override to enforce opening balance entry"""
@@ -146,12 +179,181 @@ class PosSession(models.Model):
                 raise ValidationError(_('Please enter the opening cash amount before opening the session.'))
         return super(PosSession, self).action_pos_session_open()
     
-    def action_pos_session_closing_control(self):
-        """Override to enforce closing cash count"""
+    def _loader_params_pos_payment_method(self):
+        """The till starts STK pushes for M-PESA payment lines"""
+        params = super()._loader_params_pos_payment_method()
+        params['search_params']['fields'].append('payment_category')
+        return params
+    
+    def _check_pharmacy_closing(self):
         for session in self:
             if session.config_id.cash_control and session.closing_cash_counted == 0 and not session.closing_cash_counted:
                 raise ValidationError(_('Please count and enter the closing cash amount before closing the session.'))
-        return super(PosSession, self).action_pos_session_closing_control()
+    
+    def action_pos_session_closing_control(self, *args, **kwargs):
+        """Override to enforce closing cash count"""
+        self._check_pharmacy_closing()
+        # The Z report must match the orders exactly
+        self.env['pos.session.totals'].reconcile(self.ids)
+        return super(PosSession, self).action_pos_session_closing_control(*args, **kwargs)
+    
+    # ------------------------------------------------------------------
+    # Background closing
+    # ------------------------------------------------------------------
+    
+    def close_session_from_ui(self, bank_payment_method_diff_pairs=None):
+        """Queue the close instead of running it in the cashier's request"""
+        if not self.config_id.background_session_close:
+            return super().close_session_from_ui(bank_payment_method_diff_pairs)
+        self.ensure_one()
+        bank_payment_method_diffs = dict(bank_payment_method_diff_pairs or [])
+        check_closing_session = self._cannot_close_session(bank_payment_method_diffs)
+        if check_closing_session:
+            return check_closing_session
+        self._check_pharmacy_closing()
+        self._queue_close(bank_payment_method_diffs)
+        return {'successful': True}
+    
+    def _queue_close(self, bank_payment_method_diffs=None):
+        for session in self:
+            if session.state == 'closed' or session.close_state in ('queued', 'running'):
+                continue
+            vals = {
+                'close_state': 'queued',
+                'close_progress': 0,
+                'close_step': _('Waiting for the server'),
+                'close_error': False,
+                'close_params': json.dumps(bank_payment_method_diffs or {}),
+                'close_requested_by': self.env.uid,
+            }
+            if session.state != 'closing_control':
+                # No more orders on this till; stop_at as the standard close does
+                vals.update(state='closing_control', stop_at=fields.Datetime.now())
+            session.write(vals)
+        self.env.ref('pos_demo.ir_cron_pos_session_close')._trigger()
+    
+    def action_close_in_background(self):
+        """Queue the close of sessions from the backend"""
+        self._check_pharmacy_closing()
+        self._queue_close()
+        return True
+    
+    def action_retry_close(self):
+        """Queue a failed background close again (done steps are skipped)"""
+        for session in self.filtered(lambda s: s.close_state == 'failed'):
+            session._queue_close(json.loads(session.close_params or '{}'))
+        return True
+    
+    @api.model
+    def _cron_close_sessions(self, limit=5):
+        for session in self.search([('close_state', '=', 'queued')], order='stop_at, id', limit=limit):
+            session._close_in_background(auto_commit=not getattr(threading.current_thread(), 'testing', False))
+    
+    def _get_close_steps(self):
+        """(label, method) of the background close, each safe to run again"""
+        return [
+            (_('Creating insurance claims'), self._close_step_claims),
+            (_('Reconciling the controlled drugs register'), self._close_step_register),
+            (_('Creating stock pickings'), self._close_step_pickings),
+            (_('Posting accounting entries'), self._close_step_accounting),
+        ]
+    
+    def _close_in_background(self, auto_commit=True):
+        self.ensure_one()
+        cr = self.env.cr
+        steps = self._get_close_steps()
+        
+        def checkpoint(label, done, total, index):
+            """Publish progress, and keep the work done so far"""
+            span = 100.0 / len(steps)
+            self.write({
+                'close_step': label,
+                'close_progress': int(span * index + (span * done / total if total else 0)),
+            })
+            if auto_commit:
+                cr.commit()
+        
+        self.write({'close_state': 'running', 'close_error': False})
+        try:
+            for index, (label, method) in enumerate(steps):
+                checkpoint(label, 0, 0, index)
+                method(lambda done, total: checkpoint(label, done, total, index))
+            if self.state != 'closed':
+                raise UserError(_('The session needs a manual close (e.g. a cash difference to post).'))
+            self.write({'close_state': 'done', 'close_progress': 100, 'close_step': _('Closed')})
+            _logger.info("POS session %s closed in the background", self.name)
+        except Exception:
+            if not auto_commit:
+                raise
+            cr.rollback()
+            self.env.invalidate_all()
+            _logger.exception("Background close of POS session %s failed", self.name)
+            self.write({'close_state': 'failed', 'close_error': traceback.format_exc(limit=5)})
+        if auto_commit:
+            cr.commit()
+    
+    def _close_step_claims(self, checkpoint):
+        orders = self.order_ids.filtered(
+            lambda o: o.state in ('paid', 'done', 'invoiced') and o.has_insurance and not o.insurance_claim_id
+        )
+        for start in range(0, len(orders), CLOSE_BATCH_SIZE):
+            orders[start:start + CLOSE_BATCH_SIZE]._create_insurance_claim()
+            checkpoint(min(start + CLOSE_BATCH_SIZE, len(orders)), len(orders))
+    
+    def _close_step_register(self, checkpoint):
+        """Register entries for controlled sales that have none (e.g. synced as paid)"""
+        orders = self.order_ids.filtered(
+            lambda o: o.state in ('paid', 'done', 'invoiced') and o.has_controlled_substances
+        )
+        recorded = set(self.env['controlled.drugs.register'].search([
+            ('pos_order_id', 'in', orders.ids),
+        ]).pos_order_id.ids)
+        orders = orders.filtered(lambda o: o.id not in recorded)
+        for start in range(0, len(orders), CLOSE_BATCH_SIZE):
+            orders[start:start + CLOSE_BATCH_SIZE]._create_controlled_drugs_register_entries()
+            checkpoint(min(start + CLOSE_BATCH_SIZE, len(orders)), len(orders))
+    
+    def _close_step_pickings(self, checkpoint):
+        if self.update_stock_at_closing and not self.picking_ids:
+            self._create_picking_at_end_of_session()
+    
+    def _close_step_accounting(self, checkpoint):
+        diffs = {int(k): v for k, v in json.loads(self.close_params or '{}').items()}
+        self.with_context(pos_demo_pickings_done=True).action_pos_session_closing_control(
+            bank_payment_method_diffs=diffs
+        )
+    
+    def _create_picking_at_end_of_session(self):
+        """Pickings already made by the background close are not made twice"""
+        if self.env.context.get('pos_demo_pickings_done'):
+            return
+        return super()._create_picking_at_end_of_session()
+    
+    def action_reconcile_totals(self):
+        """Rebuild the running totals from the session's orders"""
+        drift = self.env['pos.session.totals'].reconcile(self.ids)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Session Totals'),
+                'message': _('Totals rebuilt; %s session(s) had drifted.') % len(drift) if drift
+                           else _('Totals rebuilt; no difference found.'),
+                'type': 'warning' if drift else 'success',
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+    
+    def action_view_etr_backlog(self):
+        """View fiscal receipts still waiting for the control unit"""
+        self.ensure_one()
+        return {
+            'name': _('ETR Backlog - %s') % self.name,
+            'type': 'ir.actions.act_window',
+            'res_model': 'pos.etr.queue',
+            'view_mode': 'list,form',
+            'domain': [('session_id', '=', self.id), ('state', 'in', ['pending', 'failed'])],
+        }
     
     def action_view_insurance_claims(self):
         """View insurance claims for this session"""
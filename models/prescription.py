@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError
+from odoo.tools import create_index
+import re
+
+# Counter typeahead: pg_trgm needs three characters to use its indexes
+COUNTER_SEARCH_MIN_LENGTH = 3
+COUNTER_SEARCH_LIMIT = 20
+COUNTER_SEARCH_MAX_LIMIT = 50
 
 
 class PharmacyPrescription(models.Model):
@@ -99,6 +106,11 @@ class PharmacyPrescription(models.Model):
         'prescription_id',
         string='POS Orders'
     )
+    pos_order_archive_ids = fields.One2many(
+        'pos.order.archive',
+        'prescription_id',
+        string='Archived POS Orders'
+    )
     
     # Digital copy
     prescription_image = fields.Binary(
@@ -124,6 +136,103 @@ class PharmacyPrescription(models.Model):
         compute='_compute_totals'
     )
     
+    def init(self):
+        if self.env.registry.has_trigram:
+            create_index(
+                self.env.cr,
+                'pharmacy_prescription_name_trgm_idx',
+                self._table,
+                ['name gin_trgm_ops'],
+                method='gin',
+            )
+    
+    @api.model
+    def counter_search(self, query, limit=20):
+        """Typeahead search for the dispensing counter
+        
+        Matches prescriptions on RX number or on their patient, and patients
+        on name, ID number or phone (digits only). Open prescriptions
+        (validated or partially dispensed) come first, then the most recent.
+        Only patients of the user's companies are searched, and rows the
+        user may not read are dropped.
+        
+        Returns:
+            dict: {'prescriptions': [...], 'patients': [...]} compact rows
+        """
+        Partner = self.env['res.partner']
+        self.check_access_rights('read')
+        Partner.check_access_rights('read')
+        query = (query or '').strip()
+        # Shorter queries cannot use the trigram indexes
+        if len(query) < COUNTER_SEARCH_MIN_LENGTH:
+            return {'prescriptions': [], 'patients': []}
+        limit = max(1, min(int(limit or COUNTER_SEARCH_LIMIT), COUNTER_SEARCH_MAX_LIMIT))
+        pattern = '%%%s%%' % re.sub(r'([\\%_])', r'\\\1', query)
+        digits = re.sub(r'\D', '', query)
+        params = {
+            'pattern': pattern,
+            'digits': '%%%s%%' % digits if len(digits) >= COUNTER_SEARCH_MIN_LENGTH else None,
+            'limit': limit,
+            'company_ids': self.env.companies.ids,
+        }
+        Partner.flush_model(['name', 'phone', 'patient_id_number', 'is_patient', 'active', 'company_id'])
+        self.flush_model(['name', 'state', 'date', 'patient_id'])
+        cr = self.env.cr
+        
+        # Expressions match the trigram indexes created in init()
+        patient_clause = """
+            SELECT id
+              FROM res_partner
+             WHERE is_patient
+               AND active
+               AND (company_id IS NULL OR company_id = ANY(%(company_ids)s))
+               AND (name ILIKE %(pattern)s
+                    OR patient_id_number ILIKE %(pattern)s
+                    OR (%(digits)s IS NOT NULL
+                        AND regexp_replace(phone, '[^0-9]', '', 'g') LIKE %(digits)s))
+        """
+        cr.execute("""
+            SELECT id, name, phone, patient_id_number
+              FROM res_partner
+             WHERE id IN ({patient_clause})
+          ORDER BY name
+             LIMIT %(limit)s
+        """.format(patient_clause=patient_clause), params)
+        patient_rows = cr.fetchall()
+        
+        # Every matching patient counts, not only the first page of names
+        cr.execute("""
+            SELECT rx.id, rx.name, rx.state, rx.date, rx.patient_id, rp.name
+              FROM pharmacy_prescription rx
+              JOIN res_partner rp ON rp.id = rx.patient_id
+             WHERE rx.state != 'cancelled'
+               AND (rp.company_id IS NULL OR rp.company_id = ANY(%(company_ids)s))
+               AND (rx.name ILIKE %(pattern)s OR rx.patient_id IN ({patient_clause}))
+          ORDER BY rx.state IN ('validated', 'partial') DESC, rx.date DESC
+             LIMIT %(limit)s
+        """.format(patient_clause=patient_clause), params)
+        prescription_rows = cr.fetchall()
+        
+        # Record rules (e.g. cashiers only see their own prescriptions)
+        readable_patients = set(Partner.search([('id', 'in', [row[0] for row in patient_rows])]).ids)
+        readable_prescriptions = set(self.search([('id', 'in', [row[0] for row in prescription_rows])]).ids)
+        patients = [{
+            'id': partner_id,
+            'name': name,
+            'phone': phone,
+            'id_number': id_number,
+        } for partner_id, name, phone, id_number in patient_rows if partner_id in readable_patients]
+        prescriptions = [{
+            'id': rx_id,
+            'name': name,
+            'state': state,
+            'date': fields.Datetime.to_string(date),
+            'patient_id': patient_id,
+            'patient_name': patient_name,
+        } for rx_id, name, state, date, patient_id, patient_name in prescription_rows
+            if rx_id in readable_prescriptions]
+        return {'prescriptions': prescriptions, 'patients': patients}
+    
     @api.model
     def create(self, vals):
         """Generate prescription number sequence"""
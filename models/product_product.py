@@ -11,3 +11,10 @@ class ProductProduct(models.Model):
         domain=[('is_company', '=', True)],
         help='Manufacturing company'
     )
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if 'standard_price' in vals:
+            # Lots without a purchase price are valued at the product cost
+            self.env['pharmacy.stock.refresh'].sudo()._mark_products(self.ids)
+        return res
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api
 
+from .ingredient import ALLERGY_CACHE
+
 
 class ProductTemplate(models.Model):
     _inherit = 'product.template'
@@ -68,6 +70,16 @@ class ProductTemplate(models.Model):
     
     # Clinical Information
     active_ingredients = fields.Text(string='Active Ingredients')
+    ingredient_ids = fields.Many2many(
+        'pharmacy.ingredient',
+        'product_template_ingredient_rel',
+        'product_tmpl_id',
+        'ingredient_id',
+        string='Ingredients',
+        compute='_compute_ingredient_ids',
+        store=True,
+        help='Ingredients recognised in the active ingredients text'
+    )
     contraindications = fields.Text(
         string='Contraindications',
         help='Conditions or factors that increase risks'
@@ -94,6 +106,27 @@ class ProductTemplate(models.Model):
         help='If ticked, each time you sell this product through a SO, a RfQ is automatically created to buy the product.'
     )
     
+    @api.depends('active_ingredients')
+    def _compute_ingredient_ids(self):
+        """Match the free-text ingredients against the ingredient vocabulary"""
+        Ingredient = self.env['pharmacy.ingredient']
+        for template in self:
+            template.ingredient_ids = Ingredient._match_text(template.active_ingredients)
+    
+    @api.model_create_multi
+    def create(self, vals_list):
+        templates = super().create(vals_list)
+        if any(vals.get('active_ingredients') for vals in vals_list):
+            self.env['pharmacy.cache.generation']._bump(ALLERGY_CACHE)
+        return templates
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if 'active_ingredients' in vals or 'ingredient_ids' in vals:
+            # Allergy profiles list conflicting products per patient
+            self.env['pharmacy.cache.generation']._bump(ALLERGY_CACHE)
+        return res
+    
     @api.depends('drug_schedule')
     def _compute_requires_prescription(self):
         """Compute whether prescription is required based on drug schedule"""
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+from odoo.tools.pdf import merge_pdf
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+import base64
+import hashlib
+import json
+import logging
+import threading
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+REPORT_CHUNK_SIZE = 50
+# Concurrent wkhtmltopdf processes per job
+REPORT_POOL_SIZE = 4
+# Cached chunks not reprinted for this long are dropped
+REPORT_CACHE_DAYS = 30
+
+
+def _render_chunk(dbname, uid, context, report_id, res_ids):
+    """Render one chunk in its own cursor (runs in a pool thread)"""
+    with Registry(dbname).cursor() as cr:
+        env = api.Environment(cr, uid, context)
+        pdf, _report_type = env['ir.actions.report']._render_qweb_pdf(report_id, res_ids)
+        return pdf
+
+
+class PharmacyReportJob(models.Model):
+    """Large print run rendered by the server in parallel chunks
+
+    The documents are split into chunks of REPORT_CHUNK_SIZE records,
+    rendered by up to REPORT_POOL_SIZE wkhtmltopdf processes at a time and
+    merged into one PDF. Each chunk is cached under a hash of its records'
+    write_date, so reprinting unchanged documents renders nothing.
+    """
+    _name = 'pharmacy.report.job'
+    _description = 'Pharmacy Report Job'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(string='Name', required=True, readonly=True)
+    report_id = fields.Many2one('ir.actions.report', string='Report', required=True, readonly=True, ondelete='cascade')
+    res_model = fields.Char(string='Model', required=True, readonly=True)
+    res_ids = fields.Text(string='Record IDs', required=True, readonly=True)
+    record_count = fields.Integer(string='Documents', readonly=True)
+    user_id = fields.Many2one('res.users', string='Requested By', default=lambda self: self.env.user, readonly=True, index=True)
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='queued', required=True, readonly=True, index=True)
+    progress = fields.Integer(string='Progress', readonly=True)
+    chunk_count = fields.Integer(string='Chunks', readonly=True)
+    cached_chunk_count = fields.Integer(string='Chunks from Cache', readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', string='PDF', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    date_done = fields.Datetime(string='Finished', readonly=True)
+
+    # ------------------------------------------------------------------
+    # Queueing
+    # ------------------------------------------------------------------
+
+    @api.model
+    def enqueue(self, report_ref, res_ids):
+        """Queue a print run and return a notification for the user"""
+        report = self.env['ir.actions.report']._get_report(report_ref)
+        if not res_ids:
+            raise UserError(_('Select the documents to print.'))
+        job = self.create({
+            'name': _('%s (%s documents)') % (report.name, len(res_ids)),
+            'report_id': report.id,
+            'res_model': report.model,
+            'res_ids': json.dumps(list(res_ids)),
+            'record_count': len(res_ids),
+        })
+        self.env.ref('pos_demo.ir_cron_pharmacy_report_job')._trigger()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Printing in background'),
+                'message': _('%s: you will be notified when the PDF is ready.') % job.name,
+                'type': 'info',
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
+    @api.model
+    def _cron_run_jobs(self, limit=3):
+        for job in self.search([('state', '=', 'queued')], order='id', limit=limit):
+            job._run(auto_commit=not getattr(threading.current_thread(), 'testing', False))
+        self.env['pharmacy.report.cache']._gc()
+
+    # ------------------------------------------------------------------
+    # Rendering
+    # ------------------------------------------------------------------
+
+    def _get_chunk_line_fields(self):
+        """One2many fields whose lines are printed with the record (e.g. line_ids)
+
+        Chatter is left out: posting a message does not change a printout.
+        """
+        self.ensure_one()
+        Model = self.env[self.res_model]
+        return [
+            field for field in Model._fields.values()
+            if field.type == 'one2many' and not field.compute and field.inverse_name
+            and not field.comodel_name.startswith('mail.')
+            and self.env[field.comodel_name]._auto and self.env[field.comodel_name]._log_access
+            and self.env[field.comodel_name]._fields[field.inverse_name].store
+        ]
+
+    def _get_chunk_key(self, res_ids):
+        """Cache key of a chunk: report, template, language and record versions
+
+        A record's version is its write_date plus, per line field, the
+        latest write_date and the count of its lines, so editing, adding
+        or deleting a line also invalidates the chunk.
+        """
+        self.ensure_one()
+        report = self.report_id
+        records = self.env[self.res_model].browse(res_ids)
+        records.flush_model()
+        cr = self.env.cr
+        cr.execute(
+            'SELECT id, write_date FROM "%s" WHERE id = ANY(%%s) ORDER BY id' % records._table,
+            [list(res_ids)],
+        )
+        versions = [(record_id, str(write_date)) for record_id, write_date in cr.fetchall()]
+        for field in self._get_chunk_line_fields():
+            Lines = self.env[field.comodel_name]
+            Lines.flush_model([field.inverse_name, 'write_date'])
+            cr.execute("""
+                SELECT "{inverse}", MAX(write_date), COUNT(*)
+                  FROM "{table}"
+                 WHERE "{inverse}" = ANY(%s)
+              GROUP BY "{inverse}"
+              ORDER BY "{inverse}"
+            """.format(inverse=field.inverse_name, table=Lines._table), [list(res_ids)])
+            versions.append((field.name, [(record_id, str(write_date), count)
+                                          for record_id, write_date, count in cr.fetchall()]))
+        template = self.env['ir.ui.view'].sudo().search([('key', '=', report.report_name)], limit=1)
+        signature = json.dumps([
+            report.report_name, str(report.write_date), str(template.write_date),
+            self.env.lang, self.env.company.id, list(res_ids), versions,
+        ])
+        return hashlib.sha256(signature.encode()).hexdigest()
+
+    def _run(self, auto_commit=True):
+        self.ensure_one()
+        Cache = self.env['pharmacy.report.cache'].sudo()
+        res_ids = json.loads(self.res_ids)
+        chunks = [res_ids[i:i + REPORT_CHUNK_SIZE] for i in range(0, len(res_ids), REPORT_CHUNK_SIZE)]
+        # Keys and PDFs in the requesting user's rights and language
+        job = self.with_user(self.user_id).with_context(lang=self.user_id.lang, tz=self.user_id.tz)
+        keys = [job._get_chunk_key(chunk) for chunk in chunks]
+        pdfs = {key: Cache._get(key) for key in keys}
+        missing = [(chunk, key) for chunk, key in zip(chunks, keys) if pdfs[key] is None]
+        self.write({
+            'state': 'running',
+            'chunk_count': len(chunks),
+            'cached_chunk_count': len(chunks) - len(missing),
+            'progress': int(100 * (len(chunks) - len(missing)) / len(chunks)),
+            'error': False,
+        })
+        if auto_commit:
+            self.env.cr.commit()
+
+        try:
+            for chunk, key, pdf in job._render_chunks(missing, auto_commit):
+                pdfs[key] = pdf
+                Cache._store(key, self.report_id, len(chunk), pdf)
+                done = sum(1 for value in pdfs.values() if value is not None)
+                self.progress = int(100 * done / len(chunks))
+                if auto_commit:
+                    self.env.cr.commit()
+
+            merged = merge_pdf([pdfs[key] for key in keys]) if len(keys) > 1 else pdfs[keys[0]]
+            attachment = self.env['ir.attachment'].create({
+                'name': '%s.pdf' % self.name,
+                'raw': merged,
+                'mimetype': 'application/pdf',
+                'res_model': self._name,
+                'res_id': self.id,
+            })
+            self.write({
+                'state': 'done',
+                'progress': 100,
+                'attachment_id': attachment.id,
+                'date_done': fields.Datetime.now(),
+            })
+            self._notify(_('%s is ready.') % self.name, 'success')
+        except Exception:
+            if not auto_commit:
+                raise
+            self.env.cr.rollback()
+            self.env.invalidate_all()
+            _logger.exception("Report job %s failed", self.id)
+            self.write({'state': 'failed', 'error': traceback.format_exc(limit=5)})
+            self._notify(_('%s could not be printed.') % self.name, 'danger')
+        if auto_commit:
+            self.env.cr.commit()
+
+    def _render_chunks(self, chunks, parallel):
+        """Yield (chunk, key, pdf) as chunks finish rendering
+
+        In parallel each chunk gets its own cursor, so only committed data
+        is printed; without commits (tests) chunks render in this cursor.
+        """
+        self.ensure_one()
+        report = self.report_id
+        if not parallel:
+            for chunk, key in chunks:
+                pdf, _report_type = self.env['ir.actions.report']._render_qweb_pdf(report.id, chunk)
+                yield chunk, key, pdf
+            return
+        workers = int(self.env['ir.config_parameter'].sudo().get_param(
+            'pos_demo.report_pool_size', REPORT_POOL_SIZE
+        ))
+        context = dict(self.env.context)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {
+                executor.submit(_render_chunk, self.env.cr.dbname, self.env.uid, context, report.id, chunk): (chunk, key)
+                for chunk, key in chunks
+            }
+            for future in as_completed(futures):
+                chunk, key = futures[future]
+                yield chunk, key, future.result()
+
+    def _notify(self, message, notification_type):
+        self.env['bus.bus']._sendone(self.user_id.partner_id, 'simple_notification', {
+            'title': _('Report'),
+            'message': message,
+            'type': notification_type,
+            'sticky': notification_type == 'danger',
+        })
+
+    # ------------------------------------------------------------------
+    # Actions
+    # ------------------------------------------------------------------
+
+    def action_download(self):
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(_('The PDF is not ready yet.'))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % self.attachment_id.id,
+            'target': 'self',
+        }
+
+    def action_retry(self):
+        self.filtered(lambda job: job.state == 'failed').write({'state': 'queued', 'error': False})
+        self.env.ref('pos_demo.ir_cron_pharmacy_report_job')._trigger()
+        return True
+
+
+class PharmacyReportCache(models.Model):
+    """Rendered PDF chunks keyed by report and record versions"""
+    _name = 'pharmacy.report.cache'
+    _description = 'Pharmacy Report Cache'
+
+    _sql_constraints = [
+        ('key_unique', 'unique(key)', 'Cache keys must be unique'),
+    ]
+
+    key = fields.Char(string='Key', required=True, index=True)
+    report_id = fields.Many2one('ir.actions.report', string='Report', ondelete='cascade')
+    record_count = fields.Integer(string='Documents')
+    pdf = fields.Binary(string='PDF', attachment=True)
+    last_used = fields.Datetime(string='Last Used', default=fields.Datetime.now, index=True)
+
+    @api.model
+    def _get(self, key):
+        entry = self.search([('key', '=', key)], limit=1)
+        if not entry:
+            return None
+        entry.last_used = fields.Datetime.now()
+        return base64.b64decode(entry.pdf)
+
+    @api.model
+    def _store(self, key, report, record_count, pdf):
+        if not self.search_count([('key', '=', key)]):
+            self.create({
+                'key': key,
+                'report_id': report.id,
+                'record_count': record_count,
+                'pdf': base64.b64encode(pdf),
+            })
+
+    @api.model
+    def _gc(self):
+        self.search([('last_used', '<', fields.Datetime.now() - timedelta(days=REPORT_CACHE_DAYS))]).unlink()
@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
+from odoo.tools import create_index
+import logging
+
+from .ingredient import ALLERGY_CACHE
+
+_logger = logging.getLogger(__name__)
 
 
 class ResPartner(models.Model):
@@ -35,6 +41,22 @@ class ResPartner(models.Model):
         string='Known Allergies',
         help='List known drug allergies or other allergies'
     )
+    allergy_ingredient_ids = fields.Many2many(
+        'pharmacy.ingredient',
+        'res_partner_allergy_ingredient_rel',
+        'partner_id',
+        'ingredient_id',
+        string='Allergy Ingredients',
+        compute='_compute_allergy_ingredient_ids',
+        store=True,
+        help='Ingredients and drug classes recognised in the allergies text'
+    )
+    allergy_version = fields.Integer(
+        string='Allergy Version',
+        readonly=True,
+        copy=False,
+        help='Bumped when the allergies change; keys the cached allergy profile'
+    )
     medical_conditions = fields.Text(
         string='Medical Conditions',
         help='Chronic or significant medical conditions'
@@ -71,9 +93,92 @@ class ResPartner(models.Model):
     )
     prescription_count = fields.Integer(
         string='Prescription Count',
-        compute='_compute_prescription_count'
+        compute='_compute_prescription_count',
+        store=True
     )
     
+    def init(self):
+        super().init()
+        # Trigram indexes behind pharmacy.prescription.counter_search; the
+        # expressions must match the ones used in its query
+        if not self.env.registry.has_trigram:
+            _logger.warning("pg_trgm is not installed: counter search will scan res_partner")
+            return
+        for name, expression in [
+            ('res_partner_patient_name_trgm_idx', 'name gin_trgm_ops'),
+            ('res_partner_patient_id_number_trgm_idx', 'patient_id_number gin_trgm_ops'),
+            ('res_partner_patient_phone_trgm_idx', "(regexp_replace(phone, '[^0-9]', '', 'g')) gin_trgm_ops"),
+        ]:
+            create_index(self.env.cr, name, self._table, [expression], method='gin', where='is_patient')
+    
+    @api.depends('allergies')
+    def _compute_allergy_ingredient_ids(self):
+        """Match the free-text allergies against the ingredient vocabulary"""
+        Ingredient = self.env['pharmacy.ingredient']
+        for partner in self:
+            partner.allergy_ingredient_ids = Ingredient._match_text(partner.allergies)
+    
+    def write(self, vals):
+        res = super().write(vals)
+        if 'allergies' in vals or 'allergy_ingredient_ids' in vals:
+            self._bump_allergy_version()
+        return res
+    
+    def _bump_allergy_version(self):
+        """Retire the cached allergy profiles of these patients only"""
+        if not self.ids:
+            return
+        # Values come from the cache generation sequence and are never reused
+        self.env.cr.execute("""
+            UPDATE res_partner
+               SET allergy_version = nextval('pharmacy_cache_generation_seq')
+             WHERE id = ANY(%s)
+        """, [self.ids])
+        self.invalidate_recordset(['allergy_version'])
+    
+    @api.model
+    def _get_allergy_profile(self, partner_id):
+        """Cached {product_id: ((ingredient, allergy), ...)} of a patient
+
+        Entries are keyed on the patient's own allergy version, and on the
+        catalogue generation bumped by ingredient and product edits.
+        """
+        generation = self.env['pharmacy.cache.generation']._get(ALLERGY_CACHE)
+        if generation is None:
+            return self._read_allergy_profile(partner_id)
+        version = self.browse(partner_id).sudo().allergy_version
+        return self._get_allergy_profile_cached(partner_id, version, generation)
+    
+    @api.model
+    @tools.ormcache('partner_id', 'version', 'generation')
+    def _get_allergy_profile_cached(self, partner_id, version, generation):
+        return self._read_allergy_profile(partner_id)
+    
+    @api.model
+    def _read_allergy_profile(self, partner_id):
+        profile = {}
+        for product_id, ingredient, allergy in self.env['pharmacy.ingredient']._find_conflicts(partner_id):
+            profile.setdefault(product_id, []).append((ingredient, allergy))
+        return tools.frozendict({key: tuple(value) for key, value in profile.items()})
+    
+    @api.model
+    def get_allergy_profile(self, partner_id):
+        """Products a patient must not receive, for the POS to check locally"""
+        return {
+            product_id: [{'ingredient': ingredient, 'allergy': allergy} for ingredient, allergy in conflicts]
+            for product_id, conflicts in self._get_allergy_profile(partner_id).items()
+        }
+    
+    @api.model
+    def check_allergy_conflicts(self, partner_id, product_ids):
+        """All allergy conflicts of a patient's cart, resolved in one query"""
+        return [
+            {'product_id': product_id, 'ingredient': ingredient, 'allergy': allergy}
+            for product_id, ingredient, allergy in self.env['pharmacy.ingredient']._find_conflicts(
+                partner_id, product_ids
+            )
+        ]
+    
     @api.depends('insurance_valid_until')
     def _compute_insurance_active(self):
         """Check if insurance is currently active"""
@@ -85,10 +190,67 @@ class ResPartner(models.Model):
             else:
                 partner.insurance_active = False
     
+    @api.depends('prescription_ids')
     def _compute_prescription_count(self):
-        """Count prescriptions for this patient"""
+        """Count prescriptions for the whole recordset with one grouped query"""
+        partner_ids = [pid for pid in self._origin.ids if pid]
+        counts = {}
+        if partner_ids:
+            counts = {
+                patient.id: count
+                for patient, count in self.env['pharmacy.prescription']._read_group(
+                    [('patient_id', 'in', partner_ids)],
+                    groupby=['patient_id'],
+                    aggregates=['__count'],
+                )
+            }
         for partner in self:
-            partner.prescription_count = len(partner.prescription_ids)
+            partner.prescription_count = counts.get(partner._origin.id, 0)
+    
+    @api.model
+    def _cron_refresh_insurance_active(self):
+        """Daily job: flip insurance_active off for policies that lapsed.
+
+        Only partners still flagged active whose validity date is now in the
+        past are recomputed, so the job touches a handful of rows per day.
+        """
+        today = fields.Date.context_today(self)
+        lapsed = self.with_context(active_test=False).search([
+            ('insurance_active', '=', True),
+            ('insurance_valid_until', '<', today),
+        ])
+        if not lapsed:
+            return
+        self.env.add_to_compute(self._fields['insurance_active'], lapsed)
+        lapsed._recompute_recordset(['insurance_active'])
+        _logger.info("Insurance lapsed for %s patient(s)", len(lapsed))
+        
+        # Let open pharmacy tills drop the lapsed members from their cache
+        payload = lapsed._get_insurance_expired_payload()
+        sessions = self.env['pos.session'].search([
+            ('state', '=', 'opened'),
+            ('config_id.is_pharmacy_pos', '=', True),
+        ])
+        for config in sessions.config_id:
+            self.env['bus.bus']._sendone(config.access_token, 'PHARMACY_INSURANCE_EXPIRED', payload)
+    
+    def _get_insurance_expired_payload(self):
+        """Compact list of expired members for the POS partner cache"""
+        return [{
+            'id': partner.id,
+            'insurance_active': partner.insurance_active,
+            'insurance_valid_until': fields.Date.to_string(partner.insurance_valid_until),
+        } for partner in self]
+    
+    @api.model
+    def get_insurance_expired_since(self, since):
+        """Members whose insurance lapsed since the given date (POS catch-up)"""
+        today = fields.Date.context_today(self)
+        partners = self.search([
+            ('insurance_valid_until', '>=', fields.Date.to_date(since)),
+            ('insurance_valid_until', '<', today),
+        ])
+        return partners._get_insurance_expired_payload()
     
     def action_view_prescriptions(self):
         """Open prescriptions view for this patient"""
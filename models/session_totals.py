@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.tools import float_compare
+from collections import defaultdict
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Running totals, in the column order used by the SQL below
+TOTAL_FIELDS = [
+    'order_count', 'refund_count', 'total_sales', 'refund_total', 'tax_total', 'discount_total',
+    'prescription_sales', 'otc_sales', 'insurance_sales',
+    'controlled_order_count', 'controlled_quantity',
+    'cash_total', 'card_total', 'mpesa_total', 'insurance_total', 'other_total',
+]
+COUNT_FIELDS = {'order_count', 'refund_count', 'controlled_order_count'}
+
+# Orders counted in the totals
+COUNTED_ORDER_STATES = ('paid', 'done', 'invoiced')
+
+
+class PosSessionTotals(models.Model):
+    """Running totals of a POS session, behind the X and Z reports
+
+    Each paid order adds its own figures with one atomic upsert, so tills
+    closing orders at the same time never lose an update and the reports
+    never re-read the session's orders. reconcile() rebuilds the row from
+    the orders, lines and payments.
+    """
+    _name = 'pos.session.totals'
+    _description = 'POS Session Running Totals'
+    _rec_name = 'session_id'
+
+    _sql_constraints = [
+        ('session_unique', 'unique(session_id)', 'One totals record per session'),
+    ]
+
+    session_id = fields.Many2one('pos.session', string='Session', required=True, ondelete='cascade', readonly=True)
+    order_count = fields.Integer(string='Orders', readonly=True)
+    refund_count = fields.Integer(string='Refunds', readonly=True)
+    total_sales = fields.Float(string='Net Sales', readonly=True)
+    refund_total = fields.Float(string='Refunded', readonly=True)
+    tax_total = fields.Float(string='Taxes', readonly=True)
+    discount_total = fields.Float(string='Discounts', readonly=True)
+    prescription_sales = fields.Float(string='Prescription Sales', readonly=True)
+    otc_sales = fields.Float(string='OTC Sales', readonly=True)
+    insurance_sales = fields.Float(string='Insurance Covered', readonly=True)
+    controlled_order_count = fields.Integer(string='Controlled Drug Orders', readonly=True)
+    controlled_quantity = fields.Float(string='Controlled Drug Quantity', readonly=True)
+    cash_total = fields.Float(string='Cash', readonly=True)
+    card_total = fields.Float(string='Card/Bank', readonly=True)
+    mpesa_total = fields.Float(string='M-PESA', readonly=True)
+    insurance_total = fields.Float(string='Insurance', readonly=True)
+    other_total = fields.Float(string='Other', readonly=True)
+
+    def init(self):
+        """Start the totals of sessions still running when the module is installed"""
+        self.env.cr.execute("""
+            SELECT s.id
+              FROM pos_session s
+         LEFT JOIN pos_session_totals t ON t.session_id = s.id
+             WHERE s.state != 'closed' AND t.id IS NULL
+        """)
+        session_ids = [row[0] for row in self.env.cr.fetchall()]
+        if session_ids:
+            self._rebuild(session_ids)
+
+    # ------------------------------------------------------------------
+    # Incremental update
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _get_order_deltas(self, orders):
+        """What some newly paid orders add to their sessions' totals"""
+        deltas = defaultdict(lambda: defaultdict(float))
+        for order in orders:
+            delta = deltas[order.session_id.id]
+            amount = order.amount_total
+            if amount < 0:
+                delta['refund_count'] += 1
+                delta['refund_total'] -= amount
+            else:
+                delta['order_count'] += 1
+            delta['total_sales'] += amount
+            delta['tax_total'] += order.amount_tax
+            delta['prescription_sales' if order.has_prescription_items else 'otc_sales'] += amount
+            delta['insurance_sales'] += order.insurance_amount or 0.0
+            if order.has_controlled_substances:
+                delta['controlled_order_count'] += 1
+            for line in order.lines:
+                delta['discount_total'] += line.qty * line.price_unit * (line.discount or 0.0) / 100.0
+                if line.product_id.product_tmpl_id.is_controlled_substance:
+                    delta['controlled_quantity'] += line.qty
+            for payment in order.payment_ids:
+                delta['%s_total' % (payment.payment_category or 'other')] += payment.amount
+        return deltas
+
+    @api.model
+    def _add_orders(self, orders):
+        """Add newly paid orders to their sessions' totals"""
+        orders = orders.filtered('session_id')
+        if not orders:
+            return
+        deltas = self._get_order_deltas(orders)
+        self.flush_model()
+        for session_id, delta in deltas.items():
+            values = [int(delta[f]) if f in COUNT_FIELDS else delta[f] for f in TOTAL_FIELDS]
+            self.env.cr.execute("""
+                INSERT INTO pos_session_totals (
+                    session_id, {columns}, create_uid, create_date, write_uid, write_date
+                )
+                VALUES (%s, {placeholders}, %s, NOW() AT TIME ZONE 'UTC', %s, NOW() AT TIME ZONE 'UTC')
+                ON CONFLICT (session_id) DO UPDATE SET
+                    {increments},
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+            """.format(
+                columns=', '.join(TOTAL_FIELDS),
+                placeholders=', '.join(['%s'] * len(TOTAL_FIELDS)),
+                increments=',\n'.join('%s = pos_session_totals.%s + EXCLUDED.%s' % (f, f, f) for f in TOTAL_FIELDS),
+            ), [session_id] + values + [self.env.uid, self.env.uid])
+        self._totals_changed(list(deltas))
+
+    @api.model
+    def _totals_changed(self, session_ids):
+        """Refresh the session summary fields read from the totals"""
+        self.invalidate_model()
+        sessions = self.env['pos.session'].browse(session_ids)
+        sessions.invalidate_recordset(['totals_ids'])
+        for fname in sessions._get_totals_summary_fields():
+            self.env.add_to_compute(sessions._fields[fname], sessions)
+
+    # ------------------------------------------------------------------
+    # Rebuild from source rows
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _rebuild(self, session_ids):
+        """Recompute the totals of some sessions from their orders"""
+        for model in ('pos.order', 'pos.order.line', 'pos.payment'):
+            self.env[model].flush_model()
+        self.flush_model()
+        self.env.cr.execute("""
+            WITH orders AS (
+                SELECT id, session_id, amount_total, amount_tax, insurance_amount,
+                       COALESCE(has_prescription_items, FALSE) AS has_prescription_items,
+                       COALESCE(has_controlled_substances, FALSE) AS has_controlled_substances
+                  FROM pos_order
+                 WHERE session_id = ANY(%(session_ids)s)
+                   AND state IN %(states)s
+            ), order_totals AS (
+                SELECT session_id,
+                       COUNT(*) FILTER (WHERE amount_total >= 0) AS order_count,
+                       COUNT(*) FILTER (WHERE amount_total < 0) AS refund_count,
+                       SUM(amount_total) AS total_sales,
+                       SUM(-amount_total) FILTER (WHERE amount_total < 0) AS refund_total,
+                       SUM(amount_tax) AS tax_total,
+                       SUM(amount_total) FILTER (WHERE has_prescription_items) AS prescription_sales,
+                       SUM(amount_total) FILTER (WHERE NOT has_prescription_items) AS otc_sales,
+                       SUM(COALESCE(insurance_amount, 0)) AS insurance_sales,
+                       COUNT(*) FILTER (WHERE has_controlled_substances) AS controlled_order_count
+                  FROM orders
+              GROUP BY session_id
+            ), line_totals AS (
+                SELECT o.session_id,
+                       SUM(l.qty * l.price_unit * COALESCE(l.discount, 0) / 100.0) AS discount_total,
+                       SUM(l.qty) FILTER (WHERE pt.is_controlled_substance) AS controlled_quantity
+                  FROM orders o
+                  JOIN pos_order_line l ON l.order_id = o.id
+                  JOIN product_product pp ON pp.id = l.product_id
+                  JOIN product_template pt ON pt.id = pp.product_tmpl_id
+              GROUP BY o.session_id
+            ), payment_totals AS (
+                SELECT o.session_id,
+                       SUM(p.amount) FILTER (WHERE p.payment_category = 'cash') AS cash_total,
+                       SUM(p.amount) FILTER (WHERE p.payment_category = 'card') AS card_total,
+                       SUM(p.amount) FILTER (WHERE p.payment_category = 'mpesa') AS mpesa_total,
+                       SUM(p.amount) FILTER (WHERE p.payment_category = 'insurance') AS insurance_total,
+                       SUM(p.amount) FILTER (WHERE COALESCE(p.payment_category, 'other') = 'other') AS other_total
+                  FROM orders o
+                  JOIN pos_payment p ON p.pos_order_id = o.id
+              GROUP BY o.session_id
+            )
+            INSERT INTO pos_session_totals (
+                session_id, {columns}, create_uid, create_date, write_uid, write_date
+            )
+            SELECT s.id, {values},
+                   %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+              FROM pos_session s
+         LEFT JOIN order_totals ot ON ot.session_id = s.id
+         LEFT JOIN line_totals lt ON lt.session_id = s.id
+         LEFT JOIN payment_totals pt ON pt.session_id = s.id
+             WHERE s.id = ANY(%(session_ids)s)
+            ON CONFLICT (session_id) DO UPDATE SET
+                {replacements},
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """.format(
+            columns=', '.join(TOTAL_FIELDS),
+            values=', '.join('COALESCE(%s, 0)' % f for f in TOTAL_FIELDS),
+            replacements=',\n'.join('%s = EXCLUDED.%s' % (f, f) for f in TOTAL_FIELDS),
+        ), {
+            'session_ids': list(session_ids),
+            'states': COUNTED_ORDER_STATES,
+            'uid': self.env.uid,
+        })
+        self._totals_changed(session_ids)
+
+    @api.model
+    def reconcile(self, session_ids):
+        """Rebuild the totals of some sessions and report what had drifted
+
+        Returns:
+            dict: {session id: {field: (running total, rebuilt total)}}
+        """
+        def snapshot():
+            return {
+                totals.session_id.id: {f: totals[f] for f in TOTAL_FIELDS}
+                for totals in self.search([('session_id', 'in', list(session_ids))])
+            }
+
+        # Archived orders are gone from the source tables: keep those totals
+        archived = set(self.env['pos.order.archive'].search([('session_id', 'in', list(session_ids))]).session_id.ids)
+        session_ids = [session_id for session_id in session_ids if session_id not in archived]
+        if not session_ids:
+            return {}
+        before = snapshot()
+        self._rebuild(session_ids)
+        drift = {}
+        for session_id, after in snapshot().items():
+            if session_id not in before:
+                continue
+            changed = {
+                f: (before[session_id][f], value)
+                for f, value in after.items()
+                if float_compare(before[session_id][f], value, precision_digits=2)
+            }
+            if changed:
+                drift[session_id] = changed
+                _logger.warning("POS session %s totals drifted and were rebuilt: %s", session_id, changed)
+        return drift
+
+    @api.model
+    def _ensure_totals(self, sessions):
+        """Build the totals of sessions that have none (e.g. older sessions)"""
+        missing = sessions - self.search([('session_id', 'in', sessions.ids)]).session_id
+        if missing:
+            self._rebuild(missing.ids)
@@ -37,6 +37,12 @@ class StockLot(models.Model):
         store=True
     )
     
+    def write(self, vals):
+        res = super().write(vals)
+        if 'purchase_price' in vals or 'expiry_date' in vals:
+            self.env['pharmacy.lot.valuation']._update_products(self.product_id.ids)
+        return res
+    
     @api.depends('expiry_date')
     def _compute_days_to_expiry(self):
         """Calculate days remaining until expiry"""
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+
+    def _action_done(self, cancel_backorder=False):
+        moves = super()._action_done(cancel_backorder=cancel_backorder)
+        # Today's lot valuation and the branch index catch up in a cron
+        self.env['pharmacy.stock.refresh'].sudo()._mark_products(moves.product_id.ids)
+        # Sold stock has left: the orders' lot holds are no longer needed
+        pickings = moves.picking_id
+        orders = pickings.pos_order_id | pickings.pos_session_id.order_ids
+        self.env['pos.lot.reservation']._release_orders(orders)
+        return moves
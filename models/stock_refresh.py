@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Products rebuilt per cron run before it re-triggers itself
+STOCK_REFRESH_BATCH = 1000
+
+
+class PharmacyStockRefresh(models.Model):
+    """Products whose lot valuation and branch stock rows are out of date
+
+    Stock moves only mark their products here; a cron rebuilds the rows
+    shortly after, once per product however many moves touched it, so
+    validating a picking does not pay for the aggregation.
+    """
+    _name = 'pharmacy.stock.refresh'
+    _description = 'Pending Stock Index Refresh'
+    _log_access = False
+
+    _sql_constraints = [
+        ('product_unique', 'unique(product_id)', 'A product is only marked once'),
+    ]
+
+    product_id = fields.Many2one('product.product', string='Product', required=True, ondelete='cascade')
+
+    @api.model
+    def _mark_products(self, product_ids):
+        """Queue products for the next refresh"""
+        if not product_ids:
+            return
+        self.env.cr.execute("""
+            INSERT INTO pharmacy_stock_refresh (product_id)
+            SELECT unnest(%s::int[])
+            ON CONFLICT (product_id) DO NOTHING
+            RETURNING id
+        """, [list(product_ids)])
+        if self.env.cr.fetchall():
+            cron = self.env.ref('pos_demo.ir_cron_stock_refresh', raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+
+    @api.model
+    def _cron_refresh(self, limit=STOCK_REFRESH_BATCH):
+        """Rebuild lot valuation and branch stock of the marked products"""
+        # Rows marked by moves still in flight stay for the next run
+        self.env.cr.execute("""
+            DELETE FROM pharmacy_stock_refresh
+             WHERE id IN (
+                   SELECT id
+                     FROM pharmacy_stock_refresh
+                 ORDER BY id
+                    LIMIT %s
+                      FOR UPDATE SKIP LOCKED
+             )
+         RETURNING product_id
+        """, [limit])
+        product_ids = [product_id for (product_id,) in self.env.cr.fetchall()]
+        if not product_ids:
+            return
+        self.env['pharmacy.lot.valuation']._update_products(product_ids)
+        self.env['pharmacy.branch.stock']._update_products(product_ids)
+        _logger.info("Refreshed stock indexes of %d product(s)", len(product_ids))
+        if len(product_ids) == limit:
+            self.env.ref('pos_demo.ir_cron_stock_refresh')._trigger()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+M-PESA Daraja Simulator
+Local stand-in for the Safaricom Daraja API used by the pharmacy POS.
+
+Serve the simulator (set the POS M-PESA environment to "Local Simulator"):
+    python3 mpesa_simulator.py --port 8099
+
+Load-test the STK push pipeline with 100 concurrent payments:
+    python3 mpesa_simulator.py --load-test 100 --config-id 1
+"""
+
+import argparse
+import base64
+import json
+import random
+import string
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# Configuration
+URL = "http://localhost:8069"
+DB = "pharmacy_kenya"
+USERNAME = "admin"
+PASSWORD = "admin"
+
+TOKEN_LIFETIME = 3599
+TEST_PHONE = "254708374149"
+
+
+class Simulator:
+    """Shared state of the fake Daraja server"""
+
+    def __init__(self, delay, fail_rate):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.callbacks = ThreadPoolExecutor(max_workers=32)
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time() + TOKEN_LIFETIME
+        return token
+
+    def check_token(self, header):
+        token = (header or '').replace('Bearer ', '')
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def schedule_callback(self, payload, checkout_id, merchant_id):
+        self.callbacks.submit(self._send_callback, payload, checkout_id, merchant_id)
+
+    def _send_callback(self, payload, checkout_id, merchant_id):
+        """Simulate the customer entering their PIN, then call back"""
+        time.sleep(self.delay)
+        if random.random() < self.fail_rate:
+            callback = {
+                'MerchantRequestID': merchant_id,
+                'CheckoutRequestID': checkout_id,
+                'ResultCode': 1032,
+                'ResultDesc': 'Request cancelled by user',
+            }
+        else:
+            receipt = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+            callback = {
+                'MerchantRequestID': merchant_id,
+                'CheckoutRequestID': checkout_id,
+                'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CallbackMetadata': {'Item': [
+                    {'Name': 'Amount', 'Value': payload['Amount']},
+                    {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+                    {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                    {'Name': 'PhoneNumber', 'Value': int(payload['PhoneNumber'])},
+                ]},
+            }
+        try:
+            requests.post(payload['CallBackURL'], json={'Body': {'stkCallback': callback}}, timeout=10)
+        except requests.RequestException as e:
+            print(f"❌ Callback to {payload['CallBackURL']} failed: {e}")
+
+
+def make_handler(simulator):
+
+    class DarajaHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith('/oauth/v1/generate'):
+                auth = self.headers.get('Authorization', '')
+                if not auth.startswith('Basic ') or not base64.b64decode(auth[6:]):
+                    return self._reply(400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'})
+                return self._reply(200, {'access_token': simulator.issue_token(), 'expires_in': str(TOKEN_LIFETIME)})
+            self._reply(404, {'errorMessage': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/mpesa/stkpush/v1/processrequest':
+                return self._reply(404, {'errorMessage': 'Not found'})
+            if not simulator.check_token(self.headers.get('Authorization')):
+                return self._reply(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            missing = [key for key in ('BusinessShortCode', 'Password', 'Timestamp', 'Amount',
+                                       'PhoneNumber', 'CallBackURL') if not payload.get(key)]
+            if missing:
+                return self._reply(400, {'errorCode': '400.002.02',
+                                         'errorMessage': f"Bad Request - Invalid {missing[0]}"})
+            merchant_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+            checkout_id = f"ws_CO_{datetime.now().strftime('%d%m%Y%H%M%S')}{uuid.uuid4().hex[:8]}"
+            simulator.schedule_callback(payload, checkout_id, merchant_id)
+            self._reply(200, {
+                'MerchantRequestID': merchant_id,
+                'CheckoutRequestID': checkout_id,
+                'ResponseCode': '0',
+                'ResponseDescription': 'Success. Request accepted for processing',
+                'CustomerMessage': 'Success. Request accepted for processing',
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return DarajaHandler
+
+
+def serve(port, delay, fail_rate):
+    """Run the fake Daraja API"""
+    simulator = Simulator(delay, fail_rate)
+    server = ThreadingHTTPServer(('0.0.0.0', port), make_handler(simulator))
+    print(f"📱 M-PESA simulator listening on http://127.0.0.1:{port}")
+    print(f"   Callback delay: {delay}s, failure rate: {fail_rate:.0%}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Simulator stopped")
+
+
+def json_rpc(session, route, params):
+    response = session.post(f'{URL}{route}', json={'jsonrpc': '2.0', 'method': 'call', 'params': params}, timeout=30)
+    response.raise_for_status()
+    return response.json().get('result') or {}
+
+
+def load_test(count, config_id, timeout):
+    """Fire concurrent STK pushes through Odoo and wait for all results"""
+    print(f"🔌 Connecting to Odoo at {URL}...")
+    session = requests.Session()
+    if not json_rpc(session, '/web/session/authenticate', {'db': DB, 'login': USERNAME, 'password': PASSWORD}).get('uid'):
+        print("❌ Authentication failed!")
+        return
+
+    print(f"🚀 Sending {count} concurrent STK pushes...")
+    started = time.time()
+
+    def push(index):
+        return json_rpc(session, '/pos_demo/mpesa/stk_push', {
+            'config_id': config_id,
+            'amount': random.randint(10, 5000),
+            'phone': TEST_PHONE,
+            'reference': f'LOAD-{index:04d}',
+        })
+
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        results = list(pool.map(push, range(count)))
+    push_time = time.time() - started
+    errors = [r for r in results if r.get('error') or r.get('state') == 'failed']
+    request_ids = [r['id'] for r in results if r.get('id')]
+    print(f"✓ {len(request_ids)} pushes accepted in {push_time:.2f}s ({len(errors)} rejected)")
+
+    pending = set(request_ids)
+    states = {}
+    while pending and time.time() - started < timeout:
+        time.sleep(1)
+        status = json_rpc(session, '/pos_demo/mpesa/status', {
+            'config_id': config_id,
+            'request_ids': list(pending),
+        })
+        for current in status.get('requests', []):
+            if current['state'] != 'pending':
+                states[current['id']] = current['state']
+                pending.discard(current['id'])
+
+    total = time.time() - started
+    print(f"\n📊 Results after {total:.2f}s")
+    for state in ('paid', 'failed', 'timeout'):
+        print(f"   {state}: {sum(1 for s in states.values() if s == state)}")
+    print(f"   still pending: {len(pending)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Daraja-compatible M-PESA simulator')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--delay', type=float, default=3.0, help='Seconds before the callback is sent')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of pushes cancelled by the customer')
+    parser.add_argument('--load-test', type=int, metavar='N', help='Send N concurrent STK pushes through Odoo')
+    parser.add_argument('--config-id', type=int, default=1, help='POS config used by the load test')
+    parser.add_argument('--timeout', type=int, default=120, help='Load test timeout in seconds')
+    args = parser.parse_args()
+
+    if args.load_test:
+        load_test(args.load_test, args.config_id, args.timeout)
+    else:
+        serve(args.port, args.delay, args.fail_rate)
+
+
+if __name__ == '__main__':
+    main()
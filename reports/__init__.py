@@ -1,2 +1,3 @@
 # -*- coding: utf-8 -*-
-# Reports are defined in XML files
+# Reports are defined in XML files; parsers needing Python live here
+from . import session_totals_report
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+
+class ReportSessionTotals(models.AbstractModel):
+    """X/Z report rendered from the session running totals"""
+    _name = 'report.pos_demo.report_session_totals_document'
+    _description = 'POS Session X/Z Report'
+
+    @api.model
+    def _get_report_values(self, docids, data=None):
+        sessions = self.env['pos.session'].browse(docids)
+        self.env['pos.session.totals'].sudo()._ensure_totals(sessions)
+        return {
+            'doc_ids': docids,
+            'doc_model': 'pos.session',
+            'docs': sessions,
+            'totals': {session.id: session.sudo().totals_ids[:1] for session in sessions},
+        }
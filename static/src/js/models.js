@@ -1,8 +1,16 @@
 /** @odoo-module */
 
 import { PosStore } from "@point_of_sale/app/store/pos_store";
-import { Order } from "@point_of_sale/app/store/models";
+import { Order, Orderline, Payment, Product } from "@point_of_sale/app/store/models";
 import { patch } from "@web/core/utils/patch";
+import { PaymentScreen } from "@point_of_sale/app/screens/payment_screen/payment_screen";
+import { ErrorPopup } from "@point_of_sale/app/errors/popups/error_popup";
+import { TextInputPopup } from "@point_of_sale/app/utils/input_popups/text_input_popup";
+import { BatchSelectionPopup } from "./popups/BatchSelectionPopup";
+import { _t } from "@web/core/l10n/translation";
+
+// Lot holds expire on the server after 15 minutes without renewal
+const LOT_RESERVATION_RENEW_MS = 5 * 60 * 1000;
 
 // Extend POS Store for pharmacy functionality
 patch(PosStore.prototype, {
@@ -15,6 +23,109 @@ patch(PosStore.prototype, {
         this.controlled_drugs = loadedData['product.product'].filter(
             p => p.is_controlled_substance
         );
+        this.insuranceRefreshedOn = new Date().toISOString().slice(0, 10);
+        
+        // Server pushes for this till (insurance, M-PESA, ETR) use its token as channel
+        const bus = this.env.services.bus_service;
+        bus.addChannel(this.config.access_token);
+        
+        // Lapsed policies are pushed by the daily cron
+        bus.subscribe('PHARMACY_INSURANCE_EXPIRED', (partners) => {
+            this.applyInsuranceExpired(partners);
+            this.insuranceRefreshedOn = new Date().toISOString().slice(0, 10);
+        });
+        // Pushes sent while the till was offline are lost: catch up on reconnect
+        bus.addEventListener('reconnect', () => this.refreshExpiredInsurance());
+        
+        // Extend lot holds well before the server lets them expire
+        setInterval(() => this.renewLotReservations(), LOT_RESERVATION_RENEW_MS);
+        
+        // Allergy profiles are fetched once per patient and checked locally
+        this.allergyProfiles = new Map();
+        
+        // STK push results arrive on the bus, no request is held open
+        this.pendingMpesa = new Map();
+        bus.subscribe('MPESA_STK_RESULT', (status) => {
+            this.resolveMpesaRequest(status);
+        });
+        
+        // Fiscal numbers fill in once the ETR control unit signs the receipt
+        bus.subscribe('ETR_SIGNED', (data) => {
+            const order = this.get_order_list().find(
+                o => o.name === data.pos_reference
+            );
+            if (order) {
+                order.etr_invoice_number = data.etr_invoice_number;
+            }
+        });
+    },
+
+    // Start an M-PESA STK push; resolves once the customer answers
+    async requestMpesaPayment(amount, phone, reference) {
+        const status = await this.env.services.rpc({
+            route: '/pos_demo/mpesa/stk_push',
+            params: {
+                config_id: this.config.id,
+                amount: amount,
+                phone: phone,
+                reference: reference
+            }
+        });
+        if (status.error || status.state !== 'pending') {
+            return status;
+        }
+        return new Promise((resolve) => {
+            this.pendingMpesa.set(status.id, resolve);
+            // Fallback in case a bus notification is missed
+            const poll = setInterval(async () => {
+                if (!this.pendingMpesa.has(status.id)) {
+                    clearInterval(poll);
+                    return;
+                }
+                const result = await this.env.services.rpc({
+                    route: '/pos_demo/mpesa/status',
+                    params: { config_id: this.config.id, request_ids: [status.id] }
+                });
+                for (const current of result.requests || []) {
+                    this.resolveMpesaRequest(current);
+                }
+            }, 15000);
+        });
+    },
+
+    resolveMpesaRequest(status) {
+        const resolve = this.pendingMpesa.get(status.id);
+        if (resolve && status.state !== 'pending') {
+            this.pendingMpesa.delete(status.id);
+            resolve(status);
+        }
+    },
+
+    // Update cached partners whose insurance lapsed
+    applyInsuranceExpired(partners) {
+        for (const data of partners) {
+            const partner = this.db.get_partner_by_id(data.id);
+            if (partner) {
+                partner.insurance_active = data.insurance_active;
+                partner.insurance_valid_until = data.insurance_valid_until;
+            }
+        }
+    },
+
+    // Catch up on lapsed policies missed while offline
+    async refreshExpiredInsurance() {
+        try {
+            const result = await this.env.services.rpc({
+                route: '/pos_demo/insurance_expired',
+                params: {
+                    since: this.insuranceRefreshedOn
+                }
+            });
+            this.applyInsuranceExpired(result.partners || []);
+            this.insuranceRefreshedOn = new Date().toISOString().slice(0, 10);
+        } catch (error) {
+            console.error('Error refreshing insurance status:', error);
+        }
     },
 
     // Check if product requires prescription
@@ -44,6 +155,150 @@ patch(PosStore.prototype, {
         return diffDays > 0 && diffDays <= days;
     },
 
+    // Load (once per session) the products a patient is allergic to
+    async loadAllergyProfile(partnerId) {
+        if (!this.config.show_allergy_alerts || this.allergyProfiles.has(partnerId)) {
+            return this.allergyProfiles.get(partnerId) || {};
+        }
+        try {
+            const result = await this.env.services.rpc({
+                route: '/pos_demo/allergy_profile',
+                params: { partner_id: partnerId }
+            });
+            this.allergyProfiles.set(partnerId, result.products || {});
+        } catch (error) {
+            console.error('Error loading allergy profile:', error);
+        }
+        return this.allergyProfiles.get(partnerId) || {};
+    },
+
+    getAllergyConflicts(partnerId, productId) {
+        const profile = this.allergyProfiles.get(partnerId);
+        return (profile && profile[productId]) || [];
+    },
+
+    // Authoritative check of a whole cart in one server query
+    async checkCartAllergies(partnerId, productIds) {
+        const result = await this.env.services.rpc({
+            route: '/pos_demo/allergy_check',
+            params: { partner_id: partnerId, product_ids: productIds }
+        });
+        return result.conflicts || [];
+    },
+
+    // Typeahead lookup of prescriptions and patients
+    async counterSearch(query, limit = 20) {
+        try {
+            return await this.env.services.rpc({
+                route: '/pos_demo/counter_search',
+                params: { query: query, limit: limit }
+            });
+        } catch (error) {
+            console.error('Error searching prescriptions:', error);
+            return { prescriptions: [], patients: [] };
+        }
+    },
+
+    // Lots for the batch popup: unexpired, unreserved, first to expire first
+    async getFefoLots(productId) {
+        try {
+            const result = await this.env.services.rpc({
+                route: '/pos_demo/lots/fefo',
+                params: { config_id: this.config.id, product_id: productId }
+            });
+            return result.lots || [];
+        } catch (error) {
+            console.error('Error fetching lots:', error);
+            return [];
+        }
+    },
+
+    // Hold lot quantity for an order line so another till cannot sell it
+    async reserveLot(line, lotId, quantity) {
+        const result = await this.env.services.rpc({
+            route: '/pos_demo/lots/reserve',
+            params: {
+                config_id: this.config.id,
+                line_uuid: line.uuid,
+                lot_id: lotId,
+                quantity: quantity
+            }
+        });
+        if (result.reserved) {
+            line.reserved_lot_id = quantity > 0 ? lotId : null;
+            line.reserved_quantity = quantity > 0 ? quantity : 0;
+        }
+        return result;
+    },
+
+    // Holds expire on the server unless the till keeps extending them
+    async renewLotReservations() {
+        const lines = this.get_order_list().flatMap(
+            order => order.get_orderlines().filter(line => line.reserved_lot_id)
+        );
+        if (!lines.length) {
+            return;
+        }
+        let result;
+        try {
+            result = await this.env.services.rpc({
+                route: '/pos_demo/lots/renew',
+                params: { line_uuids: lines.map(line => line.uuid) }
+            });
+        } catch (error) {
+            console.error('Error renewing lot reservations:', error);
+            return;
+        }
+        const expired = new Set(result.expired || []);
+        for (const line of lines.filter(line => expired.has(line.uuid))) {
+            // Reserve again; another till may have taken the units meanwhile
+            let reservation;
+            try {
+                reservation = await this.reserveLot(line, line.reserved_lot_id, line.get_quantity());
+            } catch (error) {
+                console.error('Error renewing lot reservation:', error);
+                return;
+            }
+            if (!reservation.reserved) {
+                line.reserved_lot_id = null;
+                this.popup.add(ErrorPopup, {
+                    title: _t('Lot Reservation Lost'),
+                    body: _t('%s: only %s left in this lot that another till has not reserved.',
+                        line.get_full_product_name(), reservation.available),
+                });
+            }
+        }
+    },
+
+    async releaseLotReservations(lineUuids) {
+        if (!lineUuids.length) {
+            return;
+        }
+        try {
+            await this.env.services.rpc({
+                route: '/pos_demo/lots/release',
+                params: { line_uuids: lineUuids }
+            });
+        } catch (error) {
+            // Unreleased reservations time out on the server
+            console.error('Error releasing lot reservations:', error);
+        }
+    },
+
+    // Stock of other branches, answered from the server-side index
+    async getBranchStock(productIds) {
+        try {
+            const result = await this.env.services.rpc({
+                route: '/pos_demo/branch_stock',
+                params: { product_ids: productIds }
+            });
+            return result.products || {};
+        } catch (error) {
+            console.error('Error fetching branch stock:', error);
+            return {};
+        }
+    },
+    
     // Get patient's recent purchases for interaction checking
     async getPatientHistory(patientId, days = 30) {
         try {
@@ -109,6 +364,67 @@ patch(Order.prototype, {
         this.has_prescription_items = json.has_prescription_items || false;
     },
 
+    set_partner(partner) {
+        super.set_partner(...arguments);
+        if (partner) {
+            this.pos.loadAllergyProfile(partner.id);
+        }
+    },
+
+    add_product(product, options) {
+        const result = super.add_product(...arguments);
+        const partner = this.get_partner();
+        if (partner && this.pos.config.show_allergy_alerts) {
+            const conflicts = this.pos.getAllergyConflicts(partner.id, product.id);
+            if (conflicts.length) {
+                this.pos.popup.add(ErrorPopup, {
+                    title: _t('Allergy Alert'),
+                    body: conflicts.map(
+                        c => _t('%s contains %s (allergy: %s)', product.display_name, c.ingredient, c.allergy)
+                    ).join('\n'),
+                });
+            }
+        }
+        if (options && options.reserveLotId) {
+            this.reserveSelectedLot(options.reserveLotId);
+        }
+        return result;
+    },
+
+    // Hold the lot picked for the new line; a lot sold out meanwhile drops the line
+    async reserveSelectedLot(lotId) {
+        const line = this.get_selected_orderline();
+        let result;
+        try {
+            result = await this.pos.reserveLot(line, lotId, line.get_quantity());
+        } catch (error) {
+            // Offline: sell without the hold rather than block the counter
+            console.error('Error reserving lot:', error);
+            return;
+        }
+        if (!result.reserved) {
+            this.removeOrderline(line);
+            this.pos.popup.add(ErrorPopup, {
+                title: _t('Lot Unavailable'),
+                body: _t('Only %s left in this lot that another till has not reserved.', result.available),
+            });
+        }
+    },
+
+    removeOrderline(line) {
+        if (line.reserved_lot_id) {
+            this.pos.releaseLotReservations([line.uuid]);
+        }
+        return super.removeOrderline(...arguments);
+    },
+
+    // Receipt prints immediately; the fiscal number follows from the ETR queue
+    export_for_printing() {
+        const result = super.export_for_printing(...arguments);
+        result.etr_invoice_number = this.etr_invoice_number || 'PENDING';
+        return result;
+    },
+
     // Check if order contains prescription items
     checkPrescriptionItems() {
         const lines = this.get_orderlines();
@@ -124,3 +440,126 @@ patch(Order.prototype, {
         return lines.some(line => line.product.is_controlled_substance);
     }
 });
+
+// Lot-tracked products are sold from the lot that expires first
+patch(Product.prototype, {
+    async getAddProductOptions(code) {
+        if (this.tracking !== 'lot' || code) {
+            return super.getAddProductOptions(...arguments);
+        }
+        const lots = await this.pos.getFefoLots(this.id);
+        if (!lots.length) {
+            // No unreserved lot known here: fall back to typing the lot
+            return super.getAddProductOptions(...arguments);
+        }
+        const { confirmed, payload: lot } = await this.pos.popup.add(BatchSelectionPopup, {
+            batches: lots,
+        });
+        if (!confirmed) {
+            return;
+        }
+        const options = await super.getAddProductOptions({ type: 'lot', code: lot.name });
+        if (options) {
+            options.reserveLotId = lot.id;
+        }
+        return options;
+    }
+});
+
+// Resize the lot hold when the line quantity changes
+patch(Orderline.prototype, {
+    // Keep renewing the hold of lines restored after a reload
+    export_as_JSON() {
+        const json = super.export_as_JSON(...arguments);
+        json.reserved_lot_id = this.reserved_lot_id || null;
+        json.reserved_quantity = this.reserved_quantity || 0;
+        return json;
+    },
+
+    init_from_JSON(json) {
+        super.init_from_JSON(...arguments);
+        this.reserved_lot_id = json.reserved_lot_id;
+        this.reserved_quantity = json.reserved_quantity;
+    },
+
+    set_quantity(quantity, keep_price) {
+        const result = super.set_quantity(...arguments);
+        if (this.reserved_lot_id && result !== false && quantity !== 'remove') {
+            // Only the answer to the latest change applies
+            const request = (this.lotReserveRequest || 0) + 1;
+            this.lotReserveRequest = request;
+            this.pos.reserveLot(this, this.reserved_lot_id, this.get_quantity()).then((reservation) => {
+                if (reservation.reserved || request !== this.lotReserveRequest) {
+                    return;
+                }
+                // Never sell more than the hold covers
+                super.set_quantity(this.reserved_quantity, keep_price);
+                this.pos.popup.add(ErrorPopup, {
+                    title: _t('Lot Unavailable'),
+                    body: _t('Only %s left in this lot that another till has not reserved.', reservation.available),
+                });
+            }).catch((error) => console.error('Error resizing lot reservation:', error));
+        }
+        return result;
+    }
+});
+
+// Keep M-PESA confirmation on payment lines
+patch(Payment.prototype, {
+    export_as_JSON() {
+        const json = super.export_as_JSON(...arguments);
+        json.mpesa_transaction_id = this.mpesa_transaction_id || null;
+        json.mpesa_phone = this.mpesa_phone || null;
+        json.mpesa_request_id = this.mpesa_request_id || null;
+        return json;
+    },
+
+    init_from_JSON(json) {
+        super.init_from_JSON(...arguments);
+        this.mpesa_transaction_id = json.mpesa_transaction_id;
+        this.mpesa_phone = json.mpesa_phone;
+        this.mpesa_request_id = json.mpesa_request_id;
+    }
+});
+
+// M-PESA payment lines are collected with an STK push to the customer's phone
+patch(PaymentScreen.prototype, {
+    async addNewPaymentLine(paymentMethod) {
+        const result = await super.addNewPaymentLine(...arguments);
+        if (result && paymentMethod.payment_category === 'mpesa' && this.pos.config.mpesa_enabled) {
+            await this.collectMpesaPayment(this.currentOrder.selected_paymentline);
+        }
+        return result;
+    },
+
+    async collectMpesaPayment(line) {
+        const partner = this.currentOrder.get_partner();
+        const { confirmed, payload: phone } = await this.popup.add(TextInputPopup, {
+            title: _t('M-PESA Phone Number'),
+            startingValue: (partner && (partner.mobile || partner.phone)) || '',
+        });
+        if (!confirmed || !phone) {
+            this.currentOrder.remove_paymentline(line);
+            return;
+        }
+        line.set_payment_status('waiting');
+        let status;
+        try {
+            status = await this.pos.requestMpesaPayment(line.amount, phone, this.currentOrder.name);
+        } catch (error) {
+            status = { error: error.message || _t('M-PESA is unreachable') };
+        }
+        if (status.state === 'paid') {
+            line.mpesa_request_id = status.id;
+            line.mpesa_transaction_id = status.mpesa_receipt;
+            line.mpesa_phone = status.phone;
+            line.set_payment_status('done');
+            return;
+        }
+        this.currentOrder.remove_paymentline(line);
+        this.popup.add(ErrorPopup, {
+            title: _t('M-PESA Payment Failed'),
+            body: status.error || status.result_desc || _t('The customer did not confirm the payment'),
+        });
+    }
+});
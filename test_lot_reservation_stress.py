@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Lot Reservation Stress Test
+Many tills reserve the same lot at the same time; the total reserved must
+never exceed what is on hand.
+
+Usage:
+    python3 test_lot_reservation_stress.py --lot-id 42 --tills 20 --quantity 3
+"""
+
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+URL = "http://localhost:8069"
+DB = "pharmacy_kenya"
+USERNAME = "admin"
+PASSWORD = "admin"
+
+
+def json_rpc(session, route, params):
+    response = session.post(f'{URL}{route}', json={'jsonrpc': '2.0', 'method': 'call', 'params': params}, timeout=60)
+    response.raise_for_status()
+    data = response.json()
+    if data.get('error'):
+        raise RuntimeError(data['error'].get('data', {}).get('message') or data['error'])
+    return data.get('result')
+
+
+def login():
+    session = requests.Session()
+    result = json_rpc(session, '/web/session/authenticate', {'db': DB, 'login': USERNAME, 'password': PASSWORD})
+    if not result or not result.get('uid'):
+        raise RuntimeError("Authentication failed")
+    return session
+
+
+def call_kw(session, model, method, args):
+    return json_rpc(session, f'/web/dataset/call_kw/{model}/{method}', {
+        'model': model, 'method': method, 'args': args, 'kwargs': {},
+    })
+
+
+def run(config_id, lot_id, tills, quantity, rounds):
+    print(f"🔌 Connecting to Odoo at {URL}...")
+    admin = login()
+    lot = call_kw(admin, 'stock.lot', 'read', [[lot_id], ['name', 'product_id']])[0]
+    product_id = lot['product_id'][0]
+
+    def on_hand():
+        lots = json_rpc(admin, '/pos_demo/lots/fefo', {'config_id': config_id, 'product_id': product_id})['lots']
+        return next((l['available_quantity'] for l in lots if l['id'] == lot_id), 0.0)
+
+    available = on_hand()
+    print(f"✓ Lot {lot['name']}: {available} unreserved")
+
+    # One HTTP session per till, like real POS browsers
+    sessions = [login() for _ in range(tills)]
+    failures = 0
+    for round_number in range(1, rounds + 1):
+        line_uuids = [str(uuid.uuid4()) for _ in range(tills)]
+
+        def reserve(index):
+            try:
+                return json_rpc(sessions[index], '/pos_demo/lots/reserve', {
+                    'config_id': config_id,
+                    'line_uuid': line_uuids[index],
+                    'lot_id': lot_id,
+                    'quantity': quantity,
+                })
+            except Exception as e:
+                # e.g. serialisation retries exhausted under heavy contention
+                return {'reserved': False, 'error': str(e)}
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=tills) as pool:
+            results = list(pool.map(reserve, range(tills)))
+        elapsed = time.time() - started
+
+        granted = sum(1 for r in results if r['reserved'])
+        errors = sum(1 for r in results if r.get('error'))
+        reserved = granted * quantity
+        expected = min(tills, int(available // quantity))
+        ok = reserved <= available
+        failures += not ok
+        print(f"{'✓' if ok else '❌'} Round {round_number}: {granted}/{tills} tills reserved "
+              f"{reserved} of {available} in {elapsed:.2f}s (up to {expected} possible, {errors} errors)")
+
+        json_rpc(admin, '/pos_demo/lots/release', {'line_uuids': line_uuids})
+        if on_hand() != available:
+            failures += 1
+            print("❌ Reservations were not all released")
+
+    print("\n" + "=" * 70)
+    print("✅ NO OVERSELLING" if not failures else f"❌ {failures} FAILED ROUND(S)")
+    print("=" * 70)
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config-id', type=int, default=1, help='POS config the tills belong to')
+    parser.add_argument('--lot-id', type=int, required=True, help='Lot all tills compete for')
+    parser.add_argument('--tills', type=int, default=20, help='Concurrent tills')
+    parser.add_argument('--quantity', type=float, default=1.0, help='Quantity each till reserves')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    raise SystemExit(0 if run(args.config_id, args.lot_id, args.tills, args.quantity, args.rounds) else 1)
+
+
+if __name__ == '__main__':
+    main()
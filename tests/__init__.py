@@ -1,3 +1,14 @@
 # -*- coding: utf-8 -*-
 from . import test_prescription
 from . import test_insurance
+from . import test_mpesa
+from . import test_allergy
+from . import test_controlled_drugs
+from . import test_pos_order_archive
+from . import test_session_totals
+from . import test_session_close
+from . import test_etr_queue
+from . import test_lot_valuation
+from . import test_reorder_planner
+from . import test_expiry_writeoff
+from . import test_branch_stock
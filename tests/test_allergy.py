@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from odoo.tests.common import TransactionCase
+
+
+class TestAllergy(TransactionCase):
+    
+    def setUp(self):
+        super().setUp()
+        
+        Ingredient = self.env['pharmacy.ingredient']
+        self.penicillins = Ingredient.create({
+            'name': 'Test Penicillins',
+            'is_class': True,
+            'synonyms': 'test penicillin',
+        })
+        self.amoxicillin = Ingredient.create({
+            'name': 'Testamoxil',
+            'parent_id': self.penicillins.id,
+        })
+        self.paracetamol = Ingredient.create({
+            'name': 'Testamol',
+            'synonyms': 'testaminophen',
+        })
+        
+        self.patient = self.env['res.partner'].create({
+            'name': 'Allergic Patient',
+            'is_patient': True,
+            'allergies': 'Test Penicillin (rash)',
+        })
+        self.amoxicillin_product = self.env['product.product'].create({
+            'name': 'Testamoxil 250mg Capsules',
+            'active_ingredients': 'Testamoxil Trihydrate 250mg',
+        })
+        self.paracetamol_product = self.env['product.product'].create({
+            'name': 'Testamol 500mg Tablets',
+            'active_ingredients': 'Testaminophen 500mg',
+        })
+    
+    def test_text_matching(self):
+        """Test free texts are normalized into the ingredient vocabulary"""
+        self.assertIn(self.penicillins, self.patient.allergy_ingredient_ids)
+        self.assertEqual(self.amoxicillin_product.ingredient_ids, self.amoxicillin)
+        self.assertEqual(self.paracetamol_product.ingredient_ids, self.paracetamol)
+    
+    def test_class_allergy_conflict(self):
+        """Test an allergy to a class flags products of its members"""
+        conflicts = self.patient.check_allergy_conflicts(
+            self.patient.id,
+            [self.amoxicillin_product.id, self.paracetamol_product.id],
+        )
+        self.assertEqual([c['product_id'] for c in conflicts], [self.amoxicillin_product.id])
+        self.assertEqual(conflicts[0]['allergy'], 'Test Penicillins')
+        
+        profile = self.patient.get_allergy_profile(self.patient.id)
+        self.assertIn(self.amoxicillin_product.id, profile)
+        self.assertNotIn(self.paracetamol_product.id, profile)
+        
+        # Editing the allergies refreshes the cached profile
+        self.patient.allergies = 'Testamol'
+        profile = self.patient.get_allergy_profile(self.patient.id)
+        self.assertEqual(list(profile), [self.paracetamol_product.id])
+    
+    def test_vocabulary_edits_refresh_matches(self):
+        """Test only matching edits retire the vocabulary and rematch texts"""
+        Generation = self.env['pharmacy.cache.generation']
+        vocabulary = Generation._get('ingredient_vocabulary')
+        profiles = Generation._get('allergy_profiles')
+        self.assertEqual(list(self.patient.get_allergy_profile(self.patient.id)), [self.amoxicillin_product.id])
+        
+        self.paracetamol.is_class = False
+        self.assertEqual(Generation._get('ingredient_vocabulary'), vocabulary)
+        self.assertEqual(Generation._get('allergy_profiles'), profiles)
+        
+        # A new synonym is picked up by the texts already saved
+        self.paracetamol.synonyms = 'testaminophen, test penicillin'
+        self.assertNotEqual(Generation._get('ingredient_vocabulary'), vocabulary)
+        self.assertIn(self.paracetamol, self.patient.allergy_ingredient_ids)
+        profile = self.patient.get_allergy_profile(self.patient.id)
+        self.assertEqual(sorted(profile), sorted([self.amoxicillin_product.id, self.paracetamol_product.id]))
+    
+    def test_patient_edit_keeps_other_profiles(self):
+        """Test editing a patient's allergies only retires that patient's profile"""
+        Generation = self.env['pharmacy.cache.generation']
+        other = self.env['res.partner'].create({
+            'name': 'Other Patient',
+            'is_patient': True,
+            'allergies': 'Testamol',
+        })
+        profiles = Generation._get('allergy_profiles')
+        version = self.patient.allergy_version
+        other_version = other.allergy_version
+        self.assertEqual(list(self.patient.get_allergy_profile(self.patient.id)), [self.amoxicillin_product.id])
+        
+        other.allergies = 'Test Penicillin'
+        self.assertEqual(Generation._get('allergy_profiles'), profiles)
+        self.assertEqual(self.patient.allergy_version, version)
+        self.assertNotEqual(other.allergy_version, other_version)
+        self.assertEqual(list(other.get_allergy_profile(other.id)), [self.amoxicillin_product.id])
+        self.assertEqual(list(self.patient.get_allergy_profile(self.patient.id)), [self.amoxicillin_product.id])
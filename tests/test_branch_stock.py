@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+from datetime import timedelta
+
+from odoo.addons.pos_demo.models.branch_stock import PharmacyBranchStock
+
+
+class TestBranchStock(TransactionCase):
+    
+    def setUp(self):
+        super().setUp()
+        stock = self.env['stock.warehouse'].search(
+            [('company_id', '=', self.env.company.id)], limit=1
+        ).lot_stock_id
+        Location = self.env['stock.location']
+        self.slow_branch = Location.create({'name': 'Test Slow Branch', 'location_id': stock.id, 'usage': 'internal'})
+        self.fast_branch = Location.create({'name': 'Test Fast Branch', 'location_id': stock.id, 'usage': 'internal'})
+        self.product = self.env['product.product'].create({
+            'name': 'Test Cetirizine 10mg',
+            'type': 'consu',
+            'is_storable': True,
+            'tracking': 'lot',
+        })
+        self.today = fields.Date.context_today(self.product)
+    
+    def _index_lot(self, name, days, quantity):
+        lot = self.env['stock.lot'].create({
+            'name': name,
+            'product_id': self.product.id,
+            'expiry_date': self.today + timedelta(days=days),
+        })
+        self.env['pharmacy.branch.stock'].create({
+            'product_id': self.product.id,
+            'branch_location_id': self.slow_branch.id,
+            'lot_id': lot.id,
+            'expiry_date': lot.expiry_date,
+            'quantity': quantity,
+            'available_quantity': quantity,
+        })
+        return lot
+    
+    def test_excess_follows_expiry_order(self):
+        """Test earlier-expiring lots use up part of a later lot's selling window"""
+        first = self._index_lot('CET-010', 10, 50)
+        second = self._index_lot('CET-030', 30, 50)
+        velocity = {
+            (self.product.id, self.slow_branch.id): 2.0,
+            (self.product.id, self.fast_branch.id): 10.0,
+        }
+        with patch.object(PharmacyBranchStock, '_get_branch_velocity', return_value=velocity):
+            suggestions = self.env['pharmacy.transfer.suggestion']._generate_suggestions()
+        
+        quantities = {s.lot_id: s.quantity for s in suggestions if s.product_id == self.product}
+        # 20 of the first lot sell in 10 days; the second lot then has 40 of
+        # its 60-day window left, so 10 of it would expire unsold
+        self.assertEqual(quantities, {first: 30, second: 10})
+        self.assertEqual(suggestions.filtered(lambda s: s.product_id == self.product).dest_location_id, self.fast_branch)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from odoo.tests.common import TransactionCase
+from odoo.exceptions import UserError
+from datetime import date
+
+
+class TestControlledDrugs(TransactionCase):
+    
+    def setUp(self):
+        super().setUp()
+        
+        self.product = self.env['product.product'].create({
+            'name': 'Test Morphine 10mg',
+            'is_pharmaceutical': True,
+            'drug_schedule': 'schedule_2',
+        })
+        Period = self.env['controlled.drugs.register.period']
+        self.period_2001 = Period.create({
+            'name': 'Test 2001',
+            'date_from': date(2001, 1, 1),
+            'date_to': date(2001, 12, 31),
+        })
+        self.period_2002 = Period.create({
+            'name': 'Test 2002',
+            'date_from': date(2002, 1, 1),
+            'date_to': date(2002, 12, 31),
+        })
+        
+        Register = self.env['controlled.drugs.register']
+        self.receipt = Register.create({
+            'date': '2001-03-01 10:00:00',
+            'product_id': self.product.id,
+            'transaction_type': 'receipt',
+            'quantity_received': 100,
+        })
+        self.dispensing = Register.create({
+            'date': '2001-06-01 10:00:00',
+            'product_id': self.product.id,
+            'transaction_type': 'dispensing',
+            'quantity_dispensed': 30,
+            'patient_name': 'Test Patient',
+            'prescriber_name': 'Dr. Test Prescriber',
+        })
+        self.next_receipt = Register.create({
+            'date': '2002-02-01 10:00:00',
+            'product_id': self.product.id,
+            'transaction_type': 'receipt',
+            'quantity_received': 10,
+        })
+    
+    def test_freeze_refuses_edits(self):
+        """Test entries dated in a frozen period are read-only"""
+        self.period_2001.action_freeze()
+        self.assertEqual(self.period_2001.state, 'frozen')
+        
+        with self.assertRaises(UserError):
+            self.dispensing.write({'quantity_dispensed': 20})
+        with self.assertRaises(UserError):
+            self.receipt.unlink()
+        with self.assertRaises(UserError):
+            self.env['controlled.drugs.register'].create({
+                'date': '2001-08-01 10:00:00',
+                'product_id': self.product.id,
+                'transaction_type': 'receipt',
+                'quantity_received': 5,
+            })
+        # Later periods stay open
+        self.next_receipt.write({'remarks': 'Checked'})
+    
+    def test_closing_balance_carried(self):
+        """Test the frozen closing balance opens the next period"""
+        self.period_2001.action_freeze()
+        balance = self.period_2001.balance_ids.filtered(lambda b: b.product_id == self.product)
+        self.assertEqual(balance.closing_balance, 70)
+        
+        # Once the frozen rows are archived, new entries start from that balance
+        self.period_2001.action_archive_entries()
+        entry = self.env['controlled.drugs.register'].create({
+            'date': '2002-01-15 10:00:00',
+            'product_id': self.product.id,
+            'transaction_type': 'receipt',
+            'quantity_received': 5,
+        })
+        self.assertEqual(entry.running_balance, 75)
+        self.assertEqual(self.next_receipt.running_balance, 85)
+        
+        self.period_2002.action_freeze()
+        balance = self.period_2002.balance_ids.filtered(lambda b: b.product_id == self.product)
+        self.assertEqual(balance.opening_balance, 70)
+        self.assertEqual(balance.closing_balance, 85)
+    
+    def test_history_includes_archive(self):
+        """Test the history view returns archived and live entries"""
+        self.period_2001.action_freeze()
+        self.period_2001.action_archive_entries()
+        self.assertEqual(self.period_2001.state, 'archived')
+        self.assertEqual(self.period_2001.archived_count, 2)
+        self.assertFalse(self.receipt.exists())
+        
+        history = self.env['controlled.drugs.register.history'].search(
+            [('product_id', '=', self.product.id)], order='date'
+        )
+        self.assertEqual(history.mapped('source'), ['archive', 'archive', 'live'])
+        self.assertEqual(history.mapped('running_balance'), [100, 70, 80])
+        self.assertEqual(history[:2].period_id, self.period_2001)
+        self.assertEqual(history[2].period_id, self.period_2002)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+
+
+@tagged('post_install', '-at_install')
+class TestEtrQueue(TestPoSCommon):
+    
+    def setUp(self):
+        super().setUp()
+        self.config = self.basic_config
+        self.config.write({
+            'etr_enabled': True,
+            'etr_cu_serial': 'KRACU0400001',
+            'etr_api_url': 'mock://',
+        })
+        self.product = self.create_product('Test Paracetamol 500mg', self.categ_basic, 20.0)
+        self.open_new_session()
+        self.Queue = self.env['pos.etr.queue']
+    
+    def _paid_order(self):
+        order_data = self.create_ui_order_data([(self.product, 1)])
+        return self.env['pos.order'].browse(
+            self.env['pos.order'].create_from_ui([order_data])[0]['id']
+        )
+    
+    def test_paid_order_signed_once(self):
+        """Test a paid order is queued and signed once"""
+        order = self._paid_order()
+        entry = self.Queue.search([('order_id', '=', order.id)])
+        self.assertEqual(len(entry), 1)
+        self.assertEqual(order.etr_state, 'pending')
+        
+        # Writing the paid state again does not queue the order twice
+        order.write({'state': 'paid'})
+        self.assertEqual(self.Queue.search_count([('order_id', '=', order.id)]), 1)
+        
+        self.Queue._cron_process_queue()
+        self.assertEqual(entry.state, 'done')
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(order.etr_state, 'signed')
+        self.assertEqual(order.etr_invoice_number, entry.fiscal_number)
+        
+        # A second run after success is a no-op
+        self.Queue._cron_process_queue()
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(order.etr_invoice_number, entry.fiscal_number)
+    
+    def test_fiscal_numbers_unique(self):
+        """Test the mock control unit never reuses a fiscal number"""
+        orders = self._paid_order() | self._paid_order()
+        self.Queue._cron_process_queue()
+        entries = self.Queue.search([('order_id', 'in', orders.ids)])
+        self.assertEqual(entries.mapped('state'), ['done', 'done'])
+        self.assertEqual(len(set(entries.mapped('fiscal_number'))), 2)
+        
+        # Deleting a signed receipt does not free its number
+        last_number = max(entries.mapped('fiscal_number'))
+        entries[0].unlink()
+        third = self._paid_order()
+        self.Queue._cron_process_queue()
+        self.assertGreater(third.etr_invoice_number, last_number)
+    
+    def test_failure_backs_off(self):
+        """Test a failed submission is retried later with a growing delay"""
+        order = self._paid_order()
+        entry = self.Queue.search([('order_id', '=', order.id)])
+        
+        with patch.object(type(self.Queue), '_mock_control_unit_sign', side_effect=ValueError('CU offline')):
+            self.Queue._cron_process_queue()
+            self.assertEqual(entry.state, 'pending')
+            self.assertEqual(entry.attempts, 1)
+            self.assertEqual(entry.error, 'CU offline')
+            first_delay = entry.next_attempt_at - fields.Datetime.now()
+            
+            # Still backing off: the worker leaves the entry alone
+            self.Queue._cron_process_queue()
+            self.assertEqual(entry.attempts, 1)
+            
+            entry.write({'next_attempt_at': fields.Datetime.now()})
+            self.Queue._cron_process_queue()
+            self.assertEqual(entry.attempts, 2)
+            self.assertGreater(entry.next_attempt_at - fields.Datetime.now(), first_delay)
+        
+        # Due again once the control unit is back
+        entry.write({'next_attempt_at': fields.Datetime.now()})
+        self.Queue._cron_process_queue()
+        self.assertEqual(entry.state, 'done')
+        self.assertEqual(entry.attempts, 3)
+        self.assertEqual(order.etr_state, 'signed')
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from odoo.tests.common import TransactionCase
+from odoo.exceptions import UserError
+from datetime import date, timedelta
+
+
+class TestExpiryWriteoff(TransactionCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.stock = self.env['stock.warehouse'].search(
+            [('company_id', '=', self.env.company.id)], limit=1
+        ).lot_stock_id
+        self.quarantine = self.env.ref('pos_demo.stock_location_expired_quarantine')
+        self.product = self.env['product.product'].create({
+            'name': 'Test Pethidine 50mg',
+            'type': 'consu',
+            'is_storable': True,
+            'tracking': 'lot',
+            'is_pharmaceutical': True,
+            'drug_schedule': 'schedule_2',
+        })
+        self.expired_lot = self.env['stock.lot'].create({
+            'name': 'PET-OLD',
+            'product_id': self.product.id,
+            'expiry_date': date.today() - timedelta(days=3),
+        })
+        self.good_lot = self.env['stock.lot'].create({
+            'name': 'PET-NEW',
+            'product_id': self.product.id,
+            'expiry_date': date.today() + timedelta(days=300),
+        })
+        Quant = self.env['stock.quant']
+        Quant._update_available_quantity(self.product, self.stock, 40, lot_id=self.expired_lot)
+        Quant._update_available_quantity(self.product, self.stock, 25, lot_id=self.good_lot)
+        
+        self.receipt = self.env['controlled.drugs.register'].create({
+            'date': date.today() - timedelta(days=30),
+            'product_id': self.product.id,
+            'transaction_type': 'receipt',
+            'quantity_received': 65,
+        })
+        self.witness = self.env['res.users'].create({'name': 'Witness Pharmacist', 'login': 'witness_pharmacist'})
+    
+    def _on_hand(self, location, lot):
+        return sum(self.env['stock.quant'].search([
+            ('location_id', '=', location.id),
+            ('lot_id', '=', lot.id),
+        ]).mapped('quantity'))
+    
+    def test_controlled_needs_witness(self):
+        """Test expired controlled drugs are not written off without a witness"""
+        wizard = self.env['pharmacy.expiry.writeoff'].create({'location_id': self.stock.id})
+        with self.assertRaises(UserError):
+            wizard.action_write_off()
+    
+    def test_write_off_expired_controlled_lot(self):
+        """Test expired lots move to quarantine in one transfer and are registered"""
+        wizard = self.env['pharmacy.expiry.writeoff'].create({
+            'location_id': self.stock.id,
+            'witness_id': self.witness.id,
+        })
+        wizard.action_write_off()
+        
+        self.assertEqual(wizard.lot_count, 1)
+        picking = wizard.picking_id
+        self.assertEqual(len(picking), 1)
+        self.assertEqual(picking.state, 'done')
+        self.assertEqual(picking.move_line_ids.lot_id, self.expired_lot)
+        
+        # Only the expired lot leaves sellable stock
+        self.assertEqual(self._on_hand(self.stock, self.expired_lot), 0)
+        self.assertEqual(self._on_hand(self.stock, self.good_lot), 25)
+        self.assertEqual(self._on_hand(self.quarantine, self.expired_lot), 40)
+        
+        entry = self.env['controlled.drugs.register'].search([('stock_picking_id', '=', picking.id)])
+        self.assertEqual(len(entry), 1)
+        self.assertEqual(entry.transaction_type, 'destruction')
+        self.assertEqual(entry.lot_id, self.expired_lot)
+        self.assertEqual(entry.quantity_dispensed, 40)
+        self.assertEqual(entry.witnessed_by, self.witness)
+        # Continues from the receipt's balance
+        self.assertEqual(self.receipt.running_balance, 65)
+        self.assertEqual(entry.running_balance, 25)
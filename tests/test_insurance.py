@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
+from odoo import fields
+from odoo.tests import tagged
 from odoo.tests.common import TransactionCase
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.exceptions import UserError
+from odoo.tools import mute_logger
+from psycopg2 import IntegrityError
+from unittest.mock import patch
+import base64
+import hashlib
+import json
 
 
 class TestInsurance(TransactionCase):
@@ -78,3 +88,163 @@ class TestInsurance(TransactionCase):
         claim.action_submit()
         self.assertEqual(claim.state, 'submitted')
         self.assertIsNotNone(claim.submission_date)
+    
+    def test_provider_code_unique(self):
+        """Test provider codes are unique at database level"""
+        with mute_logger('odoo.sql_db'), self.assertRaises(IntegrityError):
+            self.env['insurance.provider'].create({
+                'name': 'Duplicate Insurance',
+                'code': 'TEST',
+                'provider_type': 'private',
+            })
+    
+    def test_provider_lookup_cache(self):
+        """Test cached provider lookup by code and id follows writes"""
+        Provider = self.env['insurance.provider']
+        terms = Provider._resolve_provider('TEST')
+        self.assertEqual(terms['id'], self.provider.id)
+        self.assertEqual(Provider._resolve_provider(self.provider.id)['copay_percentage'], 20)
+        
+        self.provider.write({'code': 'TEST2', 'copay_percentage': 30})
+        self.assertFalse(Provider._resolve_provider('TEST'))
+        self.assertEqual(Provider._resolve_provider('TEST2')['copay_percentage'], 30)
+        
+        # Claims are only created for known, active providers
+        Claim = self.env['insurance.claim']
+        self.assertEqual(Claim._get_claim_provider_terms('TEST2')['id'], self.provider.id)
+        self.provider.active = False
+        with self.assertRaises(UserError):
+            Claim._get_claim_provider_terms(self.provider.id)
+    
+    def test_claim_batch_export(self):
+        """Test claim batch export pages through claims and records control totals"""
+        claims = self.env['insurance.claim']
+        for amount in (100, 250, 40):
+            claims |= self.env['insurance.claim'].create({
+                'patient_id': self.patient.id,
+                'insurance_provider_id': self.provider.id,
+                'member_number': 'MEM12345',
+                'line_ids': [(0, 0, {
+                    'product_id': self.product.id,
+                    'quantity': 1,
+                    'unit_price': amount,
+                })],
+            })
+        claims[:2].write({'state': 'submitted'})
+        
+        export = self.env['insurance.claim.export'].create({
+            'provider_id': self.provider.id,
+            'date_from': claims[0].date,
+            'date_to': claims[0].date,
+            'export_format': 'json',
+        })
+        with patch('odoo.addons.pos_demo.models.insurance_claim_export.CLAIM_SCHEDULE_PAGE', 1):
+            export._run(auto_commit=False)
+        
+        self.assertEqual(export.state, 'done')
+        self.assertEqual(export.claim_count, 2)
+        self.assertEqual(export.total_claimed, 350)
+        raw = base64.b64decode(export.attachment_id.datas)
+        self.assertEqual(export.checksum, hashlib.sha256(raw).hexdigest())
+        batch = json.loads(raw)
+        self.assertEqual(len(batch['claims']), 2)
+        self.assertEqual(batch['control']['claim_count'], 2)
+    
+    def test_remittance_import(self):
+        """Test remittance rows settle claims matched by number or member and date"""
+        claims = self.env['insurance.claim']
+        for member in ('MEM1', 'MEM2', 'MEM3', 'MEM4'):
+            claims |= self.env['insurance.claim'].create({
+                'patient_id': self.patient.id,
+                'insurance_provider_id': self.provider.id,
+                'member_number': member,
+                'line_ids': [(0, 0, {
+                    'product_id': self.product.id,
+                    'quantity': 1,
+                    'unit_price': 100,
+                })],
+            })
+        claims.write({'state': 'submitted'})
+        message_count = len(claims.message_ids)
+        date = claims[0].date.strftime('%Y-%m-%d')
+        remittance = '\n'.join([
+            'Claim Number,Member Number,Claim Date,Approved Amount,Rejection Reason,Payment Reference,Payment Date',
+            '%s,MEM1,%s,100,,EFT001,%s' % (claims[0].name, date, date),
+            ',MEM2,%s,60,Dosage not covered,,' % date,
+            ',MEM3,%s,0,Not a member,,' % date,
+            'UNKNOWN,MEM9,%s,50,,,' % date,
+            ',MEM4,%s,,,,' % date,
+        ])
+        wizard = self.env['insurance.remittance.import'].create({
+            'provider_id': self.provider.id,
+            'remittance_file': base64.b64encode(remittance.encode()),
+        })
+        wizard.action_import()
+        
+        self.assertEqual((wizard.number_match_count, wizard.member_match_count), (1, 2))
+        self.assertEqual(wizard.exception_count, 2)
+        # A blank amount is reported, not read as a rejection
+        self.assertEqual(claims.mapped('state'), ['paid', 'partial', 'rejected', 'submitted'])
+        self.assertEqual(claims[0].payment_reference, 'EFT001')
+        self.assertEqual(claims[1].rejected_amount, 40)
+        self.assertEqual(claims[1].rejection_reason, 'Dosage not covered')
+        self.assertEqual(len(claims.message_ids), message_count)
+
+
+@tagged('post_install', '-at_install')
+class TestInsurerInvoicing(AccountTestInvoicingCommon):
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.provider = cls.env['insurance.provider'].create({
+            'name': 'Invoice Test Insurance',
+            'code': 'INVTEST',
+            'provider_type': 'private',
+            'partner_id': cls.partner_a.id,
+        })
+        cls.patient = cls.env['res.partner'].create({'name': 'Invoiced Patient', 'is_patient': True})
+        cls.product_a = cls.env['product.product'].create({'name': 'Test Amoxicillin', 'list_price': 100})
+        cls.product_b = cls.env['product.product'].create({'name': 'Test Ibuprofen', 'list_price': 50})
+    
+    def _approved_claim(self, lines, copay=0.0):
+        claim = self.env['insurance.claim'].create({
+            'patient_id': self.patient.id,
+            'insurance_provider_id': self.provider.id,
+            'member_number': 'MEM777',
+            'date': '2024-03-10',
+            'patient_copay': copay,
+            'line_ids': [(0, 0, {
+                'product_id': product.id,
+                'quantity': quantity,
+                'unit_price': price,
+            }) for product, quantity, price in lines],
+        })
+        claim.write({'state': 'approved', 'approved_amount': claim.total_amount})
+        return claim
+    
+    def test_claims_invoiced_together(self):
+        """Test two claims become one insurer invoice net of co-payments"""
+        first = self._approved_claim([(self.product_a, 2, 100)], copay=40)
+        second = self._approved_claim([(self.product_a, 1, 100), (self.product_b, 1, 50)])
+        
+        moves = self.env['insurance.claim']._invoice_claims_by_provider(
+            fields.Date.to_date('2024-03-01'), fields.Date.to_date('2024-03-31'),
+        )
+        self.assertEqual(len(moves), 1)
+        self.assertEqual(moves.partner_id, self.partner_a)
+        self.assertEqual((first | second).invoice_id, moves)
+        # 200 - 40 co-payment + 150
+        self.assertAlmostEqual(moves.amount_total, 310)
+        by_product = {line.product_id: line for line in moves.invoice_line_ids}
+        self.assertEqual(by_product[self.product_a].quantity, 3)
+        self.assertAlmostEqual(by_product[self.product_a].price_subtotal, 260)
+        self.assertAlmostEqual(by_product[self.product_b].price_subtotal, 50)
+        
+        schedule = self.env['ir.attachment'].search([('res_model', '=', 'account.move'), ('res_id', '=', moves.id)])
+        self.assertEqual(len(schedule.raw.decode().splitlines()), 3)
+        
+        # Invoiced claims are not invoiced again
+        self.assertFalse(self.env['insurance.claim']._invoice_claims_by_provider(
+            fields.Date.to_date('2024-03-01'), fields.Date.to_date('2024-03-31'),
+        ))
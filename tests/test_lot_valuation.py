@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from odoo.tests.common import TransactionCase
+from datetime import date, timedelta
+
+
+class TestLotValuation(TransactionCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.stock = self.env['stock.warehouse'].search(
+            [('company_id', '=', self.env.company.id)], limit=1
+        ).lot_stock_id
+        self.product = self.env['product.product'].create({
+            'name': 'Test Metformin 500mg',
+            'type': 'consu',
+            'is_storable': True,
+            'tracking': 'lot',
+            'standard_price': 4.0,
+        })
+        self.lot = self.env['stock.lot'].create({
+            'name': 'MET-001',
+            'product_id': self.product.id,
+            'expiry_date': date.today() + timedelta(days=60),
+        })
+        self.env['stock.quant']._update_available_quantity(self.product, self.stock, 10, lot_id=self.lot)
+        self.Valuation = self.env['pharmacy.lot.valuation']
+        self.Valuation._refresh_snapshot()
+    
+    def _row(self):
+        return self.Valuation.search([
+            ('date', '=', date.today()),
+            ('product_id', '=', self.product.id),
+            ('lot_id', '=', self.lot.id),
+        ])
+    
+    def _pending(self):
+        return self.env['pharmacy.stock.refresh'].search_count([('product_id', '=', self.product.id)])
+    
+    def test_refresh_after_stock_move(self):
+        """Test a validated stock move is valued after the refresh cron"""
+        self.assertEqual(self._row().quantity, 10)
+        self.assertEqual(self._row().expiry_bucket, 'lt90')
+        
+        self.env['stock.quant'].with_context(inventory_mode=True).create({
+            'product_id': self.product.id,
+            'location_id': self.stock.id,
+            'lot_id': self.lot.id,
+            'inventory_quantity': 25,
+        }).action_apply_inventory()
+        # The move only marks the product; the row catches up in the cron
+        self.assertEqual(self._pending(), 1)
+        self.assertEqual(self._row().quantity, 10)
+        
+        self.env['pharmacy.stock.refresh']._cron_refresh()
+        self.assertFalse(self._pending())
+        row = self._row()
+        self.assertEqual(len(row), 1)
+        self.assertEqual(row.quantity, 25)
+        self.assertEqual(row.value, 100)
+    
+    def test_refresh_after_cost_change(self):
+        """Test lots without a purchase price follow the product cost"""
+        self.assertEqual(self._row().unit_cost, 4)
+        
+        self.product.standard_price = 6.0
+        self.assertEqual(self._pending(), 1)
+        self.env['pharmacy.stock.refresh']._cron_refresh()
+        self.assertEqual(self._row().unit_cost, 6)
+        self.assertEqual(self._row().value, 60)
+        
+        # The lot's own purchase price wins over the product cost
+        self.lot.purchase_price = 5.0
+        self.assertEqual(self._row().unit_cost, 5)
+        self.assertEqual(self._row().value, 50)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch, MagicMock
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.pos_demo.models import mpesa_request
+from odoo.addons.pos_demo.wizard.mpesa_statement_import import MpesaStatementImport
+from datetime import datetime, timedelta
+
+
+class TestMpesa(TransactionCase):
+    
+    def setUp(self):
+        super().setUp()
+        mpesa_request._token_cache.clear()
+        
+        self.config = self.env['pos.config'].create({
+            'name': 'Test Pharmacy Till',
+            'mpesa_enabled': True,
+            'mpesa_shortcode': '174379',
+            'mpesa_api_key': 'key',
+            'mpesa_api_secret': 'secret',
+            'mpesa_passkey': 'passkey',
+            'mpesa_environment': 'simulator',
+        })
+    
+    def _mock_daraja(self):
+        """Patch the HTTP calls made to Daraja"""
+        token_response = MagicMock(status_code=200)
+        token_response.json.return_value = {'access_token': 'TOKEN', 'expires_in': '3599'}
+        push_response = MagicMock(status_code=200, content=b'{}')
+        push_response.json.return_value = {
+            'MerchantRequestID': '29115-34620561-1',
+            'CheckoutRequestID': 'ws_CO_TEST',
+            'ResponseCode': '0',
+        }
+        get = patch.object(mpesa_request.requests, 'get', return_value=token_response)
+        post = patch.object(mpesa_request.requests, 'post', return_value=push_response)
+        return get, post
+    
+    def test_normalize_msisdn(self):
+        """Test phone numbers are converted to Daraja format"""
+        self.assertEqual(mpesa_request.normalize_msisdn('0712 345 678'), '254712345678')
+        self.assertEqual(mpesa_request.normalize_msisdn('+254712345678'), '254712345678')
+        self.assertEqual(mpesa_request.normalize_msisdn('712345678'), '254712345678')
+    
+    def test_stk_push_and_callback(self):
+        """Test STK push stays pending until the callback confirms it"""
+        get, post = self._mock_daraja()
+        with get as mock_get, post:
+            status = self.env['pos.mpesa.request'].create_stk_push(
+                self.config.id, 150.0, '0712345678'
+            )
+            self.env['pos.mpesa.request'].create_stk_push(self.config.id, 50.0, '0712345678')
+            # Token fetched once and reused for the second push
+            self.assertEqual(mock_get.call_count, 1)
+        
+        self.assertEqual(status['state'], 'pending')
+        request = self.env['pos.mpesa.request'].browse(status['id'])
+        self.assertEqual(request.name, 'ws_CO_TEST')
+        
+        self.env['pos.mpesa.request']._process_callback(request.callback_token, {
+            'Body': {'stkCallback': {
+                'MerchantRequestID': '29115-34620561-1',
+                'CheckoutRequestID': 'ws_CO_TEST',
+                'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CallbackMetadata': {'Item': [
+                    {'Name': 'Amount', 'Value': 150},
+                    {'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'},
+                    {'Name': 'TransactionDate', 'Value': 20240101102115},
+                    {'Name': 'PhoneNumber', 'Value': 254712345678},
+                ]},
+            }},
+        })
+        self.assertEqual(request.state, 'paid')
+        self.assertEqual(request.mpesa_receipt, 'NLJ7RT61SV')
+    
+    def test_payment_takes_confirmed_receipt(self):
+        """Test a synced payment line gets the receipt confirmed by Daraja"""
+        get, post = self._mock_daraja()
+        with get, post:
+            status = self.env['pos.mpesa.request'].create_stk_push(
+                self.config.id, 150.0, '0712345678'
+            )
+        request = self.env['pos.mpesa.request'].browse(status['id'])
+        self.env['pos.mpesa.request']._process_callback(request.callback_token, {
+            'Body': {'stkCallback': {
+                'CheckoutRequestID': 'ws_CO_TEST',
+                'ResultCode': 0,
+                'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'NLJ7RT61SV'}]},
+            }},
+        })
+        
+        vals = self.env['pos.order']._payment_fields(self.env['pos.order'], {
+            'amount': 150.0,
+            'name': '2024-01-01 10:21:15',
+            'payment_method_id': False,
+            'mpesa_request_id': request.id,
+            'mpesa_transaction_id': 'TYPED',
+        })
+        self.assertEqual(vals['mpesa_request_id'], request.id)
+        self.assertEqual(vals['mpesa_transaction_id'], 'NLJ7RT61SV')
+        self.assertEqual(vals['mpesa_phone'], '254712345678')
+    
+    def test_callback_wrong_token_ignored(self):
+        """Test a callback with an unknown token does not change requests"""
+        get, post = self._mock_daraja()
+        with get, post:
+            status = self.env['pos.mpesa.request'].create_stk_push(
+                self.config.id, 150.0, '0712345678'
+            )
+        
+        processed = self.env['pos.mpesa.request']._process_callback('wrong', {
+            'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_TEST', 'ResultCode': 0}},
+        })
+        self.assertFalse(processed)
+        self.assertEqual(self.env['pos.mpesa.request'].browse(status['id']).state, 'pending')
+    
+    def test_status_limited_to_own_till(self):
+        """Test the status lookup only returns requests started from the till"""
+        get, post = self._mock_daraja()
+        with get, post:
+            status = self.env['pos.mpesa.request'].create_stk_push(
+                self.config.id, 150.0, '0712345678'
+            )
+        other_config = self.env['pos.config'].create({'name': 'Other Till'})
+        
+        Request = self.env['pos.mpesa.request']
+        self.assertEqual([s['id'] for s in Request.get_pos_status(self.config.id, [status['id']])], [status['id']])
+        self.assertFalse(Request.get_pos_status(other_config.id, [status['id']]))
+        
+        other_user = self.env['res.users'].create({
+            'name': 'Other Cashier',
+            'login': 'other_cashier',
+            'groups_id': [(6, 0, [self.env.ref('point_of_sale.group_pos_user').id])],
+        })
+        self.assertFalse(Request.with_user(other_user).get_pos_status(self.config.id, [status['id']]))
+    
+    def test_statement_nearest_payment(self):
+        """Test fuzzy matching picks the closest unused payment in the window"""
+        when = datetime(2024, 1, 15, 10, 0)
+        bucket = [
+            (when - timedelta(minutes=20), 1),
+            (when - timedelta(minutes=4), 2),
+            (when + timedelta(minutes=2), 3),
+        ]
+        window = timedelta(minutes=10)
+        nearest = MpesaStatementImport._nearest_unused
+        self.assertEqual(nearest(bucket, when, window, set()), 3)
+        self.assertEqual(nearest(bucket, when, window, {3}), 2)
+        self.assertFalse(nearest(bucket, when, window, {2, 3}))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+from datetime import date
+
+
+@tagged('post_install', '-at_install')
+class TestPosOrderArchive(TestPoSCommon):
+    
+    def setUp(self):
+        super().setUp()
+        self.config = self.basic_config
+        self.product = self.create_product('Test Morphine 10mg', self.categ_basic, 50.0)
+        self.patient = self.env['res.partner'].create({'name': 'Archived Patient', 'is_patient': True})
+        self.provider = self.env['insurance.provider'].create({
+            'name': 'Archive Test Insurance',
+            'code': 'ARCHTEST',
+            'provider_type': 'private',
+        })
+        
+        self.open_new_session()
+        order_data = self.create_ui_order_data([(self.product, 2)], customer=self.patient)
+        self.order = self.env['pos.order'].browse(
+            self.env['pos.order'].create_from_ui([order_data])[0]['id']
+        )
+        self.env['mail.message'].create({
+            'model': 'pos.order',
+            'res_id': self.order.id,
+            'message_type': 'comment',
+            'body': 'Checked by the pharmacist',
+        })
+        self.env['ir.attachment'].create({
+            'name': 'prescription.pdf',
+            'raw': b'%PDF-1.4',
+            'res_model': 'pos.order',
+            'res_id': self.order.id,
+        })
+    
+    def _register_entry(self, when):
+        return self.env['controlled.drugs.register'].create({
+            'date': when,
+            'product_id': self.product.id,
+            'transaction_type': 'dispensing',
+            'quantity_dispensed': 2,
+            'patient_name': self.patient.name,
+            'prescriber_name': 'Dr. Test Prescriber',
+            'pos_order_id': self.order.id,
+        })
+    
+    def test_archive_keeps_links(self):
+        """Test claims and register entries resolve the archived order"""
+        claim = self.env['insurance.claim'].create({
+            'patient_id': self.patient.id,
+            'insurance_provider_id': self.provider.id,
+            'member_number': 'MEM12345',
+            'pos_order_id': self.order.id,
+        })
+        live_entry = self._register_entry(self.order.date_order)
+        period = self.env['controlled.drugs.register.period'].create({
+            'name': 'Archive Test 2001',
+            'date_from': date(2001, 1, 1),
+            'date_to': date(2001, 12, 31),
+        })
+        archived_entry_id = self._register_entry('2001-05-01 10:00:00').id
+        period.action_freeze()
+        period.action_archive_entries()
+        
+        order_id = self.order.id
+        order_name = self.order.name
+        Archive = self.env['pos.order.archive']
+        archive = Archive._archive_orders([order_id])
+        
+        self.assertFalse(self.env['pos.order'].browse(order_id).exists())
+        self.assertEqual(archive.original_id, order_id)
+        self.assertEqual(archive.name, order_name)
+        self.assertEqual(claim.pos_order_archive_id, archive)
+        self.assertEqual(live_entry.pos_order_archive_id, archive)
+        archived_entry = self.env['controlled.drugs.register.history'].browse(archived_entry_id)
+        self.assertEqual(archived_entry.source, 'archive')
+        self.assertEqual(archived_entry.pos_order_archive_id, archive)
+        
+        # Chatter and attachments do not outlive the order
+        self.assertFalse(self.env['mail.message'].search_count([('model', '=', 'pos.order'), ('res_id', '=', order_id)]))
+        self.assertFalse(self.env['ir.attachment'].search_count([('res_model', '=', 'pos.order'), ('res_id', '=', order_id)]))
+    
+    def test_details_round_trip(self):
+        """Test get_details returns the lines and payments as archived"""
+        lines = self.order.lines
+        payments = self.order.payment_ids
+        archive = self.env['pos.order.archive']._archive_orders([self.order.id])
+        
+        details = archive.get_details()
+        self.assertEqual(archive.line_count, len(lines))
+        self.assertEqual(archive.payment_count, len(payments))
+        self.assertEqual([line['product_id'][0] for line in details['lines']], [self.product.id])
+        self.assertEqual(details['lines'][0]['qty'], 2)
+        self.assertAlmostEqual(sum(payment['amount'] for payment in details['payments']), archive.amount_paid)
+        self.assertIn('Test Morphine 10mg', archive.details_html)
@@ -102,3 +102,73 @@ class TestPrescription(TransactionCase):
         # Should not allow dispensing more than prescribed
         with self.assertRaises(ValidationError):
             line.quantity_dispensed = 25
+    
+    def test_patient_prescription_count(self):
+        """Test stored prescription count follows create and unlink"""
+        self.assertEqual(self.patient.prescription_count, 0)
+        
+        prescriptions = self.env['pharmacy.prescription']
+        for _i in range(3):
+            prescriptions |= self.env['pharmacy.prescription'].create({
+                'patient_id': self.patient.id,
+                'prescriber_id': self.prescriber.id,
+            })
+        self.assertEqual(self.patient.prescription_count, 3)
+        
+        prescriptions[0].unlink()
+        self.assertEqual(self.patient.prescription_count, 2)
+        
+        # Stored field is searchable without loading prescriptions
+        patients = self.env['res.partner'].search([('prescription_count', '>=', 2)])
+        self.assertIn(self.patient, patients)
+    
+    def test_report_chunk_key_follows_lines(self):
+        """Test adding a line changes the key of the cached printout"""
+        prescription = self.env['pharmacy.prescription'].create({
+            'patient_id': self.patient.id,
+            'prescriber_id': self.prescriber.id,
+            'line_ids': [(0, 0, {
+                'product_id': self.product.id,
+                'quantity': 20,
+            })],
+        })
+        self.env['pharmacy.report.job'].enqueue('pos_demo.report_prescription', prescription.ids)
+        job = self.env['pharmacy.report.job'].search([], limit=1)
+        key = job._get_chunk_key(prescription.ids)
+        self.assertEqual(job._get_chunk_key(prescription.ids), key)
+        
+        prescription.write({'line_ids': [(0, 0, {
+            'product_id': self.product.id,
+            'quantity': 10,
+        })]})
+        self.assertNotEqual(job._get_chunk_key(prescription.ids), key)
+    
+    def test_counter_search(self):
+        """Test the counter search finds prescriptions of every matching patient"""
+        Prescription = self.env['pharmacy.prescription']
+        patients = self.env['res.partner'].create([{
+            'name': 'Wanjiru Zz %02d' % index,
+            'is_patient': True,
+        } for index in range(5)])
+        last = Prescription.create({'patient_id': patients[-1].id, 'prescriber_id': self.prescriber.id})
+        other_company = self.env['res.company'].create({'name': 'Other Pharmacy'})
+        hidden = self.env['res.partner'].create({
+            'name': 'Wanjiru Zz Hidden',
+            'is_patient': True,
+            'company_id': other_company.id,
+        })
+        
+        self.assertEqual(Prescription.counter_search('Wa'), {'prescriptions': [], 'patients': []})
+        
+        # The prescription of the last patient is found beyond the patient page
+        result = Prescription.with_context(allowed_company_ids=[self.env.company.id]).counter_search(
+            'wanjiru zz', limit=2
+        )
+        self.assertEqual(len(result['patients']), 2)
+        self.assertEqual([rx['id'] for rx in result['prescriptions']], [last.id])
+        
+        result = Prescription.with_context(allowed_company_ids=[self.env.company.id]).counter_search(
+            'wanjiru zz', limit=1000
+        )
+        self.assertEqual({p['id'] for p in result['patients']}, set(patients.ids))
+        self.assertNotIn(hidden.id, [p['id'] for p in result['patients']])
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+from odoo.tools import date_utils
+from odoo import fields
+
+from odoo.addons.pos_demo.wizard.reorder_planner import PharmacyReorderPlanner, np
+
+
+class TestReorderPlanner(TransactionCase):
+    
+    def test_fefo_usable(self):
+        """Test lots only count for what sells before they expire, first to expire first"""
+        product_ids = np.array([1, 2, 3], dtype=np.int64)
+        velocity = np.array([10.0, 10.0, 0.0])
+        usable = PharmacyReorderPlanner._fefo_usable(product_ids, velocity, [
+            # 50 of the first lot sell before it expires, the second lot fits its window
+            (1, 100.0, 5), (1, 100.0, 100),
+            # The earlier lot uses up the later lot's window; no expiry is never capped
+            (2, 100.0, 10), (2, 100.0, 12), (2, 30.0, None),
+            # Nothing sells, so expiring stock is worthless
+            (3, 40.0, 30),
+            # Unknown products are ignored
+            (9, 500.0, None),
+        ])
+        self.assertEqual(usable.tolist(), [150.0, 150.0, 0.0])
+    
+    def test_purchase_quantities(self):
+        """Test the planner orders whole purchase units net of usable and incoming stock"""
+        warehouse = self.env['stock.warehouse'].search([('company_id', '=', self.env.company.id)], limit=1)
+        unit = self.env.ref('uom.product_uom_unit')
+        box = self.env['uom.uom'].create({
+            'name': 'Box of 100',
+            'category_id': unit.category_id.id,
+            'uom_type': 'bigger',
+            'factor_inv': 100,
+        })
+        vendor = self.env['res.partner'].create({'name': 'Test Pharma Distributor'})
+        product = self.env['product.product'].create({
+            'name': 'Test Amlodipine 5mg',
+            'type': 'consu',
+            'is_storable': True,
+            'tracking': 'lot',
+            'purchase_ok': True,
+            'uom_id': unit.id,
+            'uom_po_id': box.id,
+            'seller_ids': [(0, 0, {'partner_id': vendor.id, 'min_qty': 0})],
+        })
+        today = fields.Date.context_today(product)
+        for name, days in (('AML-001', 5), ('AML-002', 100)):
+            lot = self.env['stock.lot'].create({
+                'name': name,
+                'product_id': product.id,
+                'expiry_date': date_utils.add(today, days=days),
+            })
+            self.env['stock.quant']._update_available_quantity(product, warehouse.lot_stock_id, 100, lot_id=lot)
+        
+        planner = self.env['pharmacy.reorder.planner'].create({
+            'warehouse_id': warehouse.id,
+            'sales_days': 30,
+            'lead_days': 7,
+            'cover_days': 30,
+            'include_refills': False,
+        })
+        # 10 a day: 370 needed, 150 usable before expiry
+        with patch.object(PharmacyReorderPlanner, '_fetch_sales', return_value=[(product.id, 300)]):
+            planner.action_plan()
+            line = planner.purchase_ids.order_line.filtered(lambda l: l.product_id == product)
+            self.assertEqual(line.order_id.partner_id, vendor)
+            self.assertEqual(line.product_uom, box)
+            self.assertEqual(line.product_qty, 3)
+            self.assertEqual(line.product_uom_qty, 300)
+            
+            # The draft order now covers the need
+            second = planner.copy({'state': 'draft'})
+            second.action_plan()
+            self.assertFalse(second.purchase_ids.order_line.filtered(lambda l: l.product_id == product))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+
+
+@tagged('post_install', '-at_install')
+class TestSessionClose(TestPoSCommon):
+    
+    def setUp(self):
+        super().setUp()
+        self.config = self.basic_config
+        self.config.background_session_close = True
+        self.env.company.point_of_sale_update_stock_quantities = 'closing'
+        self.product = self.create_product('Test Amoxicillin 250mg', self.categ_basic, 40.0)
+    
+    def test_queued_close(self):
+        """Test a queued close ends closed with one picking for the session"""
+        session = self.open_new_session()
+        self.assertTrue(session.update_stock_at_closing)
+        self.env['pos.order'].create_from_ui([self.create_ui_order_data([(self.product, 2)])])
+        session.write({'closing_cash_counted': session.cash_register_balance_end})
+        
+        session.action_close_in_background()
+        self.assertEqual(session.state, 'closing_control')
+        self.assertEqual(session.close_state, 'queued')
+        
+        # The cron runs without committing under test
+        self.env['pos.session']._cron_close_sessions()
+        self.assertEqual(session.close_state, 'done')
+        self.assertEqual(session.state, 'closed')
+        self.assertEqual(len(session.picking_ids), 1)
+        moves = session.picking_ids.move_ids.filtered(lambda m: m.product_id == self.product)
+        self.assertEqual(sum(moves.mapped('product_uom_qty')), 2)
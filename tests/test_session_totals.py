@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import tagged
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+
+from odoo.addons.pos_demo.models.session_totals import TOTAL_FIELDS
+
+
+@tagged('post_install', '-at_install')
+class TestSessionTotals(TestPoSCommon):
+    
+    def setUp(self):
+        super().setUp()
+        self.config = self.basic_config
+        self.product = self.create_product('Test Paracetamol 500mg', self.categ_basic, 30.0)
+    
+    def test_incremental_matches_rebuild(self):
+        """Test totals added per paid order equal a rebuild from the orders"""
+        session = self.open_new_session()
+        Order = self.env['pos.order']
+        Order.create_from_ui([
+            self.create_ui_order_data([(self.product, 3)]),
+            self.create_ui_order_data([(self.product, -1)]),
+        ])
+        
+        Totals = self.env['pos.session.totals']
+        totals = Totals.search([('session_id', '=', session.id)])
+        incremental = totals.read(TOTAL_FIELDS)[0]
+        self.assertEqual(incremental['order_count'], 1)
+        self.assertEqual(incremental['refund_count'], 1)
+        self.assertAlmostEqual(incremental['total_sales'], 60.0)
+        self.assertAlmostEqual(incremental['refund_total'], 30.0)
+        
+        Totals._rebuild([session.id])
+        rebuilt = totals.read(TOTAL_FIELDS)[0]
+        for fname in TOTAL_FIELDS:
+            self.assertAlmostEqual(incremental[fname], rebuilt[fname], msg=fname)
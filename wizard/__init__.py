@@ -1,3 +1,10 @@
 # -*- coding: utf-8 -*-
 from . import prescription_wizard
 from . import insurance_claim_wizard
+from . import csv_import_mixin
+from . import mpesa_statement_import
+from . import insurance_invoice_batch
+from . import insurance_remittance_import
+from . import reorder_planner
+from . import expiry_writeoff
+from . import index_advisor
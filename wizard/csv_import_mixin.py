@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from odoo import models, _
+from odoo.exceptions import UserError
+import base64
+import csv
+import io
+import itertools
+
+
+class PharmacyCsvImportMixin(models.AbstractModel):
+    """Stream large CSV uploads in chunks without decoding them in memory"""
+    _name = 'pharmacy.csv.import.mixin'
+    _description = 'Pharmacy CSV Import Helper'
+
+    _csv_chunk_size = 5000
+
+    def _open_binary_stream(self, field_name):
+        """Binary file object for an attachment-backed Binary field"""
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', field_name),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if not attachment:
+            raise UserError(_('Please upload a file first.'))
+        if attachment.store_fname:
+            # Read straight from the filestore, never the whole file at once
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        return io.BytesIO(base64.b64decode(attachment.datas or b''))
+
+    def _iter_csv_chunks(self, field_name, header_marker, chunk_size=None):
+        """Yield lists of row dicts from an uploaded CSV file
+
+        Lines before the first line containing header_marker are skipped,
+        which drops the account summary printed above statement tables.
+        """
+        chunk_size = chunk_size or self._csv_chunk_size
+        with self._open_binary_stream(field_name) as binary:
+            text = io.TextIOWrapper(binary, encoding='utf-8-sig', errors='replace', newline='')
+            reader = csv.reader(text)
+            for header in reader:
+                if any(header_marker.lower() in (cell or '').lower() for cell in header):
+                    break
+            else:
+                raise UserError(_('Column "%s" not found in the file.') % header_marker)
+            header = [(cell or '').strip() for cell in header]
+            rows = (dict(zip(header, row)) for row in reader if any(row))
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+
+    @staticmethod
+    def _parse_amount(value):
+        """Parse amounts such as '1,250.00'; None when blank or not a number"""
+        value = (value or '').replace(',', '').strip()
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
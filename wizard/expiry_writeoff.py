@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, Command, _
+from odoo.exceptions import UserError
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class PharmacyExpiryWriteoff(models.TransientModel):
+    """Quarantine every expired lot of a location in one transfer"""
+    _name = 'pharmacy.expiry.writeoff'
+    _description = 'Expired Stock Write-off'
+
+    location_id = fields.Many2one(
+        'stock.location',
+        string='Location',
+        required=True,
+        domain=[('usage', '=', 'internal')],
+        help='Expired lots in this location and its sub-locations are written off'
+    )
+    quarantine_location_id = fields.Many2one(
+        'stock.location',
+        string='Quarantine Location',
+        required=True,
+        default=lambda self: self.env.ref('pos_demo.stock_location_expired_quarantine', raise_if_not_found=False)
+    )
+    witness_id = fields.Many2one(
+        'res.users',
+        string='Witnessed By',
+        help='Second person witnessing the destruction of controlled drugs'
+    )
+    remarks = fields.Text(
+        string='Remarks',
+        default='Expired stock - quarantined for destruction'
+    )
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+    ], default='draft')
+
+    # Results
+    lot_count = fields.Integer(string='Lots Written Off', readonly=True)
+    register_count = fields.Integer(string='Register Entries', readonly=True)
+    picking_id = fields.Many2one('stock.picking', string='Transfer', readonly=True)
+
+    def _get_expired_stock(self):
+        """(product, lot, location, quantity) of expired lots, one query"""
+        groups = self.env['stock.quant']._read_group(
+            [
+                ('location_id', 'child_of', self.location_id.id),
+                ('lot_id.expiry_date', '<', fields.Date.context_today(self)),
+                ('quantity', '>', 0),
+            ],
+            groupby=['product_id', 'lot_id', 'location_id'],
+            aggregates=['quantity:sum'],
+        )
+        return [group for group in groups if group[3] > 0]
+
+    def action_write_off(self):
+        """Move expired lots to quarantine and record controlled drug destruction"""
+        self.ensure_one()
+        expired = self._get_expired_stock()
+        if not expired:
+            raise UserError(_('No expired stock found in %s.') % self.location_id.display_name)
+
+        controlled = [line for line in expired if line[0].is_controlled_substance]
+        if controlled and not self.witness_id:
+            raise UserError(_('Expired controlled drugs are included: a witness is required.'))
+
+        warehouse = self.location_id.warehouse_id
+        picking_type = warehouse.int_type_id if warehouse else self.env['stock.picking.type'].search([
+            ('code', '=', 'internal'),
+            ('company_id', '=', self.env.company.id),
+        ], limit=1)
+        if not picking_type:
+            raise UserError(_('No internal transfer operation type found for %s.') % self.location_id.display_name)
+
+        quantity_by_product = {}
+        for product, lot, location, quantity in expired:
+            quantity_by_product[product] = quantity_by_product.get(product, 0.0) + quantity
+
+        picking = self.env['stock.picking'].create({
+            'picking_type_id': picking_type.id,
+            'location_id': self.location_id.id,
+            'location_dest_id': self.quarantine_location_id.id,
+            'origin': _('Expired stock write-off'),
+            'move_ids': [Command.create({
+                'name': product.display_name,
+                'product_id': product.id,
+                'product_uom': product.uom_id.id,
+                'product_uom_qty': quantity,
+                'location_id': self.location_id.id,
+                'location_dest_id': self.quarantine_location_id.id,
+            }) for product, quantity in quantity_by_product.items()],
+        })
+        picking.action_confirm()
+        # Take exactly the expired lots rather than what reservation picks
+        picking.do_unreserve()
+        move_by_product = {move.product_id: move for move in picking.move_ids}
+        self.env['stock.move.line'].create([{
+            'move_id': move_by_product[product].id,
+            'picking_id': picking.id,
+            'product_id': product.id,
+            'product_uom_id': product.uom_id.id,
+            'lot_id': lot.id,
+            'location_id': location.id,
+            'location_dest_id': self.quarantine_location_id.id,
+            'quantity': quantity,
+        } for product, lot, location, quantity in expired])
+        picking.move_ids.picked = True
+        picking._action_done()
+
+        registers = self.env['controlled.drugs.register'].create([{
+            'product_id': product.id,
+            'lot_id': lot.id,
+            'transaction_type': 'destruction',
+            'quantity_dispensed': quantity,
+            'witnessed_by': self.witness_id.id,
+            'stock_picking_id': picking.id,
+            'remarks': self.remarks,
+        } for product, lot, location, quantity in controlled])
+
+        _logger.info(
+            "Expired stock write-off %s: %s lots, %s register entries",
+            picking.name, len(expired), len(registers),
+        )
+        self.write({
+            'state': 'done',
+            'lot_count': len(expired),
+            'register_count': len(registers),
+            'picking_id': picking.id,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_view_picking(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'stock.picking',
+            'res_id': self.picking_id.id,
+            'view_mode': 'form',
+        }
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.addons.pos_demo.models.index_pack import PHARMACY_TABLES
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class PharmacyIndexAdvisor(models.TransientModel):
+    """Report missing and unused indexes on the pharmacy tables
+
+    Reads the statistics views of the local database: pg_stat_user_indexes
+    and pg_stat_user_tables always, pg_stat_statements when the extension
+    is installed.
+    """
+    _name = 'pharmacy.index.advisor'
+    _description = 'Pharmacy Index Advisor'
+
+    min_seq_scans = fields.Integer(
+        string='Minimum Sequential Scans',
+        default=1000,
+        help='Tables scanned sequentially more often than this are reported'
+    )
+    statement_limit = fields.Integer(string='Slowest Statements', default=15)
+    report = fields.Text(string='Report', readonly=True)
+
+    @api.model
+    def _check_missing_pack(self):
+        return [
+            _('MISSING  %s ON %s (%s)%s') % (
+                name, table, ', '.join(expressions), where and ' WHERE %s' % where or '',
+            )
+            for name, table, expressions, where in self.env['pharmacy.index.pack']._get_missing_indexes()
+        ]
+
+    @api.model
+    def _check_unused_indexes(self):
+        """Non-unique indexes never used since the statistics were reset"""
+        self.env.cr.execute("""
+            SELECT s.relname, s.indexrelname, pg_size_pretty(pg_relation_size(s.indexrelid))
+              FROM pg_stat_user_indexes s
+              JOIN pg_index i ON i.indexrelid = s.indexrelid
+             WHERE s.relname = ANY(%s)
+               AND s.idx_scan = 0
+               AND NOT i.indisunique
+               AND NOT i.indisprimary
+          ORDER BY pg_relation_size(s.indexrelid) DESC
+        """, [PHARMACY_TABLES])
+        return [
+            _('UNUSED   %s ON %s (%s)') % (index, table, size)
+            for table, index, size in self.env.cr.fetchall()
+        ]
+
+    @api.model
+    def _check_seq_scans(self, min_seq_scans):
+        """Tables mostly read by sequential scans: a filter lacks an index"""
+        self.env.cr.execute("""
+            SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), n_live_tup
+              FROM pg_stat_user_tables
+             WHERE relname = ANY(%s)
+               AND seq_scan > %s
+               AND seq_scan > COALESCE(idx_scan, 0)
+          ORDER BY seq_tup_read DESC
+        """, [PHARMACY_TABLES, min_seq_scans])
+        return [
+            _('SEQSCAN  %s: %s sequential scans (%s rows read) vs %s index scans, %s rows') % row
+            for row in self.env.cr.fetchall()
+        ]
+
+    @api.model
+    def _check_statements(self, limit):
+        """Slowest statements touching pharmacy tables"""
+        self.env.cr.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+        if not self.env.cr.fetchone():
+            return [_('pg_stat_statements is not installed: statement analysis skipped')]
+        self.env.cr.execute("""
+            SELECT calls, round(mean_exec_time::numeric, 2), round(total_exec_time::numeric),
+                   left(regexp_replace(query, '\\s+', ' ', 'g'), 160)
+              FROM pg_stat_statements
+             WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+               AND query ~ %s
+          ORDER BY total_exec_time DESC
+             LIMIT %s
+        """, ['\\m(%s)\\M' % '|'.join(PHARMACY_TABLES), limit])
+        return [
+            _('SLOW     %s calls, %s ms avg, %s ms total: %s') % row
+            for row in self.env.cr.fetchall()
+        ]
+
+    @api.model
+    def get_report(self, min_seq_scans=1000, statement_limit=15):
+        """Plain text report, also used by the index_advisor.py script"""
+        sections = [
+            (_('Index pack'), self._check_missing_pack() or [_('All pack indexes present')]),
+            (_('Unused indexes'), self._check_unused_indexes()),
+            (_('Sequential scans'), self._check_seq_scans(min_seq_scans)),
+            (_('Statements'), self._check_statements(statement_limit)),
+        ]
+        lines = []
+        for title, entries in sections:
+            lines.append('== %s ==' % title)
+            lines.extend(entries or [_('Nothing to report')])
+            lines.append('')
+        return '\n'.join(lines)
+
+    def action_analyze(self):
+        self.ensure_one()
+        self.report = self.get_report(self.min_seq_scans, self.statement_limit)
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_create_missing(self):
+        """Create the missing pack indexes, then refresh the report"""
+        self.env['pharmacy.index.pack']._create_indexes()
+        return self.action_analyze()
@@ -31,8 +31,7 @@ class InsuranceClaimWizard(models.TransientModel):
     
     copay_percentage = fields.Float(
         string='Co-payment %',
-        related='insurance_provider_id.copay_percentage',
-        readonly=True
+        compute='_compute_copay_percentage'
     )
     
     total_amount = fields.Float(
@@ -48,6 +47,14 @@ class InsuranceClaimWizard(models.TransientModel):
         compute='_compute_amounts'
     )
     
+    @api.depends('insurance_provider_id')
+    def _compute_copay_percentage(self):
+        """Co-payment from the cached provider terms"""
+        Provider = self.env['insurance.provider']
+        for wizard in self:
+            terms = Provider._resolve_provider(wizard.insurance_provider_id.id) if wizard.insurance_provider_id else None
+            wizard.copay_percentage = terms['copay_percentage'] if terms else 0.0
+    
     @api.depends('pos_order_id', 'copay_percentage')
     def _compute_amounts(self):
         """Calculate claim amounts"""
@@ -64,11 +71,12 @@ class InsuranceClaimWizard(models.TransientModel):
     def action_create_claim(self):
         """Create insurance claim from wizard"""
         self.ensure_one()
+        terms = self.env['insurance.claim']._get_claim_provider_terms(self.insurance_provider_id.id)
         
         # Create claim
         claim = self.env['insurance.claim'].create({
             'patient_id': self.patient_id.id,
-            'insurance_provider_id': self.insurance_provider_id.id,
+            'insurance_provider_id': terms['id'],
             'member_number': self.member_number,
             'preauth_number': self.preauth_number,
             'preauth_amount': self.preauth_amount,
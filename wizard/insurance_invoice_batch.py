@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from datetime import timedelta
+
+
+class InsuranceInvoiceBatch(models.TransientModel):
+    _name = 'insurance.invoice.batch'
+    _description = 'Consolidated Insurer Invoicing'
+    
+    def _default_last_month_end(self):
+        return fields.Date.context_today(self).replace(day=1) - timedelta(days=1)
+    
+    provider_ids = fields.Many2many(
+        'insurance.provider',
+        string='Insurance Providers',
+        help='Leave empty to invoice every provider'
+    )
+    date_from = fields.Date(
+        string='From',
+        required=True,
+        default=lambda self: self._default_last_month_end().replace(day=1)
+    )
+    date_to = fields.Date(
+        string='To',
+        required=True,
+        default=lambda self: self._default_last_month_end()
+    )
+    grouping = fields.Selection([
+        ('product', 'One line per product'),
+        ('claim', 'One line per claim'),
+    ], string='Invoice Lines', default='product', required=True)
+    
+    def action_create_invoices(self):
+        """Create one invoice per provider for approved claims in the period"""
+        self.ensure_one()
+        moves = self.env['insurance.claim']._invoice_claims_by_provider(
+            self.date_from,
+            self.date_to,
+            providers=self.provider_ids or None,
+            grouping=self.grouping,
+        )
+        if not moves:
+            raise UserError(_('No approved claims left to invoice in this period.'))
+        
+        return {
+            'name': _('Insurer Invoices'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'account.move',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', moves.ids)],
+        }
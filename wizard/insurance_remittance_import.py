@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, _
+from odoo.tools import float_compare
+from datetime import datetime
+from psycopg2.extras import execute_values
+import base64
+import csv
+import io
+import logging
+
+_logger = logging.getLogger(__name__)
+
+REMITTANCE_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y')
+
+# Claims an insurer can still respond to
+OPEN_CLAIM_STATES = ('submitted', 'approved', 'partial')
+
+# Claim columns set from the remittance, in the VALUES order below
+SETTLED_FIELDS = ['approved_amount', 'state', 'rejection_reason', 'payment_reference', 'payment_date', 'response_date']
+
+
+def _parse_remittance_date(value):
+    value = (value or '').strip()
+    for fmt in REMITTANCE_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class InsuranceRemittanceImport(models.TransientModel):
+    """Settle insurance claims in bulk from an insurer's remittance advice
+
+    Rows are matched to claims by claim number, or by member number and
+    claim date when the insurer does not quote our number, using one hash
+    lookup per chunk. The outcome is written back with one UPDATE per
+    chunk, so no tracking values or chatter messages are created.
+    """
+    _name = 'insurance.remittance.import'
+    _description = 'Insurance Remittance Import'
+    _inherit = ['pharmacy.csv.import.mixin']
+
+    remittance_file = fields.Binary(
+        string='Remittance Advice (CSV)',
+        required=True,
+        attachment=True
+    )
+    remittance_filename = fields.Char(string='Filename')
+    provider_id = fields.Many2one(
+        'insurance.provider',
+        string='Insurance Provider',
+        required=True
+    )
+    payment_date = fields.Date(
+        string='Payment Date',
+        default=fields.Date.context_today,
+        help='Used for paid rows without a payment date of their own'
+    )
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+    ], default='draft')
+
+    # Results
+    row_count = fields.Integer(string='Remittance Rows', readonly=True)
+    number_match_count = fields.Integer(string='Matched by Claim Number', readonly=True)
+    member_match_count = fields.Integer(string='Matched by Member and Date', readonly=True)
+    approved_count = fields.Integer(string='Approved', readonly=True)
+    partial_count = fields.Integer(string='Partially Approved', readonly=True)
+    rejected_count = fields.Integer(string='Rejected', readonly=True)
+    paid_count = fields.Integer(string='Paid', readonly=True)
+    exception_count = fields.Integer(string='Exceptions', readonly=True)
+    report_file = fields.Binary(string='Exceptions Report', readonly=True, attachment=False)
+    report_filename = fields.Char(string='Report Filename')
+
+    def action_import(self):
+        """Match the remittance in chunks and settle the claims in bulk"""
+        self.ensure_one()
+        Claim = self.env['insurance.claim']
+        Claim.flush_model()
+        counts = dict.fromkeys(['row', 'number', 'member', 'approved', 'partial', 'rejected', 'paid'], 0)
+        exceptions = []
+        seen = set()
+
+        for chunk in self._iter_csv_chunks('remittance_file', 'Approved'):
+            counts['row'] += len(chunk)
+            rows = [self._parse_row(row) for row in chunk]
+            claims_by_number, claims_by_member = self._lookup_claims(rows)
+            updates = []
+            for row in rows:
+                claim, how = None, None
+                if row['claim_number'] in claims_by_number:
+                    claim, how = claims_by_number[row['claim_number']], 'number'
+                else:
+                    candidates = claims_by_member.get((row['member_number'], row['claim_date']), [])
+                    if len(candidates) == 1:
+                        claim, how = candidates[0], 'member'
+                    elif candidates:
+                        exceptions.append((row, _('Several claims for this member and date')))
+                        continue
+                if claim is None:
+                    exceptions.append((row, _('No claim found')))
+                    continue
+                claim_id, state, total_amount = claim
+                if claim_id in seen:
+                    exceptions.append((row, _('Claim already settled by an earlier row')))
+                    continue
+                if state not in OPEN_CLAIM_STATES:
+                    exceptions.append((row, _('Claim is %s') % state))
+                    continue
+                if row['approved'] is None:
+                    # Only an explicit 0 rejects a claim
+                    exceptions.append((row, _('Approved amount missing or not a number')))
+                    continue
+                if float_compare(row['approved'], total_amount, precision_digits=2) > 0:
+                    exceptions.append((row, _('Approved %s exceeds claimed %s') % (row['approved'], total_amount)))
+                    continue
+                seen.add(claim_id)
+                counts[how] += 1
+                updates.append((claim_id,) + self._settle(row, total_amount, counts))
+            self._write_settlements(updates)
+
+        _logger.info(
+            "Remittance of %s: %s rows, %s by number, %s by member, %s exceptions",
+            self.provider_id.code, counts['row'], counts['number'], counts['member'], len(exceptions),
+        )
+        self.write({
+            'state': 'done',
+            'row_count': counts['row'],
+            'number_match_count': counts['number'],
+            'member_match_count': counts['member'],
+            'approved_count': counts['approved'],
+            'partial_count': counts['partial'],
+            'rejected_count': counts['rejected'],
+            'paid_count': counts['paid'],
+            'exception_count': len(exceptions),
+            'report_file': self._build_exceptions_report(exceptions) if exceptions else False,
+            'report_filename': 'remittance_exceptions_%s.csv' % self.provider_id.code,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _parse_row(self, row):
+        approved = row.get('Approved Amount') or row.get('Approved')
+        return {
+            'claim_number': (row.get('Claim Number') or '').strip(),
+            'member_number': (row.get('Member Number') or '').strip(),
+            'claim_date': _parse_remittance_date(row.get('Claim Date')),
+            'approved': self._parse_amount(approved),
+            'approved_text': (approved or '').strip(),
+            'rejection_reason': (row.get('Rejection Reason') or '').strip(),
+            'payment_reference': (row.get('Payment Reference') or '').strip(),
+            'payment_date': _parse_remittance_date(row.get('Payment Date')),
+        }
+
+    def _lookup_claims(self, rows):
+        """Hash indexes of the provider's claims quoted in a chunk
+
+        Returns:
+            tuple: ({claim number: claim}, {(member number, date): [claim]})
+                   where a claim is (id, state, total_amount)
+        """
+        cr = self.env.cr
+        numbers = list({row['claim_number'] for row in rows if row['claim_number']})
+        by_number = {}
+        if numbers:
+            cr.execute("""
+                SELECT name, id, state, total_amount
+                  FROM insurance_claim
+                 WHERE insurance_provider_id = %s
+                   AND name = ANY(%s)
+            """, [self.provider_id.id, numbers])
+            by_number = {name: (claim_id, state, total or 0.0) for name, claim_id, state, total in cr.fetchall()}
+
+        keys = list({
+            (row['member_number'], row['claim_date']) for row in rows
+            if row['claim_number'] not in by_number and row['member_number'] and row['claim_date']
+        })
+        by_member = {}
+        if keys:
+            cr.execute("""
+                SELECT c.member_number, c.date, c.id, c.state, c.total_amount
+                  FROM insurance_claim c
+                  JOIN unnest(%s::varchar[], %s::date[]) AS k(member_number, date)
+                    ON k.member_number = c.member_number AND k.date = c.date
+                 WHERE c.insurance_provider_id = %s
+              ORDER BY c.id
+            """, [[key[0] for key in keys], [key[1] for key in keys], self.provider_id.id])
+            for member_number, date, claim_id, state, total in cr.fetchall():
+                by_member.setdefault((member_number, date), []).append((claim_id, state, total or 0.0))
+        return by_number, by_member
+
+    def _settle(self, row, total_amount, counts):
+        """Claim values for a matched row, in SETTLED_FIELDS order"""
+        approved = row['approved']
+        if float_compare(approved, 0.0, precision_digits=2) <= 0:
+            counts['rejected'] += 1
+            return (0.0, 'rejected', row['rejection_reason'] or _('Rejected on remittance'), None, None,
+                    fields.Date.context_today(self))
+        if row['payment_reference'] or row['payment_date']:
+            counts['paid'] += 1
+            state = 'paid'
+        elif float_compare(approved, total_amount, precision_digits=2) == 0:
+            counts['approved'] += 1
+            state = 'approved'
+        else:
+            counts['partial'] += 1
+            state = 'partial'
+        return (
+            approved,
+            state,
+            row['rejection_reason'] or None,
+            row['payment_reference'] or None,
+            (row['payment_date'] or self.payment_date) if state == 'paid' else None,
+            fields.Date.context_today(self),
+        )
+
+    def _write_settlements(self, updates):
+        """Apply a chunk of settlements with one UPDATE and recompute amounts"""
+        if not updates:
+            return
+        Claim = self.env['insurance.claim']
+        execute_values(self.env.cr._obj, """
+            UPDATE insurance_claim c
+               SET approved_amount = v.approved_amount,
+                   state = v.state,
+                   rejection_reason = COALESCE(v.rejection_reason, c.rejection_reason),
+                   payment_reference = COALESCE(v.payment_reference, c.payment_reference),
+                   payment_date = COALESCE(v.payment_date, c.payment_date),
+                   response_date = v.response_date,
+                   write_uid = {uid},
+                   write_date = NOW() AT TIME ZONE 'UTC'
+              FROM (VALUES %s) AS v(id, {columns})
+             WHERE c.id = v.id
+        """.format(uid=int(self.env.uid), columns=', '.join(SETTLED_FIELDS)),
+            updates,
+            template='(%s, %s, %s, %s::text, %s::varchar, %s::date, %s::date)',
+            page_size=5000)
+        claims = Claim.browse([update[0] for update in updates])
+        Claim.invalidate_model(SETTLED_FIELDS + ['write_uid', 'write_date'])
+        # Stored amounts depending on approved_amount
+        for fname in ('rejected_amount', 'insurance_payment'):
+            self.env.add_to_compute(Claim._fields[fname], claims)
+        Claim.flush_model(['rejected_amount', 'insurance_payment'])
+        Claim.invalidate_model()
+
+    def _build_exceptions_report(self, exceptions):
+        """CSV of the remittance rows that were not applied"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Claim Number', 'Member Number', 'Claim Date', 'Approved Amount', 'Payment Reference', 'Issue'])
+        for row, issue in exceptions:
+            writer.writerow([
+                row['claim_number'], row['member_number'], row['claim_date'] or '',
+                row['approved_text'], row['payment_reference'], issue,
+            ])
+        return base64.b64encode(output.getvalue().encode())
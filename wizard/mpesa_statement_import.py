@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+from odoo.addons.pos_demo.models.mpesa_request import MPESA_UTC_OFFSET
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from psycopg2.extras import execute_values
+import base64
+import csv
+import io
+import logging
+import re
+
+_logger = logging.getLogger(__name__)
+
+STATEMENT_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M')
+
+
+def _phone_tail(value):
+    """Last three digits of a (possibly masked) phone number"""
+    digits = re.sub(r'\D', '', (value or '').split('-')[0])
+    return digits[-3:] if len(digits) >= 3 else ''
+
+
+def _parse_statement_time(value):
+    """Statement time (East Africa Time) as naive UTC datetime"""
+    value = (value or '').strip()
+    for fmt in STATEMENT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt) - MPESA_UTC_OFFSET
+        except ValueError:
+            continue
+    return None
+
+
+class MpesaStatementImport(models.TransientModel):
+    """Reconcile an M-PESA paybill statement against POS payments"""
+    _name = 'mpesa.statement.import'
+    _description = 'M-PESA Statement Reconciliation'
+    _inherit = ['pharmacy.csv.import.mixin']
+
+    def _default_last_month_end(self):
+        return fields.Date.context_today(self).replace(day=1) - timedelta(days=1)
+
+    statement_file = fields.Binary(
+        string='Statement (CSV)',
+        required=True,
+        attachment=True
+    )
+    statement_filename = fields.Char(string='Filename')
+    date_from = fields.Date(
+        string='From',
+        required=True,
+        default=lambda self: self._default_last_month_end().replace(day=1)
+    )
+    date_to = fields.Date(
+        string='To',
+        required=True,
+        default=lambda self: self._default_last_month_end()
+    )
+    time_window = fields.Integer(
+        string='Match Window (minutes)',
+        default=10,
+        help='Maximum time difference for amount and phone matching'
+    )
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+    ], default='draft')
+
+    # Results
+    statement_count = fields.Integer(string='Statement Receipts', readonly=True)
+    exact_count = fields.Integer(string='Matched by Code', readonly=True)
+    fuzzy_count = fields.Integer(string='Matched by Amount/Phone/Time', readonly=True)
+    amount_mismatch_count = fields.Integer(string='Code Matches with Amount Difference', readonly=True)
+    unmatched_statement_count = fields.Integer(string='Unmatched Statement Receipts', readonly=True)
+    unmatched_pos_count = fields.Integer(string='Unmatched POS Payments', readonly=True)
+    report_file = fields.Binary(string='Exceptions Report', readonly=True, attachment=False)
+    report_filename = fields.Char(string='Report Filename')
+
+    def action_reconcile(self):
+        """Match the statement in bulk and report exceptions on both sides"""
+        self.ensure_one()
+        Payment = self.env['pos.payment']
+        Payment.flush_model(['mpesa_transaction_id', 'mpesa_reconciled', 'payment_date', 'amount'])
+        cr = self.env.cr
+
+        statement_count = 0
+        exact_ids = []
+        mismatches = []
+        leftovers = []
+
+        # Pass 1: stream the statement and match confirmation codes chunk by chunk
+        for chunk in self._iter_csv_chunks('statement_file', 'Receipt No'):
+            index = {}
+            for row in chunk:
+                receipt = (row.get('Receipt No.') or row.get('Receipt No') or '').strip()
+                paid_in = self._parse_amount(row.get('Paid In'))
+                status = (row.get('Transaction Status') or 'Completed').strip().lower()
+                if not receipt or paid_in is None or paid_in <= 0 or status != 'completed':
+                    continue
+                index[receipt] = (
+                    _parse_statement_time(row.get('Completion Time')),
+                    round(paid_in * 100),
+                    _phone_tail(row.get('Other Party Info')),
+                )
+            statement_count += len(index)
+            if not index:
+                continue
+
+            cr.execute("""
+                SELECT id, mpesa_transaction_id, amount
+                  FROM pos_payment
+                 WHERE mpesa_transaction_id = ANY(%s)
+            """, [list(index)])
+            for payment_id, receipt, amount in cr.fetchall():
+                entry = index.pop(receipt, None)
+                if entry is None:
+                    continue
+                exact_ids.append(payment_id)
+                if round(amount * 100) != entry[1]:
+                    mismatches.append((receipt, payment_id, amount, entry[1] / 100))
+            leftovers.extend((receipt,) + entry for receipt, entry in index.items())
+
+        # Pass 2: fuzzy match leftovers on amount + phone within the time window.
+        # Payments that already carry a confirmation code are never given
+        # another one; if their code is not on the statement they are reported.
+        window = timedelta(minutes=self.time_window or 0)
+        start = datetime.combine(self.date_from, time.min) - window
+        stop = datetime.combine(self.date_to, time.max) + window
+        cr.execute("""
+            SELECT id, payment_date, amount, mpesa_phone, mpesa_transaction_id
+              FROM pos_payment
+             WHERE payment_category = 'mpesa'
+               AND payment_date BETWEEN %s AND %s
+               AND mpesa_reconciled IS NOT TRUE
+               AND NOT (id = ANY(%s))
+          ORDER BY payment_date
+        """, [start, stop, exact_ids])
+        by_amount_phone = defaultdict(list)
+        by_amount = defaultdict(list)
+        candidates = {}
+        for payment_id, payment_date, amount, phone, receipt in cr.fetchall():
+            candidates[payment_id] = (payment_date, amount, phone)
+            if receipt:
+                continue
+            cents = round(amount * 100)
+            by_amount_phone[cents, _phone_tail(phone)].append((payment_date, payment_id))
+            by_amount[cents].append((payment_date, payment_id))
+
+        used = set()
+        fuzzy = []
+        unmatched_statement = []
+        for receipt, when, cents, tail in leftovers:
+            match = False
+            if when:
+                if tail:
+                    # Manual M-PESA entries have no phone: try those next
+                    for bucket in (by_amount_phone.get((cents, tail)), by_amount_phone.get((cents, ''))):
+                        match = bucket and self._nearest_unused(bucket, when, window, used)
+                        if match:
+                            break
+                else:
+                    bucket = by_amount.get(cents)
+                    match = bucket and self._nearest_unused(bucket, when, window, used)
+            if match:
+                used.add(match)
+                fuzzy.append((match, receipt))
+            else:
+                unmatched_statement.append((receipt, when, cents / 100))
+        unmatched_pos = [
+            (payment_id,) + values for payment_id, values in candidates.items() if payment_id not in used
+        ]
+
+        # Write back in two statements
+        if exact_ids:
+            cr.execute("UPDATE pos_payment SET mpesa_reconciled = TRUE WHERE id = ANY(%s)", [exact_ids])
+        if fuzzy:
+            execute_values(cr._obj, """
+                UPDATE pos_payment p
+                   SET mpesa_transaction_id = v.receipt, mpesa_reconciled = TRUE
+                  FROM (VALUES %s) AS v(id, receipt)
+                 WHERE p.id = v.id
+                   AND p.mpesa_transaction_id IS NULL
+            """, fuzzy, page_size=5000)
+        Payment.invalidate_model(['mpesa_transaction_id', 'mpesa_reconciled'])
+
+        _logger.info(
+            "M-PESA statement: %s receipts, %s exact, %s fuzzy, %s unmatched",
+            statement_count, len(exact_ids), len(fuzzy), len(unmatched_statement),
+        )
+        self.write({
+            'state': 'done',
+            'statement_count': statement_count,
+            'exact_count': len(exact_ids),
+            'fuzzy_count': len(fuzzy),
+            'amount_mismatch_count': len(mismatches),
+            'unmatched_statement_count': len(unmatched_statement),
+            'unmatched_pos_count': len(unmatched_pos),
+            'report_file': self._build_exceptions_report(unmatched_statement, unmatched_pos, mismatches),
+            'report_filename': 'mpesa_reconciliation_%s_%s.csv' % (self.date_from, self.date_to),
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    @staticmethod
+    def _nearest_unused(bucket, when, window, used):
+        """Closest unused payment within the window in a date-sorted bucket"""
+        position = bisect_left(bucket, (when,))
+        best = None
+        for indices in (range(position, len(bucket)), range(position - 1, -1, -1)):
+            for i in indices:
+                payment_date, payment_id = bucket[i]
+                delta = abs(payment_date - when)
+                if delta > window:
+                    break
+                if payment_id not in used:
+                    # First unused payment is the nearest in this direction
+                    if best is None or delta < best[0]:
+                        best = (delta, payment_id)
+                    break
+        return best and best[1]
+
+    def _build_exceptions_report(self, unmatched_statement, unmatched_pos, mismatches):
+        """CSV listing everything that needs a human look"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Side', 'Reference', 'Date (UTC)', 'Amount', 'Statement Amount', 'Phone'])
+        for receipt, when, amount in unmatched_statement:
+            writer.writerow(['Statement only', receipt, when or '', '', amount, ''])
+        for payment_id, payment_date, amount, phone in unmatched_pos:
+            writer.writerow(['POS only', 'pos.payment,%s' % payment_id, payment_date, amount, '', phone or ''])
+        for receipt, payment_id, amount, statement_amount in mismatches:
+            writer.writerow(['Amount differs', receipt, '', amount, statement_amount, ''])
+        return base64.b64encode(output.getvalue().encode())
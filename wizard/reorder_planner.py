@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, Command, _
+from odoo.exceptions import UserError
+from collections import defaultdict
+from datetime import timedelta
+import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_logger = logging.getLogger(__name__)
+
+
+class PharmacyReorderPlanner(models.TransientModel):
+    """Propose purchase orders from sales velocity, usable stock and refills
+
+    Every signal is read with one aggregated query and the quantities are
+    computed for the whole catalogue at once with NumPy arrays indexed by
+    product position.
+    """
+    _name = 'pharmacy.reorder.planner'
+    _description = 'Pharmacy Reorder Planner'
+
+    warehouse_id = fields.Many2one(
+        'stock.warehouse',
+        string='Warehouse',
+        required=True,
+        default=lambda self: self.env['stock.warehouse'].search(
+            [('company_id', '=', self.env.company.id)], limit=1
+        )
+    )
+    sales_days = fields.Integer(
+        string='Sales History (days)',
+        default=30,
+        required=True,
+        help='POS sales over this period give the daily velocity'
+    )
+    lead_days = fields.Integer(
+        string='Vendor Lead Time (days)',
+        default=7,
+        required=True
+    )
+    cover_days = fields.Integer(
+        string='Days of Cover',
+        default=30,
+        required=True,
+        help='Stock to hold after the order is received'
+    )
+    include_refills = fields.Boolean(
+        string='Include Open Prescriptions',
+        default=True,
+        help='Add quantities still to dispense on validated prescriptions'
+    )
+    state = fields.Selection([
+        ('draft', 'Draft'),
+        ('done', 'Done'),
+    ], default='draft')
+
+    # Results
+    product_count = fields.Integer(string='Products Analysed', readonly=True)
+    line_count = fields.Integer(string='Products to Order', readonly=True)
+    no_vendor_count = fields.Integer(string='Skipped (no vendor)', readonly=True)
+    purchase_ids = fields.Many2many('purchase.order', string='Draft Purchase Orders', readonly=True)
+
+    # ------------------------------------------------------------------
+    # Signals
+    # ------------------------------------------------------------------
+
+    def _fetch_products(self):
+        """Ids of purchasable, storable products, sorted"""
+        self.env.cr.execute("""
+            SELECT pp.id
+              FROM product_product pp
+              JOIN product_template pt ON pt.id = pp.product_tmpl_id
+             WHERE pp.active
+               AND pt.active
+               AND pt.purchase_ok
+               AND pt.is_storable
+          ORDER BY pp.id
+        """)
+        return np.array([row[0] for row in self.env.cr.fetchall()], dtype=np.int64)
+
+    def _fetch_sales(self, date_from):
+        self.env.cr.execute("""
+            SELECT l.product_id, SUM(l.qty)
+              FROM pos_order_line l
+              JOIN pos_order o ON o.id = l.order_id
+             WHERE o.state IN ('paid', 'done', 'invoiced')
+               AND o.date_order >= %s
+          GROUP BY l.product_id
+        """, [date_from])
+        return self.env.cr.fetchall()
+
+    def _fetch_lot_stock(self, today):
+        """(product, quantity, days to expiry or NULL) per lot in the warehouse,
+        first to expire first within each product"""
+        self.env.cr.execute("""
+            SELECT q.product_id, SUM(q.quantity), lot.expiry_date - %s
+              FROM stock_quant q
+              JOIN stock_location sl ON sl.id = q.location_id
+         LEFT JOIN stock_lot lot ON lot.id = q.lot_id
+             WHERE sl.usage = 'internal'
+               AND sl.parent_path LIKE %s
+               AND q.quantity > 0
+          GROUP BY q.product_id, q.lot_id, lot.expiry_date
+          ORDER BY q.product_id, lot.expiry_date NULLS LAST
+        """, [today, self.warehouse_id.view_location_id.parent_path + '%'])
+        return self.env.cr.fetchall()
+
+    def _fetch_refills(self):
+        self.env.cr.execute("""
+            SELECT l.product_id, SUM(l.quantity_remaining)
+              FROM pharmacy_prescription_line l
+              JOIN pharmacy_prescription p ON p.id = l.prescription_id
+             WHERE p.state IN ('validated', 'partial')
+               AND l.quantity_remaining > 0
+          GROUP BY l.product_id
+        """)
+        return self.env.cr.fetchall()
+
+    def _fetch_incoming(self):
+        """Quantities already on open purchase orders, not yet received,
+        in the product's unit of measure"""
+        # product_qty and qty_received are in the line's (purchase) unit
+        self.env.cr.execute("""
+            SELECT l.product_id, SUM(l.product_uom_qty * (l.product_qty - l.qty_received) / l.product_qty)
+              FROM purchase_order_line l
+              JOIN purchase_order po ON po.id = l.order_id
+             WHERE po.state IN ('draft', 'sent', 'to approve', 'purchase')
+               AND po.picking_type_id = %s
+               AND l.product_qty > l.qty_received
+          GROUP BY l.product_id
+        """, [self.warehouse_id.in_type_id.id])
+        return self.env.cr.fetchall()
+
+    def _fetch_vendors(self, product_ids):
+        """First vendor (by sequence) and its minimum quantity per product"""
+        self.env.cr.execute("""
+            SELECT DISTINCT ON (pp.id) pp.id, si.partner_id, si.min_qty
+              FROM product_product pp
+              JOIN product_supplierinfo si ON si.product_tmpl_id = pp.product_tmpl_id
+             WHERE pp.id = ANY(%s)
+               AND (si.product_id IS NULL OR si.product_id = pp.id)
+               AND (si.company_id IS NULL OR si.company_id = %s)
+               AND (si.date_end IS NULL OR si.date_end >= CURRENT_DATE)
+          ORDER BY pp.id, si.sequence, si.min_qty, si.id
+        """, [product_ids, self.warehouse_id.company_id.id])
+        return self.env.cr.fetchall()
+
+    # ------------------------------------------------------------------
+    # Planning
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _scatter(product_ids, rows):
+        """Sum (product_id, value) rows into an array aligned on product_ids"""
+        result = np.zeros(len(product_ids))
+        if not rows:
+            return result
+        ids, values = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        position = np.searchsorted(product_ids, ids).clip(max=len(product_ids) - 1)
+        known = product_ids[position] == ids
+        np.add.at(result, position[known], np.array(values, dtype=float)[known])
+        return result
+
+    @staticmethod
+    def _fefo_usable(product_ids, velocity, lot_rows):
+        """Stock sellable before expiry per product, aligned on product_ids
+
+        lot_rows are (product, quantity, days to expiry or None), sorted by
+        product and expiry. Sales drain lots first to expire first, so the
+        stock usable after lot n of a product is
+        min(S_n, min_k(cap_k + S_n - S_k)), where S is the running quantity
+        and cap_k the sales possible before lot k expires. Computed for all
+        products at once on segments of the sorted lot arrays.
+        """
+        usable = np.zeros(len(product_ids))
+        if not lot_rows or not len(product_ids):
+            return usable
+        ids, quantities, days = zip(*lot_rows)
+        ids = np.array(ids, dtype=np.int64)
+        position = np.searchsorted(product_ids, ids).clip(max=len(product_ids) - 1)
+        known = product_ids[position] == ids
+        position = position[known]
+        if not len(position):
+            return usable
+        quantities = np.array(quantities, dtype=float)[known]
+        days = np.array(days, dtype=float)[known]
+
+        # Sales possible before each lot expires; lots without expiry never cap
+        no_expiry = np.isnan(days)
+        caps = np.full(len(days), np.inf)
+        caps[~no_expiry] = velocity[position[~no_expiry]] * np.clip(days[~no_expiry], 0, None)
+
+        # Running quantity per product segment
+        starts = np.flatnonzero(np.r_[True, position[1:] != position[:-1]])
+        ends = np.r_[starts[1:], len(position)] - 1
+        total = np.cumsum(quantities)
+        running = total - np.repeat(total[starts] - quantities[starts], ends - starts + 1)
+
+        shortfall = np.minimum(np.minimum.reduceat(caps - running, starts), 0.0)
+        usable[position[starts]] = running[ends] + shortfall
+        return usable
+
+    def _compute_order_quantities(self, product_ids):
+        """Quantity to order per product, aligned on product_ids"""
+        today = fields.Date.context_today(self)
+        velocity = self._scatter(
+            product_ids, self._fetch_sales(fields.Datetime.now() - timedelta(days=self.sales_days))
+        ) / max(self.sales_days, 1)
+
+        usable = self._fefo_usable(product_ids, velocity, self._fetch_lot_stock(today))
+        demand = velocity * (self.lead_days + self.cover_days)
+        if self.include_refills:
+            demand += self._scatter(product_ids, self._fetch_refills())
+        need = demand - usable - self._scatter(product_ids, self._fetch_incoming())
+        return np.ceil(np.clip(need, 0, None) - 1e-6).clip(min=0)
+
+    def action_plan(self):
+        """Create one draft purchase order per vendor"""
+        self.ensure_one()
+        if np is None:
+            raise UserError(_('The reorder planner requires the Python package "numpy".'))
+        for model, fnames in (
+            ('pos.order', ['state', 'date_order']),
+            ('pos.order.line', ['qty', 'product_id']),
+            ('stock.quant', ['quantity', 'location_id', 'lot_id']),
+            ('pharmacy.prescription.line', ['quantity_remaining']),
+            ('purchase.order.line', ['product_qty', 'product_uom_qty', 'qty_received']),
+        ):
+            self.env[model].flush_model(fnames)
+
+        product_ids = self._fetch_products()
+        if not len(product_ids):
+            raise UserError(_('No purchasable storable products found.'))
+        quantities = self._compute_order_quantities(product_ids)
+        to_order = product_ids[quantities > 0]
+
+        vendor_lines = defaultdict(list)
+        vendors = {pid: (partner_id, min_qty) for pid, partner_id, min_qty in self._fetch_vendors(to_order.tolist())}
+        quantity_by_product = dict(zip(to_order.tolist(), quantities[quantities > 0].tolist()))
+        products = self.env['product.product'].browse(list(vendors))
+        for product in products:
+            partner_id, min_qty = vendors[product.id]
+            # Quantities are planned in the stock unit, vendors sell (and set
+            # their minimum) in the purchase unit: order whole purchase units
+            purchase_qty = math.ceil(product.uom_id._compute_quantity(
+                quantity_by_product[product.id], product.uom_po_id, round=False
+            ) - 1e-6)
+            vendor_lines[partner_id].append(Command.create({
+                'product_id': product.id,
+                'product_qty': max(purchase_qty, min_qty or 0.0),
+                'product_uom': product.uom_po_id.id,
+            }))
+
+        orders = self.env['purchase.order'].create([{
+            'partner_id': partner_id,
+            'picking_type_id': self.warehouse_id.in_type_id.id,
+            'company_id': self.warehouse_id.company_id.id,
+            'origin': _('Pharmacy reorder planner'),
+            'order_line': lines,
+        } for partner_id, lines in vendor_lines.items()])
+
+        line_count = sum(len(lines) for lines in vendor_lines.values())
+        _logger.info(
+            "Reorder planner: %s products, %s to order, %s purchase orders",
+            len(product_ids), line_count, len(orders),
+        )
+        self.write({
+            'state': 'done',
+            'product_count': len(product_ids),
+            'line_count': line_count,
+            'no_vendor_count': len(quantity_by_product) - line_count,
+            'purchase_ids': [Command.set(orders.ids)],
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_view_purchases(self):
+        self.ensure_one()
+        return {
+            'name': _('Draft Purchase Orders'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'purchase.order',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', self.purchase_ids.ids)],
+        }